@@ -0,0 +1 @@
+"""Benchmarks for resource-fula-ordboken."""
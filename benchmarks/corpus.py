@@ -0,0 +1,136 @@
+"""Generate synthetic Fula Ordboken exports for benchmarks.
+
+The corpus is deterministic for a given seed and looks like the real export:
+records of '%word_word%' with one or more wordforms followed by '%word_text%'
+with html paragraphs, '<em>' markup, 'Även <em>...</em>' alternates and
+'Jfr <em>...</em>' references to other entries, homographs and html entities.
+"""
+
+import random
+from pathlib import Path
+
+import typer
+
+DEFAULT_SEED = 1
+DEFAULT_ENCODING = "utf-8"
+
+_ONSETS = [*"bdfghjklmprstv", "kn", "sk", "st"]
+_VOWELS = ["a", "e", "i", "o", "u", "y", "å", "ä", "ö"]
+_CODAS = ["", "ck", "g", "ll", "m", "n", "ng", "pp", "r", "s", "t", "tt"]
+_SUFFIXES = ["ar", "ade", "er", "en", "et", "is", "a", "or"]
+_FILLER = [
+    "ha samlag",
+    "nedsättande om",
+    "vardagligt",
+    "om man",
+    "om kvinna",
+    "skämtsamt",
+    "äldre ord",
+    "används även",
+    "ofta i sammansättningar",
+    "&",
+]
+_ENTITIES = {"å": "&aring;", "ä": "&auml;", "ö": "&ouml;", "é": "&eacute;", "&": "&amp;"}
+
+
+def _word(rng: random.Random) -> str:
+    return "".join(
+        rng.choice(_ONSETS) + rng.choice(_VOWELS) + rng.choice(_CODAS)
+        for _ in range(rng.choice((1, 1, 2, 2, 3)))
+    )
+
+
+def _sentence(rng: random.Random) -> str:
+    words = rng.sample(_FILLER, rng.randint(1, 3))
+    return " ".join(words).capitalize() + "."
+
+
+def _escape(text: str, *, letters: bool) -> str:
+    """Escape '&' and, like the raw export does for some entries, the non-ascii letters."""
+    if letters:
+        return "".join(_ENTITIES.get(char, char) for char in text)
+    return text.replace("&", "&amp;")
+
+
+def generate_records(
+    num_entries: int, *, seed: int = DEFAULT_SEED, escape: bool = False
+) -> list[str]:
+    """Generate the records of a synthetic export.
+
+    Args:
+        num_entries (int): number of records
+        seed (int, optional): seed for the random generator. Defaults to 1.
+        escape (bool, optional): escape html entities like the raw export. Defaults to False.
+
+    Returns:
+        list[str]: the records, each ending with a newline, the same with and without
+            `escape` apart from the escaping
+    """
+    rng = random.Random(seed)
+    baseforms: list[str] = []
+    records = []
+    for nr in range(num_entries):
+        if baseforms and rng.random() < 0.05:  # noqa: PLR2004
+            # homograph, sometimes with another case
+            baseform = rng.choice(baseforms[-50:])
+            if rng.random() < 0.3:  # noqa: PLR2004
+                baseform = baseform.capitalize()
+        else:
+            baseform = _word(rng)
+        baseforms.append(baseform)
+        wordforms = [baseform] + [
+            baseform + suffix for suffix in rng.sample(_SUFFIXES, rng.randint(0, 3))
+        ]
+        paragraphs = [_sentence(rng) for _ in range(rng.randint(1, 3))]
+        if rng.random() < 0.4:  # noqa: PLR2004
+            also = ", ".join(_word(rng) for _ in range(rng.randint(1, 2)))
+            paragraphs[0] += f" Även <em>{also}</em>."
+        if rng.random() < 0.5:  # noqa: PLR2004
+            refs = [rng.choice(baseforms) for _ in range(rng.randint(1, 3))]
+            paragraphs[-1] += " Jfr " + ", ".join(f"<em>{ref}</em>" for ref in refs) + "."
+        body = "\n".join(f"<p>{paragraph}</p>" for paragraph in paragraphs)
+        separator = "\n" if rng.random() < 0.2 else ""  # noqa: PLR2004
+        record = f"%word_word%{', '.join(wordforms)}{separator}%word_text%{body}\n"
+        records.append(_escape(record, letters=nr % 2 == 0) if escape else record)
+    return records
+
+
+def write_corpus(
+    path: Path,
+    num_entries: int,
+    *,
+    encoding: str = DEFAULT_ENCODING,
+    seed: int = DEFAULT_SEED,
+    escape: bool = False,
+) -> Path:
+    """Write a synthetic export to path.
+
+    Args:
+        path (Path): the file to write
+        num_entries (int): number of records
+        encoding (str, optional): encoding of the file. Defaults to 'utf-8'.
+        seed (int, optional): seed for the random generator. Defaults to 1.
+        escape (bool, optional): escape html entities like the raw export. Defaults to False.
+
+    Returns:
+        Path: the written path
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding=encoding, newline="") as fp:
+        fp.writelines(generate_records(num_entries, seed=seed, escape=escape))
+    return path
+
+
+def main(
+    path: Path,
+    entries: int = typer.Option(10_000, help="number of entries"),
+    encoding: str = typer.Option(DEFAULT_ENCODING, help="encoding of the file"),
+    seed: int = typer.Option(DEFAULT_SEED, help="seed of the random generator"),
+    raw: bool = typer.Option(False, help="escape html entities like the raw export"),
+) -> None:
+    """Write a synthetic Fula Ordboken export."""
+    write_corpus(path, entries, encoding=encoding, seed=seed, escape=raw)
+
+
+if __name__ == "__main__":
+    typer.run(main)
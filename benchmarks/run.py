@@ -0,0 +1,294 @@
+"""Benchmark the stages of the pipeline on a synthetic corpus.
+
+Every stage runs in a fresh process, so the reported peak RSS belongs to that
+stage alone. Results can be saved as a local baseline, later runs are compared
+against it and regressions are flagged.
+
+    python -m benchmarks.run --entries 10000 --save
+    python -m benchmarks.run --entries 10000 --fail-on-regression
+"""
+
+import multiprocessing
+import platform
+import resource
+import shutil
+import tempfile
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Optional
+
+import json_arrays
+import orjson
+import typer
+
+from benchmarks import corpus
+from resource_fula_ordboken import batch_verifier, find_updates, use_cases
+from resource_fula_ordboken.fula_ord_converter import (
+    FulaOrdTxt2JsonConverter,
+    iter_records,
+    parse_records,
+)
+from resource_fula_ordboken.shared import files, jsonl_sink
+from resource_fula_ordboken.shared.progress import set_progress_factory
+
+BASELINE_DIR = Path(".benchmarks")
+DEFAULT_THRESHOLD = 0.1
+
+
+@dataclass(frozen=True)
+class Corpus:
+    """The input files shared by all stages."""
+
+    num_entries: int
+    raw: Path
+    raw_utf8: Path
+    clean: Path
+    converted: Path
+    baseline: Path
+
+
+@dataclass(frozen=True)
+class StageResult:
+    """Measurements of one run of a stage."""
+
+    stage: str
+    entries: int
+    wall: float
+    cpu: float
+    peak_rss_kib: int
+    rss_growth_kib: int
+
+    @property
+    def entries_per_s(self) -> float:  # noqa: D102
+        return self.entries / self.wall if self.wall else 0.0
+
+
+def prepare_corpus(workdir: Path, num_entries: int, *, encoding: str, seed: int) -> Corpus:
+    """Write the synthetic inputs for all stages to workdir."""
+    raw = corpus.write_corpus(
+        workdir / f"raw.{encoding}.txt", num_entries, encoding=encoding, seed=seed, escape=True
+    )
+    raw_utf8 = corpus.write_corpus(workdir / "raw.txt", num_entries, seed=seed, escape=True)
+    clean = corpus.write_corpus(workdir / "clean.txt", num_entries, seed=seed)
+
+    converter = FulaOrdTxt2JsonConverter()
+    with clean.open(encoding="utf-8") as fp:
+        entries = [
+            entry.model_dump() for entry in converter.update_jfr(converter.convert_entry(fp))
+        ]
+    converted = workdir / "fula-ordboken.jsonl.gz"
+    jsonl_sink.dump_to_file(entries, converted)
+
+    # a baseline where a few entries have been changed since, or are not exported yet
+    baseline = workdir / "baseline.jsonl.gz"
+    json_arrays.dump_to_file(
+        (
+            {
+                "id": f"01HZ{nr:022}",
+                "version": 1,
+                "resource": "fulaord",
+                "entry": entry | {"text": "<p>Ändrad.</p>"} if nr % 31 == 0 else entry,
+            }
+            for nr, entry in enumerate(entries)
+            if nr % 47 != 0
+        ),
+        baseline,
+    )
+    return Corpus(num_entries, raw, raw_utf8, clean, converted, baseline)
+
+
+def stage_detect_encoding(data: Corpus, _tmp: Path) -> Callable[[], int]:  # noqa: D103
+    def run() -> int:
+        files.detect_encoding(data.raw)
+        return data.num_entries
+
+    return run
+
+
+def stage_unescape_file(data: Corpus, tmp: Path) -> Callable[[], int]:  # noqa: D103
+    path = tmp / "raw.txt"
+    shutil.copy(data.raw_utf8, path)
+
+    def run() -> int:
+        files.unescape_file(path)
+        return data.num_entries
+
+    return run
+
+
+def stage_parse_records(data: Corpus, _tmp: Path) -> Callable[[], int]:  # noqa: D103
+    with data.clean.open(encoding="utf-8") as fp:
+        records = list(iter_records(fp))
+    return lambda: len(parse_records(records))
+
+
+def stage_convert_entry(data: Corpus, _tmp: Path) -> Callable[[], int]:  # noqa: D103
+    def run() -> int:
+        with data.clean.open(encoding="utf-8") as fp:
+            return sum(1 for _ in FulaOrdTxt2JsonConverter().convert_entry(fp))
+
+    return run
+
+
+def stage_update_jfr(data: Corpus, _tmp: Path) -> Callable[[], int]:  # noqa: D103
+    converter = FulaOrdTxt2JsonConverter()
+    with data.clean.open(encoding="utf-8") as fp:
+        entries = list(converter.convert_entry(fp))
+    return lambda: sum(1 for _ in converter.update_jfr(entries))
+
+
+def stage_find_updates_from_export(data: Corpus, _tmp: Path) -> Callable[[], int]:  # noqa: D103
+    def run() -> int:
+        find_updates.find_updates_from_export(data.converted, data.baseline, msg="benchmark")
+        return data.num_entries
+
+    return run
+
+
+def stage_verify_batch(data: Corpus, tmp: Path) -> Callable[[], int]:  # noqa: D103
+    batch = tmp / "batch.jsonl.gz"
+    use_cases.create_karp_batch_from_export(
+        data.converted, baseline=data.baseline, output_path=batch, msg="benchmark"
+    )
+
+    def run() -> int:
+        verification = batch_verifier.verify_batch(
+            batch, current=data.converted, baseline=data.baseline
+        )
+        if not verification.ok:
+            raise RuntimeError(verification.problems)
+        return data.num_entries
+
+    return run
+
+
+def stage_package_saf(data: Corpus, tmp: Path) -> Callable[[], int]:  # noqa: D103
+    def run() -> int:
+        use_cases.package_file_as_simple_archive(
+            data.converted,
+            title="benchmark",
+            date_issued="2024-01-01",
+            output_path=tmp / "benchmark.saf.zip",
+            workdir=tmp / "work",
+        )
+        return data.num_entries
+
+    return run
+
+
+STAGES: dict[str, Callable[[Corpus, Path], Callable[[], int]]] = {
+    "detect_encoding": stage_detect_encoding,
+    "unescape_file": stage_unescape_file,
+    "parse_records": stage_parse_records,
+    "convert_entry": stage_convert_entry,
+    "update_jfr": stage_update_jfr,
+    "find_updates_from_export": stage_find_updates_from_export,
+    "verify_batch": stage_verify_batch,
+    "package_saf": stage_package_saf,
+}
+
+
+def _max_rss_kib() -> int:
+    # ru_maxrss is in KiB on Linux but in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss // 1024 if platform.system() == "Darwin" else max_rss
+
+
+def run_stage(name: str, data: Corpus) -> StageResult:
+    """Set up and time one stage in the current process."""
+    set_progress_factory(None)
+    with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as tmp:
+        rss_before = _max_rss_kib()
+        run = STAGES[name](data, Path(tmp))
+        start_cpu = time.process_time()
+        start = time.perf_counter()
+        entries = run()
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - start_cpu
+        peak_rss = _max_rss_kib()
+    return StageResult(name, entries, wall, cpu, peak_rss, peak_rss - rss_before)
+
+
+def run_isolated(name: str, data: Corpus, *, repeat: int = 1) -> StageResult:
+    """Run a stage `repeat` times, each in a fresh process, and keep the fastest run."""
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for _ in range(repeat):
+        with ProcessPoolExecutor(1, mp_context=ctx) as pool:
+            results.append(pool.submit(run_stage, name, data).result())
+    return min(results, key=lambda result: result.wall)
+
+
+def baseline_path(num_entries: int, encoding: str) -> Path:
+    """Return where the local baseline for a corpus is stored."""
+    return BASELINE_DIR / f"baseline-{num_entries}-{encoding}.json"
+
+
+def compare(
+    results: list[StageResult], baseline: dict[str, Any], *, threshold: float
+) -> list[str]:
+    """Return the stages that are slower than the baseline by more than threshold."""
+    return [
+        result.stage
+        for result in results
+        if result.stage in baseline
+        and result.entries_per_s < baseline[result.stage]["entries_per_s"] * (1 - threshold)
+    ]
+
+
+def main(
+    entries: int = typer.Option(10_000, help="number of entries in the corpus"),
+    encoding: str = typer.Option("latin-1", help="encoding of the raw export"),
+    seed: int = typer.Option(corpus.DEFAULT_SEED, help="seed of the corpus generator"),
+    stage: Optional[list[str]] = typer.Option(None, help="stages to run, defaults to all"),  # noqa: UP007
+    repeat: int = typer.Option(3, help="runs per stage, the fastest is reported"),
+    save: bool = typer.Option(False, help="save the results as the local baseline"),
+    threshold: float = typer.Option(DEFAULT_THRESHOLD, help="slowdown flagged as regression"),
+    fail_on_regression: bool = typer.Option(False, help="exit with 1 on regressions"),
+    workdir: Optional[Path] = typer.Option(None, help="where to write the corpus"),  # noqa: UP007
+) -> None:
+    """Benchmark the pipeline stages and compare them with the local baseline."""
+    stages = stage or list(STAGES)
+    if unknown := set(stages) - STAGES.keys():
+        raise typer.BadParameter(f"unknown stages: {', '.join(sorted(unknown))}")
+    with tempfile.TemporaryDirectory(prefix="bench-corpus-") as tmp:
+        corpus_dir = workdir or Path(tmp)
+        typer.echo(f"preparing corpus of {entries} entries in '{corpus_dir}' ...")
+        data = prepare_corpus(corpus_dir, entries, encoding=encoding, seed=seed)
+        results = [run_isolated(name, data, repeat=repeat) for name in stages]
+
+    path = baseline_path(entries, encoding)
+    baseline = orjson.loads(path.read_bytes()) if path.exists() else {}
+    typer.echo(
+        f"{'stage':<26}{'entries/s':>12}{'wall s':>9}{'cpu s':>9}{'peak MiB':>10}{'vs base':>9}"
+    )
+    for result in results:
+        change = ""
+        if base := baseline.get(result.stage):
+            change = f"{result.entries_per_s / base['entries_per_s'] - 1:+.1%}"
+        typer.echo(
+            f"{result.stage:<26}{result.entries_per_s:>12.0f}{result.wall:>9.3f}"
+            f"{result.cpu:>9.3f}{result.peak_rss_kib / 1024:>10.1f}{change:>9}"
+        )
+    regressions = compare(results, baseline, threshold=threshold)
+    if regressions:
+        typer.echo(f"regressions (> {threshold:.0%} slower): {', '.join(regressions)}")
+    if save:
+        baseline.update(
+            {
+                result.stage: asdict(result) | {"entries_per_s": result.entries_per_s}
+                for result in results
+            }
+        )
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(orjson.dumps(baseline, option=orjson.OPT_INDENT_2))
+        typer.echo(f"saved baseline to '{path}'")
+    if regressions and fail_on_regression:
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,77 @@
+"""Benchmark how long the CLI takes to start.
+
+Every command runs in a fresh interpreter and the fastest run is reported,
+next to a bare interpreter and `import typer` as the floor the CLI can't beat.
+The slowest modules imported by the CLI are listed from `-X importtime`.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --target-ms 200 --fail-over-target
+"""
+
+import subprocess
+import sys
+import time
+
+import typer
+
+COMMANDS: dict[str, list[str]] = {
+    "python": ["-c", "pass"],
+    "import typer": ["-c", "import typer"],
+    "import cli": ["-c", "import resource_fula_ordboken.cli"],
+    "cli --help": ["-m", "resource_fula_ordboken.cli", "--help"],
+}
+DEFAULT_TARGET_MS = 200.0
+
+
+def time_command(args: list[str], *, repeat: int) -> float:
+    """Run python with args `repeat` times and return the fastest wall time in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], check=True, capture_output=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def slowest_imports(module: str, *, top: int) -> list[tuple[float, str]]:
+    """Return the modules with the largest cumulative import time, in ms."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        _, sep, fields = line.partition("import time:")
+        _self_us, cumulative_us, name = fields.split("|") if sep else ("", "", "")
+        if cumulative_us.strip().isdigit():
+            imports.append((int(cumulative_us) / 1000, name.rstrip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main(
+    repeat: int = typer.Option(9, help="runs per command, the fastest is reported"),
+    top: int = typer.Option(15, help="number of slowest imports to list"),
+    target_ms: float = typer.Option(DEFAULT_TARGET_MS, help="target for 'cli --help'"),
+    fail_over_target: bool = typer.Option(False, help="exit with 1 if over the target"),
+) -> None:
+    """Time the startup of the CLI and list its slowest imports."""
+    results = {name: time_command(args, repeat=repeat) * 1000 for name, args in COMMANDS.items()}
+    typer.echo(f"{'command':<16}{'ms':>8}")
+    for name, ms in results.items():
+        typer.echo(f"{name:<16}{ms:>8.1f}")
+    typer.echo("\nslowest imports of resource_fula_ordboken.cli (cumulative ms):")
+    for ms, name in slowest_imports("resource_fula_ordboken.cli", top=top):
+        typer.echo(f"{ms:>8.1f}  {name}")
+    help_ms = results["cli --help"]
+    if help_ms > target_ms:
+        typer.echo(
+            f"\n'cli --help' took {help_ms:.1f} ms, over the target of {target_ms:.0f} ms"
+        )
+        if fail_over_target:
+            raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,255 @@
+"""Persistent content-hash index of a Karp baseline export."""
+
+import hashlib
+import itertools
+import sqlite3
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import json_arrays
+import orjson
+
+from resource_fula_ordboken.models import FulaOrdExportRecord
+from resource_fula_ordboken.shared import files
+from resource_fula_ordboken.shared.progress import progress
+from resource_fula_ordboken.validation import Validator
+
+INDEX_FORMAT = "1"
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE entries (
+    entry_id TEXT PRIMARY KEY,
+    entity_id TEXT NOT NULL,
+    version INTEGER,
+    resource TEXT,
+    hash TEXT NOT NULL
+);
+"""
+
+
+class IndexedEntry(NamedTuple):
+    """What the index knows about an entry in the baseline."""
+
+    entity_id: str
+    version: int | None
+    resource: str | None
+    hash: str
+
+
+def canonical_hash(entry: dict[str, Any]) -> str:
+    """Hash the content of an entry.
+
+    Fields set to None are ignored and keys are sorted, so the hash is the same
+    for an entry from a Karp export and for the same entry from `clean2karp`.
+
+    Args:
+        entry (dict[str, Any]): the entry to hash
+
+    Returns:
+        str: the hex digest
+    """
+    canonical = {field: value for field, value in entry.items() if value is not None}
+    return hashlib.sha256(orjson.dumps(canonical, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def default_index_path(baseline: Path) -> Path:
+    """Return the sidecar path of the index for a baseline."""
+    return baseline.with_name(f"{baseline.name}.index.sqlite")
+
+
+class BaselineIndex:
+    """Map entry id to (entity id, version, resource, content hash) of a baseline.
+
+    The index is stored in a SQLite file next to the baseline and records the
+    size, mtime and digest of the baseline it was built from.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, baseline: Path) -> None:
+        """Use an open index, see `BaselineIndex.open` and `BaselineIndex.build`."""
+        self.conn = conn
+        self.baseline = baseline
+
+    @classmethod
+    def build(
+        cls,
+        baseline: Path,
+        index_path: Path | None = None,
+        *,
+        validator: Validator | None = None,
+    ) -> "BaselineIndex":
+        """Build (or rebuild) the index for a baseline.
+
+        Args:
+            baseline (Path): the Karp export
+            index_path (Path | None, optional): where to write the index. Defaults to a sidecar.
+            validator (Validator | None, optional): which rows to validate. Defaults to all.
+
+        Returns:
+            BaselineIndex: the new index
+        """
+        index_path = index_path or default_index_path(baseline)
+        validator = validator or Validator()
+        tmp_path = index_path.with_name(f"{index_path.name}.swp")
+        tmp_path.unlink(missing_ok=True)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.executescript(_SCHEMA)
+            conn.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (
+                    (
+                        record.entry["id"],
+                        record.id,
+                        record.version,
+                        record.resource,
+                        canonical_hash(record.entry),
+                    )
+                    for record in (
+                        FulaOrdExportRecord.from_export(
+                            obj, validate=validator.should_validate()
+                        )
+                        for obj in progress(
+                            json_arrays.load_from_file(baseline), desc="Indexing baseline"
+                        )
+                    )
+                ),
+            )
+            stat = baseline.stat()
+            conn.executemany(
+                "INSERT INTO meta VALUES (?, ?)",
+                [
+                    ("format", INDEX_FORMAT),
+                    ("size", str(stat.st_size)),
+                    ("mtime_ns", str(stat.st_mtime_ns)),
+                    ("digest", files.file_digest(baseline)),
+                ],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        tmp_path.replace(index_path)
+        return cls(sqlite3.connect(index_path), baseline)
+
+    @classmethod
+    def open(cls, baseline: Path, index_path: Path | None = None) -> "BaselineIndex":
+        """Open an existing index for a baseline.
+
+        Args:
+            baseline (Path): the Karp export the index was built from
+            index_path (Path | None, optional): the index file. Defaults to the sidecar.
+
+        Returns:
+            BaselineIndex: the index
+
+        Raises:
+            ValueError: if the index is missing or stale
+        """
+        index_path = index_path or default_index_path(baseline)
+        if not index_path.exists():
+            raise ValueError(
+                f"no index found at '{index_path}', build it with 'index-baseline {baseline}'"
+            )
+        index = cls(sqlite3.connect(index_path), baseline)
+        if index.is_stale():
+            index.close()
+            raise ValueError(
+                f"the index '{index_path}' is stale, rebuild it with 'index-baseline {baseline}'"
+            )
+        return index
+
+    def close(self) -> None:
+        """Close the index."""
+        self.conn.close()
+
+    def __enter__(self) -> "BaselineIndex":  # noqa: D105
+        return self
+
+    def __exit__(self, *_exc: object) -> None:  # noqa: D105
+        self.close()
+
+    def meta(self) -> dict[str, str]:
+        """Return the recorded metadata of the index."""
+        return dict(self.conn.execute("SELECT key, value FROM meta"))
+
+    def is_stale(self) -> bool:
+        """Check if the baseline has changed since the index was built.
+
+        The digest is only computed when the size matches but the mtime has changed.
+        """
+        meta = self.meta()
+        if meta.get("format") != INDEX_FORMAT:
+            return True
+        stat = self.baseline.stat()
+        if str(stat.st_size) != meta.get("size"):
+            return True
+        if str(stat.st_mtime_ns) == meta.get("mtime_ns"):
+            return False
+        if files.file_digest(self.baseline) != meta.get("digest"):
+            return True
+        self.conn.execute(
+            "UPDATE meta SET value = ? WHERE key = 'mtime_ns'", (str(stat.st_mtime_ns),)
+        )
+        self.conn.commit()
+        return False
+
+    def __len__(self) -> int:  # noqa: D105
+        return self.conn.execute("SELECT count(*) FROM entries").fetchone()[0]
+
+    def get(self, entry_id: str) -> IndexedEntry | None:
+        """Look up an entry id in the baseline."""
+        row = self.conn.execute(
+            "SELECT entity_id, version, resource, hash FROM entries WHERE entry_id = ?",
+            (entry_id,),
+        ).fetchone()
+        return IndexedEntry(*row) if row else None
+
+    def iter_entries(self) -> Iterator[tuple[str, IndexedEntry]]:
+        """Yield the entry id and what is indexed of every entry in the baseline."""
+        for entry_id, *row in self.conn.execute(
+            "SELECT entry_id, entity_id, version, resource, hash FROM entries"
+        ):
+            yield entry_id, IndexedEntry(*row)
+
+    def reset_seen(self) -> None:
+        """Start tracking which entries are present in the current export."""
+        self.conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS seen (entry_id TEXT PRIMARY KEY, changed BLOB)"
+        )
+        self.conn.execute("DELETE FROM seen")
+
+    def mark_seen(self, entry_id: str, changed: dict[str, Any] | None = None) -> None:
+        """Record that an entry id is present in the current export.
+
+        The current entry is kept if it differs from the baseline. Marking an id
+        again replaces what was kept for it, so the last of duplicated ids wins
+        like when the entries are loaded in a dict.
+        """
+        self.conn.execute(
+            "INSERT INTO seen VALUES (?, ?)"
+            " ON CONFLICT (entry_id) DO UPDATE SET changed = excluded.changed",
+            (entry_id, orjson.dumps(changed) if changed is not None else None),
+        )
+
+    def iter_changed(self) -> Iterator[tuple[dict[str, Any], IndexedEntry | None]]:
+        """Yield the kept current entries in the order their ids were first seen.
+
+        Each comes with what is indexed of it, None if it is not in the baseline.
+        """
+        for changed, *row in self.conn.execute(
+            "SELECT changed, entity_id, version, resource, hash FROM seen"
+            " LEFT JOIN entries USING (entry_id)"
+            " WHERE changed IS NOT NULL ORDER BY seen.rowid"
+        ):
+            yield orjson.loads(changed), IndexedEntry(*row) if row[0] is not None else None
+
+    def iter_unseen(self) -> Iterator[IndexedEntry]:
+        """Yield the baseline entries that have not been marked as seen, by entry id."""
+        yield from itertools.starmap(
+            IndexedEntry,
+            self.conn.execute(
+                "SELECT entity_id, version, resource, hash FROM entries"
+                " WHERE entry_id NOT IN (SELECT entry_id FROM seen) ORDER BY entry_id"
+            ),
+        )
@@ -0,0 +1,142 @@
+"""Load a Karp baseline export with the decoding spread over worker processes.
+
+One thread reads and decompresses the export into batches of lines, the
+batches are parsed with orjson and turned into `FulaOrdExportRecord`s by a
+pool of worker processes, and the records are yielded batch by batch in the
+order of the export.
+"""
+
+import contextlib
+import gzip
+import queue
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+from typing import IO, TypeVar
+
+import json_arrays
+import orjson
+
+from resource_fula_ordboken.models import FulaOrdExportRecord
+from resource_fula_ordboken.shared import parallel
+from resource_fula_ordboken.validation import Validator
+
+DEFAULT_BATCH_SIZE = 2000
+_READ_AHEAD = 8
+
+T = TypeVar("T")
+
+
+def decode_batch(batch: tuple[list[bytes], list[bool]]) -> list[FulaOrdExportRecord]:
+    """Parse and (optionally) validate a batch of exported lines.
+
+    Args:
+        batch (tuple[list[bytes], list[bool]]): the lines and whether to validate each of them
+
+    Returns:
+        list[FulaOrdExportRecord]: the records in the order of the lines
+    """
+    lines, validate = batch
+    return [
+        FulaOrdExportRecord.from_export(orjson.loads(line), validate=should_validate)
+        for line, should_validate in zip(lines, validate, strict=True)
+    ]
+
+
+def iter_line_batches(path: Path, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[list[bytes]]:
+    """Yield the non-empty lines of a (gzipped) jsonl file in batches."""
+    with _open(path) as fp:
+        batch: list[bytes] = []
+        for line in fp:
+            if line.strip():
+                batch.append(line)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+
+def iter_baseline_batches(
+    baseline: Path,
+    *,
+    jobs: int = 1,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    validator: Validator | None = None,
+) -> Iterator[list[FulaOrdExportRecord]]:
+    """Yield the records of a baseline export in batches, in the order of the export.
+
+    Which records to validate is decided in order in the calling process, so the
+    same records are validated regardless of `jobs`. Exports that are not jsonl
+    are loaded with `json_arrays` and decoded in this process.
+
+    Args:
+        baseline (Path): the entries exported from karp
+        jobs (int, optional): number of processes decoding the lines. Defaults to 1.
+        batch_size (int, optional): lines per batch. Defaults to 2000.
+        validator (Validator | None, optional): which rows to validate. Defaults to all.
+
+    Yields:
+        list[FulaOrdExportRecord]: the next batch of records
+    """
+    validator = validator or Validator()
+    if ".jsonl" not in baseline.suffixes:
+        for objs in parallel.chunked(json_arrays.load_from_file(baseline), batch_size):
+            yield [
+                FulaOrdExportRecord.from_export(obj, validate=validator.should_validate())
+                for obj in objs
+            ]
+        return
+    batches = (
+        (lines, [validator.should_validate() for _ in lines])
+        for lines in _read_ahead(iter_line_batches(baseline, batch_size))
+    )
+    if jobs <= 1:
+        yield from map(decode_batch, batches)
+    else:
+        yield from parallel.ordered_map(decode_batch, batches, jobs=jobs)
+
+
+def _open(path: Path) -> IO[bytes]:
+    if path.suffix == ".gz":
+        return gzip.GzipFile(path, "rb")  # type: ignore[return-value]
+    return path.open("rb")
+
+
+def _read_ahead(items: Iterator[T], maxsize: int = _READ_AHEAD) -> Iterator[T]:
+    """Consume an iterator in a background thread, keeping up to `maxsize` items ready."""
+    ready: queue.Queue[tuple[bool, T | BaseException | None]] = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                ready.put((True, item))
+            ready.put((False, None))
+        except BaseException as exc:
+            ready.put((False, exc))
+
+    thread = threading.Thread(target=produce, name="baseline-reader", daemon=True)
+    thread.start()
+    try:
+        while True:
+            has_item, item = ready.get()
+            if not has_item:
+                if isinstance(item, BaseException):
+                    raise item
+                return
+            yield item  # type: ignore[misc]
+    finally:
+        stop.set()
+        # unblock the reader if it is waiting on a full queue
+        while thread.is_alive():
+            _drain(ready)
+            thread.join(0.01)
+
+
+def _drain(ready: queue.Queue) -> None:
+    with contextlib.suppress(queue.Empty):
+        while True:
+            ready.get_nowait()
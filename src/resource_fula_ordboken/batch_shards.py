@@ -0,0 +1,223 @@
+"""Write a Karp batch as shards that can be ingested in parallel.
+
+The commands are split over several jsonl files, and all commands for one entry
+id end up in the same shard. A manifest next to the shards lists, for every
+shard, its file name, number of commands per command type, size and sha256, so
+a loader can ingest the shards in parallel and retry a single failed shard.
+
+With a fixed number of shards, a command goes to the shard given by the crc32 of
+its entry id. With limits on commands or bytes per shard, the shards are filled
+one after another and a new shard is started when the current one is full.
+"""
+
+import datetime
+import zlib
+from collections import Counter
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from pathlib import Path
+from types import TracebackType
+from typing import Any
+
+import orjson
+
+import resource_fula_ordboken
+from resource_fula_ordboken.shared import files, jsonl_sink
+
+MANIFEST_FORMAT = "1"
+
+
+@dataclass(frozen=True)
+class Sharding:
+    """How to split a batch, either in `num_shards` or by limits per shard."""
+
+    num_shards: int | None = None
+    max_commands: int | None = None
+    max_bytes: int | None = None
+
+    def __post_init__(self) -> None:
+        """Check that exactly one way of splitting is given."""
+        limits = self.max_commands is not None or self.max_bytes is not None
+        if (self.num_shards is None) == (not limits):
+            raise ValueError("give either num_shards or max_commands and/or max_bytes")
+        for name in ("num_shards", "max_commands", "max_bytes"):
+            value = getattr(self, name)
+            if value is not None and value < 1:
+                raise ValueError(f"{name} must be positive, got {value}")
+
+
+def shard_path(output_path: Path, nr: int) -> Path:
+    """Name shard `nr` of a batch after its output path.
+
+    >>> shard_path(Path('out/fula-ordboken-batch.jsonl.gz'), 3)
+    PosixPath('out/fula-ordboken-batch.00003.jsonl.gz')
+    """
+    stem = files.real_stem(output_path.name)
+    return output_path.with_name(f"{stem}.{nr:05d}{output_path.name[len(stem) :]}")
+
+
+def manifest_path(output_path: Path) -> Path:
+    """Name the manifest of a sharded batch after its output path.
+
+    >>> manifest_path(Path('out/fula-ordboken-batch.jsonl.gz'))
+    PosixPath('out/fula-ordboken-batch.manifest.json')
+    """
+    return output_path.with_name(f"{files.real_stem(output_path.name)}.manifest.json")
+
+
+class _Shard:
+    def __init__(self, path: Path, sink: jsonl_sink.JsonlSink) -> None:
+        self.path = path
+        self.sink = sink
+        self.cmdtypes: Counter[str] = Counter()
+        self.commands = 0
+
+    def write(self, cmd: dict[str, Any]) -> None:
+        self.sink.write(cmd)
+        self.cmdtypes[cmd.get("cmdtype", "")] += 1
+        self.commands += 1
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "path": self.path.name,
+            "commands": self.commands,
+            "cmdtypes": dict(self.cmdtypes),
+            "bytes": self.sink.bytes_out,
+            "uncompressed_bytes": self.sink.bytes_in,
+            "sha256": self.sink.sha256,
+        }
+
+
+class ShardedBatchWriter:
+    """Write serialized commands to shards and finish with a manifest."""
+
+    def __init__(
+        self,
+        output_path: Path,
+        sharding: Sharding,
+        *,
+        compresslevel: int = jsonl_sink.DEFAULT_COMPRESSLEVEL,
+        block_size: int | None = None,
+        default: Callable[[Any], Any] | None = None,
+    ) -> None:
+        """Start writing the shards of the batch at output_path.
+
+        Args:
+            output_path (Path): the batch, the shards and the manifest are named after it
+            sharding (Sharding): how to split the commands
+            compresslevel (int, optional): gzip compression level. Defaults to 6.
+            block_size (int | None, optional): write gzip members of this size. Defaults to one member.
+            default (Callable[[Any], Any] | None, optional): convert objects orjson can't serialize. Defaults to None.
+        """  # noqa: E501
+        self.output_path = output_path
+        self.sharding = sharding
+        self._sink_options: dict[str, Any] = {
+            "compresslevel": compresslevel,
+            "block_size": block_size,
+            "default": default,
+        }
+        self.shards: list[_Shard] = []
+        # the shard of every entry id seen when filling shards one after another
+        self._shard_of_id: dict[str, int] = {}
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        if sharding.num_shards is not None:
+            for _ in range(sharding.num_shards):
+                self._open_shard()
+        self.manifest: dict[str, Any] | None = None
+
+    def _open_shard(self) -> _Shard:
+        path = shard_path(self.output_path, len(self.shards))
+        shard = _Shard(path, jsonl_sink.JsonlSink(path, **self._sink_options))
+        self.shards.append(shard)
+        return shard
+
+    def _is_full(self, shard: _Shard) -> bool:
+        max_commands, max_bytes = self.sharding.max_commands, self.sharding.max_bytes
+        return (max_commands is not None and shard.commands >= max_commands) or (
+            max_bytes is not None and shard.sink.size >= max_bytes
+        )
+
+    def write(self, cmd: dict[str, Any]) -> None:
+        """Write a serialized command to the shard of its entry id.
+
+        Raises:
+            ValueError: if the shard of an earlier command for the same entry is full.
+        """
+        entry_id = str(cmd["id"])
+        if self.sharding.num_shards is not None:
+            self.shards[zlib.crc32(entry_id.encode()) % self.sharding.num_shards].write(cmd)
+            return
+        nr = self._shard_of_id.get(entry_id)
+        if nr is None:
+            if not self.shards or self._is_full(self.shards[-1]):
+                if self.shards:
+                    self.shards[-1].sink.close()
+                self._open_shard()
+            nr = self._shard_of_id[entry_id] = len(self.shards) - 1
+        elif nr != len(self.shards) - 1:
+            raise ValueError(
+                f"commands for '{entry_id}' would be split over shards {nr} and {len(self.shards) - 1}"  # noqa: E501
+            )
+        self.shards[nr].write(cmd)
+
+    def write_all(self, cmds: Iterable[dict[str, Any]]) -> None:
+        """Write all serialized commands."""
+        for cmd in cmds:
+            self.write(cmd)
+
+    def close(self) -> dict[str, Any]:
+        """Close the shards and write the manifest.
+
+        Returns:
+            dict[str, Any]: the manifest
+        """
+        if self.manifest is not None:
+            return self.manifest
+        self._close_shards()
+        shards = [shard.to_dict() for shard in self.shards]
+        self.manifest = {
+            "format": MANIFEST_FORMAT,
+            "version": resource_fula_ordboken.__version__,
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "commands": sum(shard["commands"] for shard in shards),
+            "bytes": sum(shard["bytes"] for shard in shards),
+            "shards": shards,
+        }
+        manifest_path(self.output_path).write_bytes(
+            orjson.dumps(self.manifest, option=orjson.OPT_INDENT_2)
+        )
+        return self.manifest
+
+    def __enter__(self) -> "ShardedBatchWriter":  # noqa: D105
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Close the shards, the manifest is only written if no error occurred."""
+        if exc_type is None:
+            self.close()
+            return
+        self._close_shards()
+
+    def _close_shards(self) -> None:
+        """Close every shard, then raise the first error if any of them failed."""
+        errors = [error for shard in self.shards if (error := _close(shard.sink)) is not None]
+        if errors:
+            raise errors[0]
+
+
+def _close(sink: jsonl_sink.JsonlSink) -> Exception | None:
+    try:
+        sink.close()
+    except Exception as exc:
+        return exc
+    return None
+
+
+def load_manifest(output_path: Path) -> dict[str, Any]:
+    """Read the manifest of the sharded batch at output_path."""
+    return orjson.loads(manifest_path(output_path).read_bytes())
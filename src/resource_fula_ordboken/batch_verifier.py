@@ -0,0 +1,235 @@
+"""Check a Karp batch by replaying it on the baseline.
+
+The baseline is loaded as the entity id, version, entry id and content hash of
+every entry, the commands of the batch are applied to it like Karp applies
+them, and the result is compared with the converted entries the batch was made
+from. Only content hashes are kept and compared, see
+`baseline_index.canonical_hash`, and with a `MemoryBudget` the state moves to
+disk when it outgrows it. No entry is validated, so a batch of a large lexicon
+is checked in seconds.
+
+    verification = verify_batch(batch, current=current, baseline=baseline)
+    for problem in verification.problems:
+        print(problem)
+"""
+
+from collections import Counter
+from collections.abc import Iterable, Iterator, MutableMapping
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import json_arrays
+import orjson
+
+from resource_fula_ordboken import baseline_loader, batch_shards
+from resource_fula_ordboken.baseline_index import BaselineIndex, canonical_hash
+from resource_fula_ordboken.shared import files
+from resource_fula_ordboken.shared.memory_budget import MemoryBudget, SpillDict
+
+# only the first problems are kept, a bad diff may break every entry
+MAX_PROBLEMS = 100
+
+
+@dataclass
+class Verification:
+    """What replaying a batch found."""
+
+    commands: Counter[str] = field(default_factory=Counter)
+    entries: int = 0
+    num_problems: int = 0
+    problems: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        """Whether the batch turns the baseline into the current entries."""
+        return self.num_problems == 0
+
+    def add_problem(self, problem: str) -> None:
+        """Record a problem, only the first `MAX_PROBLEMS` are kept."""
+        self.num_problems += 1
+        if len(self.problems) < MAX_PROBLEMS:
+            self.problems.append(problem)
+
+
+def _pack(version: int | None, content_hash: str, entry_id: str) -> str:
+    # a spilled dict keeps str values, the entry id goes last since it is free text
+    return f"{'' if version is None else version}\t{content_hash}\t{entry_id}"
+
+
+def _unpack(packed: str) -> tuple[int | None, str, str]:
+    version, content_hash, entry_id = packed.split("\t", 2)
+    return (int(version) if version else None), content_hash, entry_id
+
+
+class BatchReplay:
+    """The entries of a baseline, changed by the commands of a batch."""
+
+    def __init__(self, budget: MemoryBudget | None = None) -> None:
+        """Start from an empty baseline, moving the entries to disk if budget is exceeded."""
+        self.budget = budget
+        # the packed version, content hash and entry id of every entity id
+        self.entities: MutableMapping[str, str] = (
+            SpillDict(budget, "replayed entries") if budget else {}
+        )
+        self.verification = Verification()
+
+    def load_baseline(self, objs: Iterable[dict[str, Any]]) -> None:
+        """Add the entries of a Karp export."""
+        for obj in objs:
+            entry = obj["entry"]
+            self.entities[str(obj["id"])] = _pack(
+                obj.get("version"), canonical_hash(entry), entry["id"]
+            )
+
+    def load_index(self, index: BaselineIndex) -> None:
+        """Add the entries of a baseline from its index, without reading the baseline."""
+        for entry_id, indexed in index.iter_entries():
+            self.entities[indexed.entity_id] = _pack(indexed.version, indexed.hash, entry_id)
+
+    def apply(self, cmd: dict[str, Any]) -> None:
+        """Apply a serialized command, recording why if Karp would reject it."""
+        cmdtype = cmd.get("cmdtype", "")
+        self.verification.commands[cmdtype] += 1
+        entity_id = str(cmd.get("id"))
+        if cmdtype == "add_entry":
+            if entity_id in self.entities:
+                self.verification.add_problem(f"add_entry of '{entity_id}', which exists")
+            else:
+                entry = cmd["entry"]
+                self.entities[entity_id] = _pack(1, canonical_hash(entry), entry["id"])
+            return
+        if cmdtype not in {"update_entry", "delete_entry"}:
+            self.verification.add_problem(f"unknown command '{cmdtype}' for '{entity_id}'")
+            return
+        packed = self.entities.get(entity_id)
+        if packed is None:
+            self.verification.add_problem(f"{cmdtype} of '{entity_id}', which doesn't exist")
+            return
+        version, content_hash, entry_id = _unpack(packed)
+        if cmd.get("version") != version:
+            self.verification.add_problem(
+                f"{cmdtype} of '{entity_id}' ({entry_id}) is for version"
+                f" {cmd.get('version')}, but it is at version {version}"
+            )
+            return
+        if cmdtype == "delete_entry":
+            del self.entities[entity_id]
+            return
+        entry = cmd["entry"]
+        new_hash = canonical_hash(entry)
+        if new_hash == content_hash:
+            self.verification.add_problem(
+                f"update_entry of '{entity_id}' ({entry_id}) doesn't change it"
+            )
+        self.entities[entity_id] = _pack(
+            None if version is None else version + 1, new_hash, entry["id"]
+        )
+
+    def apply_all(self, cmds: Iterable[dict[str, Any]]) -> int:
+        """Apply serialized commands.
+
+        Returns:
+            int: the number of commands applied
+        """
+        count = 0
+        for cmd in cmds:
+            self.apply(cmd)
+            count += 1
+        return count
+
+    def compare(self, current: Iterable[dict[str, Any]]) -> Verification:
+        """Compare the replayed entries with the current entries, by entry id."""
+        verification = self.verification
+        # the content hash of every replayed entry id
+        result: MutableMapping[str, str] = (
+            SpillDict(self.budget, "replayed entry ids") if self.budget else {}
+        )
+        for entity_id, packed in self.entities.items():
+            _, content_hash, entry_id = _unpack(packed)
+            if entry_id in result:
+                verification.add_problem(
+                    f"'{entry_id}' is the entry of more than one entity, one is '{entity_id}'"
+                )
+            result[entry_id] = content_hash
+        verification.entries = len(result)
+        for entry in current:
+            expected = result.pop(entry["id"], None)
+            if expected is None:
+                verification.add_problem(f"'{entry['id']}' is missing after the batch")
+            elif expected != canonical_hash(entry):
+                verification.add_problem(f"'{entry['id']}' differs from the current entry")
+        for entry_id in result:
+            verification.add_problem(f"'{entry_id}' is left after the batch, but not current")
+        return verification
+
+
+def batch_files(batch: Path) -> list[tuple[Path, dict[str, Any] | None]]:
+    """Return the files of a batch, with their manifest entries if it is sharded.
+
+    A sharded batch is only used when there is no single batch at the path.
+
+    Raises:
+        ValueError: if there is neither a batch nor a manifest of shards.
+    """
+    if batch.exists():
+        return [(batch, None)]
+    manifest = batch_shards.manifest_path(batch)
+    if not manifest.exists():
+        raise ValueError(f"no batch at '{batch}' and no manifest of shards at '{manifest}'")
+    return [
+        (batch.with_name(shard["path"]), shard)
+        for shard in batch_shards.load_manifest(batch)["shards"]
+    ]
+
+
+def verify_batch(
+    batch: Path,
+    *,
+    current: Path | Iterable[dict[str, Any]],
+    baseline: Path | None = None,
+    index: BaselineIndex | None = None,
+    budget: MemoryBudget | None = None,
+) -> Verification:
+    """Check that a batch turns the baseline into the current entries.
+
+    Args:
+        batch (Path): the batch, or the path the shards and manifest are named after
+        current (Path | Iterable[dict[str, Any]]): the entries the batch was made from, or the file with them
+        baseline (Path | None, optional): the entries exported from karp. Defaults to None.
+        index (BaselineIndex | None, optional): the index of the baseline, read instead of it. Defaults to None.
+        budget (MemoryBudget | None, optional): move the replayed entries to disk when it is exceeded. Defaults to None.
+
+    Returns:
+        Verification: the commands replayed and the problems found
+
+    Raises:
+        ValueError: if neither baseline nor index is given.
+    """  # noqa: E501
+    replay = BatchReplay(budget)
+    if index is not None:
+        replay.load_index(index)
+    elif baseline is not None:
+        replay.load_baseline(iter_objs(baseline))
+    else:
+        raise ValueError("give the baseline or its index")
+    for path, shard in batch_files(batch):
+        count = replay.apply_all(iter_objs(path))
+        if shard is None:
+            continue
+        if files.file_digest(path) != shard["sha256"]:
+            replay.verification.add_problem(f"the shard '{path.name}' doesn't match its sha256")
+        if count != shard["commands"]:
+            replay.verification.add_problem(
+                f"the shard '{path.name}' has {count} commands, the manifest {shard['commands']}"
+            )
+    return replay.compare(iter_objs(current) if isinstance(current, Path) else current)
+
+
+def iter_objs(path: Path) -> Iterator[dict[str, Any]]:
+    """Read the objects of a (gzipped) jsonl file, or of a json array."""
+    if ".jsonl" not in path.suffixes:
+        yield from json_arrays.load_from_file(path)
+        return
+    for lines in baseline_loader.iter_line_batches(path):
+        yield from map(orjson.loads, lines)
@@ -1,15 +1,71 @@
 """CLI for preparing fula-ordboken."""
 
+import sys
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
+import orjson
 import typer
 
 # from sb_karp.utility import text
 from resource_fula_ordboken import use_cases
-from resource_fula_ordboken.shared import files
+from resource_fula_ordboken.batch_shards import Sharding
+from resource_fula_ordboken.shared import files, instrumentation, jsonl_sink, parallel
+from resource_fula_ordboken.shared.cache import EncodingCache
+from resource_fula_ordboken.shared.progress import set_progress_factory
+from resource_fula_ordboken.shared.stage_cache import DEFAULT_STAGE_CACHE_SIZE, StageCache
+from resource_fula_ordboken.validation import DEFAULT_VALIDATE_EVERY, Validation, Validator
 
-subapp = typer.Typer()
+if TYPE_CHECKING:
+    from resource_fula_ordboken.id_registry import IdRegistry
+
+subapp = typer.Typer(rich_markup_mode=None)
+
+
+@subapp.callback()
+def main(
+    ctx: typer.Context,
+    metrics_out: Optional[Path] = typer.Option(  # noqa: UP007
+        None, help="write a json report with measurements per stage"
+    ),
+    profile: Optional[Path] = typer.Option(None, help="write cProfile stats of the run"),  # noqa: UP007
+    trace_memory: bool = typer.Option(False, help="trace peak python memory per stage"),
+    progress: bool = typer.Option(True, help="show progress bars"),
+    max_memory: Optional[str] = typer.Option(  # noqa: UP007
+        None, help="move ids, wordforms and the diff to disk beyond this size, like '512M'"
+    ),
+) -> None:
+    """Prepare Fula Ordboken for Karp."""
+    ctx.obj = {"max_memory": _parse_max_memory(max_memory) if max_memory else None}
+    if not progress:
+        set_progress_factory(None)
+    if metrics_out is None and profile is None and not trace_memory:
+        return
+    run = instrumentation.start_run(ctx.invoked_subcommand or "", trace_memory=trace_memory)
+    profiler = None
+    if profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def finish() -> None:
+        if profiler and profile:
+            profiler.disable()
+            profiler.dump_stats(profile)
+        run.finish("error" if sys.exc_info()[0] else "ok")
+        if metrics_out:
+            run.write(metrics_out)
+        else:
+            for stage in run.stages:
+                peak = stage.peak_traced_bytes or stage.max_rss_bytes
+                typer.echo(
+                    f"{stage.name}: {stage.wall_s:.3f}s, {stage.entries} entries,"
+                    f" peak {peak / (1 << 20):.1f} MiB",
+                    err=True,
+                )
+
+    ctx.call_on_close(finish)
 
 
 @subapp.command()
@@ -26,7 +82,13 @@ def package_raw(path: Path, output: Optional[Path] = None) -> None:  # noqa: UP0
 
 
 @subapp.command()
-def raw2clean(path: Path, output: Optional[Path] = None) -> None:  # noqa: UP007
+def raw2clean(
+    path: Path,
+    output: Optional[Path] = None,  # noqa: UP007
+    cache: bool = typer.Option(True, help="cache detected encodings between runs"),
+    cache_dir: Optional[Path] = typer.Option(None, help="where to keep the cache"),  # noqa: UP007
+    stage_cache: bool = typer.Option(True, help="reuse the output of an unchanged input"),
+) -> None:
     """Clean the raw data and packages the cleaned data."""
     date_issued = path.stem.split(" ")[-1]
     if not output:
@@ -34,22 +96,71 @@ def raw2clean(path: Path, output: Optional[Path] = None) -> None:  # noqa: UP007
         output_name = files.normalize_file_name(path.stem)
         output /= f"{output_name}.clean.saf.zip"
     use_cases.clean_data_and_package(
-        file=path, title=f"{path.stem} (cleaned)", date_issued=date_issued, output_path=output
+        file=path,
+        title=f"{path.stem} (cleaned)",
+        date_issued=date_issued,
+        output_path=output,
+        encoding_cache=EncodingCache.in_dir(cache_dir) if cache else None,
+        stage_cache=StageCache.in_dir(cache_dir) if stage_cache else None,
     )
 
 
 @subapp.command()
 def clean2karp(
+    ctx: typer.Context,
     path: Path,
     output: Optional[Path] = typer.Option(None, help="file to write to"),  # noqa: UP007
+    jobs: int = typer.Option(1, help="number of processes parsing entries, 0 for one per core"),
+    validation: Validation = typer.Option(Validation.STRICT, help="which entries to validate"),
+    validate_every: int = typer.Option(
+        DEFAULT_VALIDATE_EVERY, help="validate every Nth entry with '--validation sampled'"
+    ),
+    compresslevel: int = typer.Option(
+        jsonl_sink.DEFAULT_COMPRESSLEVEL, min=0, max=9, help="gzip compression level"
+    ),
+    gzip_block_size: Optional[int] = typer.Option(  # noqa: UP007
+        None, help="write independent gzip members of this many uncompressed bytes"
+    ),
+    shard_by_member: bool = typer.Option(
+        False, help="write one jsonl per .txt member of a zip instead of merging them"
+    ),
+    stage_cache: bool = typer.Option(True, help="reuse the outputs of an unchanged input"),
+    cache_dir: Optional[Path] = typer.Option(None, help="where to keep the cache"),  # noqa: UP007
+    incremental: bool = typer.Option(
+        False, help="only convert records changed since the record manifest next to the output"
+    ),
+    previous_records: Optional[Path] = typer.Option(  # noqa: UP007
+        None, help="record manifest of the previous release, implies --incremental"
+    ),
+    id_registry: Optional[Path] = typer.Option(  # noqa: UP007
+        None, help="keep entry ids stable with this registry, updated after the run"
+    ),
+    seed_ids: Optional[Path] = typer.Option(  # noqa: UP007
+        None, help="converted jsonl of the previous release, seeds a missing registry"
+    ),
+    lookup_index: bool = typer.Option(
+        False, help="write an index next to the jsonl for 'lookup', in blocked gzip"
+    ),
 ) -> None:
     """Convert FulaOrd entries from clean data."""
     date_issued = path.stem.split("_")[-1]
-    if not output:
+    if output:
+        json_output = output
+        saf_output = output.with_name(f"{files.real_stem(output.name)}.processed.saf.zip")
+    else:
         output = Path("data/data_processed")
         output_name = files.normalize_file_name(files.real_stem(path.stem))
         json_output = output / f"{output_name}.jsonl.gz"
         saf_output = output / f"{output_name}.processed.saf.zip"
+    manifest = None
+    previous = None
+    if incremental or previous_records:
+        from resource_fula_ordboken import record_manifest
+
+        manifest = record_manifest.manifest_path(json_output)
+        previous_records = previous_records or (manifest if manifest.exists() else None)
+        if previous_records:
+            previous = record_manifest.RecordManifest.load(previous_records)
 
     use_cases.convert_and_package(
         file=path,
@@ -57,28 +168,420 @@ def clean2karp(
         date_issued=date_issued,
         json_output=json_output,
         saf_output=saf_output,
+        jobs=parallel.resolve_jobs(jobs),
+        validator=Validator(validation, validate_every),
+        compresslevel=compresslevel,
+        gzip_block_size=gzip_block_size,
+        shard_by_member=shard_by_member,
+        stage_cache=StageCache.in_dir(cache_dir) if stage_cache else None,
+        previous_records=previous,
+        record_manifest=manifest,
+        previous_ids=_previous_ids(id_registry, seed_ids),
+        id_registry=id_registry,
+        max_memory=ctx.obj["max_memory"],
+        lookup_index=lookup_index,
     )
 
 
+@subapp.command()
+def lookup(
+    path: Path,
+    terms: list[str],
+    prefix: bool = typer.Option(False, help="list the forms starting with the terms"),
+    index: Optional[Path] = typer.Option(None, help="index to use"),  # noqa: UP007
+    limit: Optional[int] = typer.Option(  # noqa: UP007
+        None, min=1, help="list at most this many forms per term, 50 by default"
+    ),
+) -> None:
+    """Print the entries of a converted jsonl with the given ids or forms."""
+    from resource_fula_ordboken.lookup_index import DEFAULT_SEARCH_LIMIT, LookupIndex
+
+    limit = limit or DEFAULT_SEARCH_LIMIT
+    try:
+        entries = LookupIndex.open(path, index)
+    except ValueError as exc:
+        raise typer.BadParameter(str(exc), param_hint="'PATH'") from exc
+    found = False
+    with entries:
+        for term in terms:
+            if prefix:
+                for form, entry_id in entries.search(term, limit=limit):
+                    typer.echo(f"{form}\t{entry_id}")
+                    found = True
+                continue
+            # a term is an id or else a baseform or wordform
+            entry = entries.get(term)
+            for match in [entry] if entry is not None else entries.entries_for(term):
+                typer.echo(orjson.dumps(match).decode())
+                found = True
+    if not found:
+        raise typer.Exit(1)
+
+
 @subapp.command()
 def karp_as_batch(
+    ctx: typer.Context,
     path: Path,
     baseline: Path = typer.Option(...),
     output: Optional[Path] = typer.Option(None, help="file to write to"),  # noqa: UP007
+    streaming: bool = typer.Option(
+        False, help="diff by merging inputs sorted on disk, with bounded memory"
+    ),
+    use_index: bool = typer.Option(
+        False, help="diff against the content-hash index built by 'index-baseline'"
+    ),
+    index: Optional[Path] = typer.Option(None, help="index to use"),  # noqa: UP007
+    jobs: int = typer.Option(
+        1,
+        help="processes decoding the baseline (in-memory diff only), 0 for one per core",
+    ),
+    validation: Validation = typer.Option(
+        Validation.STRICT, help="which baseline entries to validate"
+    ),
+    validate_every: int = typer.Option(
+        DEFAULT_VALIDATE_EVERY, help="validate every Nth entry with '--validation sampled'"
+    ),
+    compresslevel: int = typer.Option(
+        jsonl_sink.DEFAULT_COMPRESSLEVEL, min=0, max=9, help="gzip compression level"
+    ),
+    gzip_block_size: Optional[int] = typer.Option(  # noqa: UP007
+        None, help="write independent gzip members of this many uncompressed bytes"
+    ),
+    shards: Optional[int] = typer.Option(  # noqa: UP007
+        None, min=1, help="split the batch in this many shards, listed in a manifest"
+    ),
+    shard_max_commands: Optional[int] = typer.Option(  # noqa: UP007
+        None, min=1, help="split the batch in shards of at most this many commands"
+    ),
+    shard_max_bytes: Optional[int] = typer.Option(  # noqa: UP007
+        None, min=1, help="split the batch in shards of about this many uncompressed bytes"
+    ),
 ) -> None:
     """Compute updates for converted entries and a given baseline.
 
     This command computes and creates a batch of commands for updating fula ordboken in .
     """
+    if jobs != 1 and (streaming or use_index or index is not None):
+        raise typer.BadParameter(
+            "only the in-memory diff decodes the baseline in several processes,"
+            " not with '--streaming' or '--use-index'",
+            param_hint="'--jobs'",
+        )
     msg = files.real_stem(path.stem)
-    date_issued = msg.split("_")[-1]
-    if not output:
-        output = Path("data/data_processed")
-        output_path = output / f"fula-ordboken-batch-{date_issued}.jsonl.gz"
     use_cases.create_karp_batch_from_export(
-        path, baseline=baseline, output_path=output_path, msg=msg
+        path,
+        baseline=baseline,
+        output_path=output or _batch_path(path),
+        msg=msg,
+        streaming=streaming,
+        use_index=use_index or index is not None,
+        index_path=index,
+        validator=Validator(validation, validate_every),
+        compresslevel=compresslevel,
+        gzip_block_size=gzip_block_size,
+        jobs=parallel.resolve_jobs(jobs),
+        sharding=_sharding(shards, shard_max_commands, shard_max_bytes),
+        max_memory=ctx.obj["max_memory"],
     )
 
 
+def _batch_path(path: Path) -> Path:
+    """Name the batch of converted entries like 'karp-as-batch' does."""
+    date_issued = files.real_stem(path.stem).split("_")[-1]
+    return Path("data/data_processed") / f"fula-ordboken-batch-{date_issued}.jsonl.gz"
+
+
+@subapp.command()
+def verify_batch(
+    ctx: typer.Context,
+    path: Path,
+    baseline: Path = typer.Option(...),
+    batch: Optional[Path] = typer.Option(  # noqa: UP007
+        None, help="batch to verify, defaults to the one 'karp-as-batch' writes"
+    ),
+    use_index: bool = typer.Option(
+        False, help="replay on the content-hash index built by 'index-baseline'"
+    ),
+    index: Optional[Path] = typer.Option(None, help="index to use"),  # noqa: UP007
+) -> None:
+    """Check that a batch turns the baseline into the converted entries.
+
+    The commands are replayed on the baseline, checking the versions they are
+    for, and the result is compared with the entries by content hash. Exits
+    with 1 if any problem is found.
+    """
+    try:
+        verification = use_cases.verify_batch(
+            batch or _batch_path(path),
+            current=path,
+            baseline=baseline,
+            use_index=use_index or index is not None,
+            index_path=index,
+            max_memory=ctx.obj["max_memory"],
+        )
+    except ValueError as exc:
+        raise typer.BadParameter(str(exc)) from exc
+    commands = ", ".join(
+        f"{cmdtype}: {count}" for cmdtype, count in sorted(verification.commands.items())
+    )
+    typer.echo(
+        f"replayed {verification.commands.total()} commands ({commands or 'none'}),"
+        f" {verification.entries} entries after the batch"
+    )
+    for problem in verification.problems:
+        typer.echo(problem, err=True)
+    if not verification.ok:
+        hidden = verification.num_problems - len(verification.problems)
+        if hidden:
+            typer.echo(f"... and {hidden} more problems", err=True)
+        typer.echo(f"the batch is wrong, {verification.num_problems} problems", err=True)
+        raise typer.Exit(1)
+    typer.echo("the batch is correct")
+
+
+@subapp.command()
+def raw2batch(
+    ctx: typer.Context,
+    path: Path,
+    baseline: Path = typer.Option(...),
+    output_dir: Path = typer.Option(Path("data"), help="where to write the outputs"),
+    cache: bool = typer.Option(True, help="cache detected encodings between runs"),
+    cache_dir: Optional[Path] = typer.Option(None, help="where to keep the cache"),  # noqa: UP007
+    jobs: int = typer.Option(
+        1,
+        help="number of processes parsing entries, and decoding the baseline for the in-memory diff, 0 for one per core",  # noqa: E501
+    ),
+    streaming: bool = typer.Option(
+        False, help="diff by merging inputs sorted on disk, with bounded memory"
+    ),
+    use_index: bool = typer.Option(
+        False, help="diff against the content-hash index built by 'index-baseline'"
+    ),
+    index: Optional[Path] = typer.Option(None, help="index to use"),  # noqa: UP007
+    validation: Validation = typer.Option(Validation.STRICT, help="which entries to validate"),
+    validate_every: int = typer.Option(
+        DEFAULT_VALIDATE_EVERY, help="validate every Nth entry with '--validation sampled'"
+    ),
+    compresslevel: int = typer.Option(
+        jsonl_sink.DEFAULT_COMPRESSLEVEL, min=0, max=9, help="gzip compression level"
+    ),
+    gzip_block_size: Optional[int] = typer.Option(  # noqa: UP007
+        None, help="write independent gzip members of this many uncompressed bytes"
+    ),
+    shards: Optional[int] = typer.Option(  # noqa: UP007
+        None, min=1, help="split the batch in this many shards, listed in a manifest"
+    ),
+    shard_max_commands: Optional[int] = typer.Option(  # noqa: UP007
+        None, min=1, help="split the batch in shards of at most this many commands"
+    ),
+    shard_max_bytes: Optional[int] = typer.Option(  # noqa: UP007
+        None, min=1, help="split the batch in shards of about this many uncompressed bytes"
+    ),
+    id_registry: Optional[Path] = typer.Option(  # noqa: UP007
+        None, help="keep entry ids stable with this registry, updated after the run"
+    ),
+    seed_ids: Optional[Path] = typer.Option(  # noqa: UP007
+        None, help="converted jsonl of the previous release, seeds a missing registry"
+    ),
+) -> None:
+    """Clean, convert and compute the batch for a raw export in one pass.
+
+    Writes the same outputs as 'raw2clean', 'clean2karp' and 'karp-as-batch'.
+    """
+    date_issued = path.stem.split(" ")[-1]
+    output_name = files.normalize_file_name(path.stem)
+    use_cases.raw_to_batch(
+        path,
+        baseline=baseline,
+        msg=output_name,
+        title=path.stem,
+        date_issued=date_issued,
+        clean_saf_output=output_dir / "data_clean" / f"{output_name}.clean.saf.zip",
+        json_output=output_dir / "data_processed" / f"{output_name}.jsonl.gz",
+        processed_saf_output=output_dir / "data_processed" / f"{output_name}.processed.saf.zip",
+        batch_output=output_dir
+        / "data_processed"
+        / f"fula-ordboken-batch-{date_issued}.jsonl.gz",
+        encoding_cache=EncodingCache.in_dir(cache_dir) if cache else None,
+        jobs=parallel.resolve_jobs(jobs),
+        validator=Validator(validation, validate_every),
+        streaming=streaming,
+        use_index=use_index or index is not None,
+        index_path=index,
+        compresslevel=compresslevel,
+        gzip_block_size=gzip_block_size,
+        sharding=_sharding(shards, shard_max_commands, shard_max_bytes),
+        previous_ids=_previous_ids(id_registry, seed_ids),
+        id_registry=id_registry,
+        max_memory=ctx.obj["max_memory"],
+    )
+
+
+def _parse_max_memory(max_memory: str) -> int:
+    from resource_fula_ordboken.shared.memory_budget import parse_size
+
+    try:
+        return parse_size(max_memory)
+    except ValueError as exc:
+        raise typer.BadParameter(str(exc), param_hint="'--max-memory'") from exc
+
+
+def _sharding(
+    shards: int | None, max_commands: int | None, max_bytes: int | None
+) -> Sharding | None:
+    if shards is None and max_commands is None and max_bytes is None:
+        return None
+    try:
+        return Sharding(shards, max_commands, max_bytes)
+    except ValueError as exc:
+        raise typer.BadParameter(str(exc)) from exc
+
+
+def _previous_ids(id_registry: Path | None, seed_ids: Path | None) -> "IdRegistry | None":
+    """Load the id registry, or seed it from the previous release if it is missing."""
+    from resource_fula_ordboken.id_registry import IdRegistry
+
+    if id_registry is not None and id_registry.exists():
+        return IdRegistry.load(id_registry)
+    return IdRegistry.from_jsonl(seed_ids) if seed_ids is not None else None
+
+
+@subapp.command()
+def rebuild(
+    ctx: typer.Context,
+    source: str = typer.Argument(..., help="directory of raw exports, or a glob of them"),
+    output_dir: Path = typer.Option(Path("data"), help="where to write the outputs"),
+    jobs: int = typer.Option(0, help="number of releases rebuilt at once, 0 for one per core"),
+    cache: bool = typer.Option(True, help="cache detected encodings between runs"),
+    cache_dir: Optional[Path] = typer.Option(None, help="where to keep the cache"),  # noqa: UP007
+    stage_cache: bool = typer.Option(True, help="reuse the outputs of an unchanged input"),
+    validation: Validation = typer.Option(Validation.STRICT, help="which entries to validate"),
+    validate_every: int = typer.Option(
+        DEFAULT_VALIDATE_EVERY, help="validate every Nth entry with '--validation sampled'"
+    ),
+    compresslevel: int = typer.Option(
+        jsonl_sink.DEFAULT_COMPRESSLEVEL, min=0, max=9, help="gzip compression level"
+    ),
+) -> None:
+    """Clean and convert every raw export in a directory, in parallel.
+
+    Each release is rebuilt like 'raw2clean' followed by 'clean2karp', and a
+    table of the timings and failures is printed when all are done.
+    """
+    raw_files = _raw_exports(source)
+    results = use_cases.rebuild_releases(
+        raw_files,
+        output_dir=output_dir,
+        jobs=min(parallel.resolve_jobs(jobs), len(raw_files)),
+        cache_dir=cache_dir,
+        encoding_cache=cache,
+        stage_cache=stage_cache,
+        validator=Validator(validation, validate_every),
+        compresslevel=compresslevel,
+        max_memory=ctx.obj["max_memory"],
+    )
+    typer.echo(_summary_table(results))
+    if any(result.error for result in results):
+        raise typer.Exit(1)
+
+
+def _raw_exports(source: str) -> list[Path]:
+    """List the zips in a directory, or the files matching a glob."""
+    import glob
+
+    if Path(source).is_dir():
+        raw_files = sorted(path for path in Path(source).iterdir() if path.suffix == ".zip")
+    else:
+        raw_files = sorted(Path(path) for path in glob.glob(source))  # noqa: PTH207
+    if not raw_files:
+        raise typer.BadParameter(f"no raw exports in '{source}'", param_hint="'SOURCE'")
+    return raw_files
+
+
+def _summary_table(results: list[use_cases.ReleaseResult]) -> str:
+    """Format the results of `rebuild` as a table, with a line of totals."""
+    rows = [("release", "date issued", "clean s", "convert s", "status")]
+    rows.extend(
+        (
+            result.path.name,
+            result.date_issued,
+            f"{result.clean_s:.2f}",
+            f"{result.convert_s:.2f}",
+            result.error or "ok",
+        )
+        for result in results
+    )
+    failed = sum(1 for result in results if result.error)
+    rows.append(
+        (
+            f"{len(results)} releases",
+            "",
+            f"{sum(result.clean_s for result in results):.2f}",
+            f"{sum(result.convert_s for result in results):.2f}",
+            f"{failed} failed" if failed else "ok",
+        )
+    )
+    widths = [max(len(row[col]) for row in rows) for col in range(4)]
+    return "\n".join(
+        "  ".join(
+            [
+                row[0].ljust(widths[0]),
+                row[1].ljust(widths[1]),
+                row[2].rjust(widths[2]),
+                row[3].rjust(widths[3]),
+                row[4],
+            ]
+        ).rstrip()
+        for row in rows
+    )
+
+
+@subapp.command()
+def index_baseline(
+    baseline: Path,
+    output: Optional[Path] = typer.Option(None, help="file to write to"),  # noqa: UP007
+    validation: Validation = typer.Option(
+        Validation.STRICT, help="which baseline entries to validate"
+    ),
+    validate_every: int = typer.Option(
+        DEFAULT_VALIDATE_EVERY, help="validate every Nth entry with '--validation sampled'"
+    ),
+) -> None:
+    """Build (or rebuild) the content-hash index of a Karp baseline export."""
+    index_path = use_cases.index_baseline(
+        baseline, index_path=output, validator=Validator(validation, validate_every)
+    )
+    typer.echo(f"wrote index to '{index_path}'")
+
+
+@subapp.command()
+def cleanup(
+    workdir: Path = typer.Option(Path("tmp"), help="where the work directories are created"),
+    older_than: float = typer.Option(
+        24.0, help="remove work directories older than this many hours"
+    ),
+    cache_dir: Optional[Path] = typer.Option(None, help="where the cache is kept"),  # noqa: UP007
+    cache_max_size: int = typer.Option(
+        DEFAULT_STAGE_CACHE_SIZE >> 20, help="shrink the stage cache to this many MiB"
+    ),
+    clear_cache: bool = typer.Option(False, help="remove all cached stage outputs"),
+    dry_run: bool = typer.Option(False, help="only list what would be removed"),
+) -> None:
+    """Remove stale work directories and shrink the stage cache."""
+    for path in use_cases.cleanup_workdirs(
+        workdir, older_than=older_than * 3600, dry_run=dry_run
+    ):
+        typer.echo(f"{'would remove' if dry_run else 'removed'} '{path}'")
+    if dry_run:
+        return
+    stage_cache = StageCache.in_dir(cache_dir)
+    if clear_cache:
+        stage_cache.clear()
+        typer.echo(f"cleared '{stage_cache.root}'")
+    else:
+        for path in stage_cache.evict(cache_max_size << 20):
+            typer.echo(f"evicted '{path}'")
+
+
 if __name__ == "__main__":
     subapp()
@@ -1,83 +1,411 @@
 """Find updates."""
 
+import itertools
+import operator
+from collections.abc import Iterable, Iterator
 from pathlib import Path
+from typing import Any
 
 import json_arrays
-from tqdm import tqdm
+import orjson
 
 import resource_fula_ordboken
+from resource_fula_ordboken import baseline_loader
+from resource_fula_ordboken.baseline_index import BaselineIndex, canonical_hash
 from resource_fula_ordboken.models import (
     AddFulaOrdEntry,
     DeleteFulaOrdEntry,
-    FulaOrdEntry,
     FulaOrdEntryCmd,
+    FulaOrdExportRecord,
     UpdateFulaOrdEntry,
+    Validator,
 )
+from resource_fula_ordboken.shared import external_sort, instrumentation
+from resource_fula_ordboken.shared.memory_budget import MemoryBudget
+from resource_fula_ordboken.shared.progress import progress, progress_bar
 
+# a loaded entry takes about 4 times the bytes of its json, measured on generated
+# entries, and a record of the baseline with its slot in a dict about 200 more
+OBJECT_BYTES_PER_JSON_BYTE = 4
+RECORD_BYTES = 200
+DEFAULT_ENTRY_BYTES = 1000
 
-def find_updates_from_export(path: Path, baseline: Path, *, msg: str) -> list[FulaOrdEntryCmd]:
+
+def find_updates_from_export(
+    path: Path | Iterable[dict[str, Any]],
+    baseline: Path,
+    *,
+    msg: str,
+    validator: Validator | None = None,
+    jobs: int = 1,
+) -> list[FulaOrdEntryCmd]:
     """Find updates from Karp export.
 
     Args:
-        path (Path): new entries
+        path (Path | Iterable[dict[str, Any]]): new entries, or the file with them
         baseline (Path): the last used entries
         msg (str): The message to use
+        validator (Validator | None, optional): which baseline rows to validate. Defaults to all.
+        jobs (int, optional): number of processes decoding the baseline. Defaults to 1.
 
     Returns:
-        tuple[list, list, list[str]]: entries to add, update, delete
+        list[FulaOrdEntryCmd]: commands to delete, then to add or update, entries
     """
-    base = {
-        obj["entry"]["id"]: FulaOrdEntry(**obj)
-        for obj in tqdm(
-            json_arrays.load_from_file(baseline),
-            desc="Loading baseline",
-            unit=" entries",
-        )
-    }
+    base: dict[str, FulaOrdExportRecord] = {}
+    with (
+        instrumentation.stage("load_baseline") as stage,
+        progress_bar(desc="Loading baseline") as bar,
+    ):
+        for records in baseline_loader.iter_baseline_batches(
+            baseline, jobs=jobs, validator=validator
+        ):
+            base.update((record.entry["id"], record) for record in records)
+            bar.update(len(records))
+            stage.entries += len(records)
 
-    curr = {
-        obj["id"]: obj
-        for obj in tqdm(
-            json_arrays.load_from_file(path), desc="Loading current", unit=" entries"
-        )
-    }
+    with instrumentation.stage("load_current") as stage:
+        curr = {obj["id"]: obj for obj in progress(_load_current(path), desc="Loading current")}
+        stage.entries += len(curr)
 
-    batch: list[FulaOrdEntryCmd] = [
-        DeleteFulaOrdEntry(
-            user=resource_fula_ordboken.user_agent(),
-            message=msg,
-            resourceId="fulaord",
-            id=base[key].id,
-            version=base[key].version,
+    return list(_diff_in_memory(base, curr, msg=msg))
+
+
+def find_updates_within(
+    path: Path | Iterable[dict[str, Any]],
+    baseline: Path,
+    *,
+    msg: str,
+    budget: MemoryBudget,
+    validator: Validator | None = None,
+    jobs: int = 1,
+) -> Iterator[FulaOrdEntryCmd]:
+    """Find updates from Karp export in memory, or on disk if that exceeds budget.
+
+    The entries are loaded like `find_updates_from_export` while they fit in
+    the budget. When they don't, what is loaded is dropped and the diff is
+    finished with `iter_updates_from_export`, in sorted runs that fit in what is
+    left of the budget. The commands are then yielded in entry id order.
+
+    Args:
+        path (Path | Iterable[dict[str, Any]]): new entries, or the file with them
+        baseline (Path): the last used entries
+        msg (str): The message to use
+        budget (MemoryBudget): the memory the loaded entries may take
+        validator (Validator | None, optional): which baseline rows to validate. Defaults to all.
+        jobs (int, optional): number of processes decoding the baseline. Defaults to 1.
+
+    Yields:
+        FulaOrdEntryCmd: commands to add, update or delete entries
+    """
+    base: dict[str, FulaOrdExportRecord] = {}
+    curr: dict[str, dict[str, Any]] = {}
+    charged = 0
+    with (
+        instrumentation.stage("load_baseline") as stage,
+        progress_bar(desc="Loading baseline") as bar,
+    ):
+        for records in baseline_loader.iter_baseline_batches(
+            baseline, jobs=jobs, validator=validator
+        ):
+            base.update((record.entry["id"], record) for record in records)
+            nbytes = sum(entry_bytes(record.entry) for record in records)
+            charged += nbytes
+            budget.charge(nbytes)
+            bar.update(len(records))
+            stage.entries += len(records)
+            if budget.exceeded:
+                break
+
+    current = iter(_load_current(path))
+    if not budget.exceeded:
+        with instrumentation.stage("load_current") as stage:
+            for obj in progress(current, desc="Loading current"):
+                curr[obj["id"]] = obj
+                nbytes = entry_bytes(obj)
+                charged += nbytes
+                budget.charge(nbytes)
+                if budget.exceeded:
+                    break
+            stage.entries += len(curr)
+
+    if budget.exceeded:
+        num_loaded = len(base) + len(curr)
+        base.clear()
+        budget.release(charged)
+        budget.spilled.append("diff")
+        yield from iter_updates_from_export(
+            itertools.chain(_drain(curr), current),
+            baseline,
+            msg=msg,
+            chunk_size=chunk_size_within(budget, charged // max(num_loaded, 1)),
+            tmpdir=budget.temp_dir(),
+            validator=validator,
         )
-        for key in tqdm(base, desc="Finding entries to remove", unit=" entries")
-        if key not in curr
-    ]
+        return
+    try:
+        yield from _diff_in_memory(base, curr, msg=msg)
+    finally:
+        budget.release(charged)
+
+
+def _diff_in_memory(
+    base: dict[str, FulaOrdExportRecord], curr: dict[str, dict[str, Any]], *, msg: str
+) -> Iterator[FulaOrdEntryCmd]:
+    """Yield the commands to delete, then to add or update, the entries by id."""
+    user = resource_fula_ordboken.user_agent()
+    for key in progress(base, desc="Finding entries to remove"):
+        if key not in curr:
+            yield DeleteFulaOrdEntry(
+                user=user,
+                message=msg,
+                resourceId="fulaord",
+                id=base[key].id,
+                version=base[key].version,
+            )
 
     # find updated entries
-    for key, curr_entry in tqdm(
-        curr.items(), desc="Finding entries to add or update", unit=" entries"
-    ):
+    for key, curr_entry in progress(curr.items(), desc="Finding entries to add or update"):
         if key in base:
-            if curr_entry != base[key].entry:
-                batch.append(
-                    UpdateFulaOrdEntry(
-                        resourceId=base[key].resource,
-                        id=base[key].id,
-                        version=base[key].version,
-                        entry=curr_entry,
-                        user=resource_fula_ordboken.user_agent(),
-                        message=msg,
-                    )
+            if is_modified(curr_entry, base[key].entry):
+                yield UpdateFulaOrdEntry(
+                    resourceId=base[key].resource,
+                    id=base[key].id,
+                    version=base[key].version,
+                    entry=curr_entry,
+                    user=user,
+                    message=msg,
                 )
         else:
-            batch.append(
-                AddFulaOrdEntry(
-                    resourceId="fulaord",
-                    entry=curr_entry,
-                    user=resource_fula_ordboken.user_agent(),
+            yield AddFulaOrdEntry(
+                resourceId="fulaord",
+                entry=curr_entry,
+                user=user,
+                message=msg,
+            )
+
+
+def entry_bytes(entry: dict[str, Any]) -> int:
+    """Estimate the memory an entry loaded from json takes, with its slot in a dict."""
+    return RECORD_BYTES + len(orjson.dumps(entry)) * OBJECT_BYTES_PER_JSON_BYTE
+
+
+def chunk_size_within(budget: MemoryBudget, bytes_per_entry: int = DEFAULT_ENTRY_BYTES) -> int:
+    """Return the size of the sorted runs that fit in what is left of budget.
+
+    Both inputs of the merge may hold a run in memory at the same time.
+    """
+    return max(budget.remaining() // (2 * max(bytes_per_entry, 1)), 1)
+
+
+def iter_updates_from_export(
+    path: Path | Iterable[dict[str, Any]],
+    baseline: Path,
+    *,
+    msg: str,
+    chunk_size: int = external_sort.DEFAULT_CHUNK_SIZE,
+    tmpdir: Path | None = None,
+    validator: Validator | None = None,
+) -> Iterator[FulaOrdEntryCmd]:
+    """Find updates from Karp export by merging both inputs sorted on entry id.
+
+    Both inputs are sorted externally, spilling to disk in runs of `chunk_size`
+    entries, so memory use is bounded by `chunk_size` and not by the size of the
+    lexicon. The commands are yielded in entry id order.
+
+    Args:
+        path (Path | Iterable[dict[str, Any]]): new entries, or the file with them
+        baseline (Path): the last used entries
+        msg (str): The message to use
+        chunk_size (int, optional): entries per sorted run. Defaults to external_sort.DEFAULT_CHUNK_SIZE.
+        tmpdir (Path | None, optional): where to write the sorted runs. Defaults to None.
+        validator (Validator | None, optional): which baseline rows to validate. Defaults to all.
+
+    Yields:
+        FulaOrdEntryCmd: commands to add, update or delete entries
+    """  # noqa: E501
+    base_iter = _last_per_key(
+        external_sort.sort_json_objects(
+            progress(json_arrays.load_from_file(baseline), desc="Loading baseline"),
+            key=_baseline_key,
+            chunk_size=chunk_size,
+            tmpdir=tmpdir,
+        ),
+        key=_baseline_key,
+    )
+    curr_iter = _last_per_key(
+        external_sort.sort_json_objects(
+            progress(_load_current(path), desc="Loading current"),
+            key=_current_key,
+            chunk_size=chunk_size,
+            tmpdir=tmpdir,
+        ),
+        key=_current_key,
+    )
+    yield from merge_updates(
+        ((_baseline_key(obj), obj) for obj in base_iter),
+        ((_current_key(obj), obj) for obj in curr_iter),
+        msg=msg,
+        validator=validator,
+    )
+
+
+def merge_updates(
+    base_iter: Iterable[tuple[str, dict[str, Any]]],
+    curr_iter: Iterable[tuple[str, dict[str, Any]]],
+    *,
+    msg: str,
+    validator: Validator | None = None,
+) -> Iterator[FulaOrdEntryCmd]:
+    """Merge two streams of (entry id, object) sorted on entry id into commands.
+
+    Args:
+        base_iter (Iterable[tuple[str, dict[str, Any]]]): baseline objects as exported from Karp
+        curr_iter (Iterable[tuple[str, dict[str, Any]]]): current entries
+        msg (str): The message to use
+        validator (Validator | None, optional): which baseline objects to validate. Defaults to all.
+
+    Yields:
+        FulaOrdEntryCmd: commands to add, update or delete entries
+    """  # noqa: E501
+    validator = validator or Validator()
+    user = resource_fula_ordboken.user_agent()
+    base_it = iter(base_iter)
+    curr_it = iter(curr_iter)
+    base_item = next(base_it, None)
+    curr_item = next(curr_it, None)
+    while base_item is not None or curr_item is not None:
+        if base_item is not None and (curr_item is None or base_item[0] < curr_item[0]):
+            base_entry = FulaOrdExportRecord.from_export(
+                base_item[1], validate=validator.should_validate()
+            )
+            yield DeleteFulaOrdEntry(
+                user=user,
+                message=msg,
+                resourceId="fulaord",
+                id=base_entry.id,
+                version=base_entry.version,
+            )
+            base_item = next(base_it, None)
+        elif curr_item is not None and (base_item is None or curr_item[0] < base_item[0]):
+            yield AddFulaOrdEntry(
+                resourceId="fulaord",
+                entry=curr_item[1],
+                user=user,
+                message=msg,
+            )
+            curr_item = next(curr_it, None)
+        elif base_item is not None and curr_item is not None:
+            base_entry = FulaOrdExportRecord.from_export(
+                base_item[1], validate=validator.should_validate()
+            )
+            if is_modified(curr_item[1], base_entry.entry):
+                yield UpdateFulaOrdEntry(
+                    resourceId=base_entry.resource,
+                    id=base_entry.id,
+                    version=base_entry.version,
+                    entry=curr_item[1],
+                    user=user,
                     message=msg,
                 )
+            base_item = next(base_it, None)
+            curr_item = next(curr_it, None)
+
+
+def find_updates_from_index(
+    path: Path | Iterable[dict[str, Any]], index: BaselineIndex, *, msg: str
+) -> Iterator[FulaOrdEntryCmd]:
+    """Find updates by comparing content hashes against an index of the baseline.
+
+    Only the current entries are read, the baseline is represented by its index.
+    The changed entries are kept in the index until all are read, so that the last
+    of duplicated ids wins like in `find_updates_from_export`.
+
+    Args:
+        path (Path | Iterable[dict[str, Any]]): new entries, or the file with them
+        index (BaselineIndex): index of the last used entries
+        msg (str): The message to use
+
+    Yields:
+        FulaOrdEntryCmd: commands to add or update entries, followed by commands to delete
+    """
+    user = resource_fula_ordboken.user_agent()
+    index.reset_seen()
+    for curr_entry in progress(_load_current(path), desc="Finding entries to add or update"):
+        key = curr_entry["id"]
+        indexed = index.get(key)
+        is_changed = indexed is None or indexed.hash != canonical_hash(curr_entry)
+        index.mark_seen(key, curr_entry if is_changed else None)
+    for curr_entry, indexed in index.iter_changed():
+        if indexed is None:
+            yield AddFulaOrdEntry(
+                resourceId="fulaord",
+                entry=curr_entry,
+                user=user,
+                message=msg,
+            )
+        else:
+            yield UpdateFulaOrdEntry(
+                resourceId=indexed.resource,
+                id=indexed.entity_id,
+                version=indexed.version,
+                entry=curr_entry,
+                user=user,
+                message=msg,
             )
+    for indexed in index.iter_unseen():
+        yield DeleteFulaOrdEntry(
+            user=user,
+            message=msg,
+            resourceId="fulaord",
+            id=indexed.entity_id,
+            version=indexed.version,
+        )
+
+
+def is_modified(curr_entry: dict[str, Any], base_entry: dict[str, Any]) -> bool:
+    """Check if the current entry differs from the baseline entry.
+
+    Fields set to None are ignored, since Karp leaves them out of the export.
+
+    Args:
+        curr_entry (dict[str, Any]): the current entry
+        base_entry (dict[str, Any]): the entry in the baseline
+
+    Returns:
+        bool: True if the entries differ
+    """
+    return _without_none(curr_entry) != _without_none(base_entry)
+
+
+def _without_none(entry: dict[str, Any]) -> dict[str, Any]:
+    return {field: value for field, value in entry.items() if value is not None}
+
+
+def _load_current(path: Path | Iterable[dict[str, Any]]) -> Iterable[dict[str, Any]]:
+    return json_arrays.load_from_file(path) if isinstance(path, Path) else path
+
+
+def _baseline_key(obj: dict[str, Any]) -> str:
+    return obj["entry"]["id"]
+
+
+_current_key = operator.itemgetter("id")
+
+
+def _last_per_key(objs: Iterable[Any], *, key: Any) -> Iterator[Any]:
+    """Keep the last of consecutive objects with equal keys, like building a dict does."""
+    prev = None
+    prev_key = None
+    for obj in objs:
+        obj_key = key(obj)
+        if prev is not None and obj_key != prev_key:
+            yield prev
+        prev, prev_key = obj, obj_key
+    if prev is not None:
+        yield prev
+
 
-    return batch
+def _drain(entries: dict[str, dict[str, Any]]) -> Iterator[dict[str, Any]]:
+    """Yield the entries, dropping each from the dict, in no particular order."""
+    while entries:
+        yield entries.popitem()[1]
@@ -1,110 +1,343 @@
 """Converter for Fula Ordboken."""
 
+import itertools
 import re
-import unicodedata
-from collections.abc import Generator, Iterable
+from collections.abc import Generator, Iterable, Iterator, MutableMapping
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import orjson
 
 from resource_fula_ordboken import text
-from resource_fula_ordboken.models import FulaOrd
+from resource_fula_ordboken.id_registry import IdAllocator
+from resource_fula_ordboken.models import FulaOrd, FulaOrdRecord
+from resource_fula_ordboken.shared import parallel
+from resource_fula_ordboken.shared.memory_budget import MemoryBudget, SpillDict
+from resource_fula_ordboken.text import shave_marks  # noqa: F401, it used to live here
+from resource_fula_ordboken.validation import Validator
 
 EM_PROG = re.compile(r"<em>([a-zA-ZåäöÅÄÖ0-9, \-]+)[\.,]?</em>")
 JFR_PROG = re.compile(r"Jfr(.*)</p>")
 ALSO_PROG = re.compile(r"(?:Ä|ä)ven <em>(.*?)</em>")
 
+RECORDS_PER_CHUNK = 1000
+
+
+class ParsedRecord(NamedTuple):
+    """A record parsed from the txt export, before an id is assigned."""
+
+    baseform: str
+    wordforms: list[str]
+    alternates: list[str]
+    text: str
+    jfr: list[str] | None
+
+
+def iter_records(lines: Iterable[str]) -> Iterator[tuple[str, str]]:
+    """Split the lines of the export into records.
+
+    A record starts with a line beginning with '%word_word%' (or the first line)
+    and continues until the next such line.
+
+    Yields:
+        tuple[str, str]: the first line and the rest of the record
+    """
+    word_word = None
+    word_text: list[str] = []  # joined once per record, concatenation is quadratic
+    for line in lines:
+        if word_word is None:
+            word_word = line
+        elif line.startswith("%word_word%"):
+            yield word_word, "".join(word_text)
+            word_word = line
+            word_text = []
+        else:
+            word_text.append(line)
+    if word_word is not None:
+        yield word_word, "".join(word_text)
+
+
+def parse_record(word_word: str, word_text: str) -> ParsedRecord:
+    """Parse one record of the export.
+
+    The header is cut with one partition on each marker, and html entities are
+    only unescaped in parts that contain '&'. The text is only searched for
+    alternates and jfr references if their markers occur in it.
+    """
+    header = word_word.rpartition("%word_word%")[2]
+    if "&" in header:
+        header = text.unescape_str(header)
+    if "%word_text%" in header:
+        # the words and the text are unescaped twice, as they always have been
+        words = header.partition("%word_text%")[0]
+        if "&" in words:
+            words = text.unescape_str(words)
+        _word_text = header.rpartition("%word_text%")[2]
+        if "&" in _word_text:
+            _word_text = text.unescape_str(_word_text)
+        if word_text:
+            _word_text += word_text
+    else:
+        words = header
+        _word_text = word_text.rpartition("%word_text%")[2].strip()
+        if "&" in _word_text:
+            _word_text = text.unescape_str(_word_text)
+    baseform, *wordforms = words.split(", ")
+    alternates = []
+    if "ven <em>" in _word_text:
+        for also in ALSO_PROG.findall(_word_text):
+            alternates.extend(also.split(", "))
+    jfr = None
+    if "Jfr" in _word_text and (jfr_match := JFR_PROG.search(_word_text)):
+        jfr = EM_PROG.findall(jfr_match.group(0))
+    return ParsedRecord(
+        baseform=baseform.strip(),
+        wordforms=list(map(str.strip, wordforms)),
+        alternates=alternates,
+        text=_word_text.strip(),
+        jfr=jfr,
+    )
+
+
+def parse_records(records: list[tuple[str, str]]) -> list[ParsedRecord]:
+    """Parse a chunk of records without validating them."""
+    return list(itertools.starmap(parse_record, records))
+
+
+def validate_parsed(record: ParsedRecord) -> ParsedRecord:
+    """Validate a parsed record as a `FulaOrd`, before an id is assigned to it."""
+    FulaOrd.model_validate(
+        {
+            "baseform": record.baseform,
+            "id": "",
+            "wordforms": record.wordforms + record.alternates,
+            "text": record.text,
+            "jfr": record.jfr,
+        }
+    )
+    return record
+
+
+def parse_batch(batch: tuple[list[tuple[str, str]], list[bool]]) -> list[ParsedRecord]:
+    """Parse and (optionally) validate a chunk of records, used by the worker processes.
+
+    Args:
+        batch (tuple[list[tuple[str, str]], list[bool]]): the records and whether to validate each of them
+
+    Returns:
+        list[ParsedRecord]: the parsed records in the order of the chunk
+    """  # noqa: E501
+    records, validate = batch
+    return [
+        validate_parsed(parsed) if should_validate else parsed
+        for parsed, should_validate in zip(
+            itertools.starmap(parse_record, records), validate, strict=True
+        )
+    ]
+
+
+def dump_parsed(
+    records: Iterable[tuple[str, str]], path: Path, *, validator: Validator | None = None
+) -> int:
+    """Parse records and write them as json lines, for parsing in another process.
+
+    See `iter_parsed` for `validator`.
+
+    Returns:
+        int: the number of records written
+    """
+    count = 0
+    with path.open("wb") as fp:
+        for record in iter_parsed(records, validator=validator):
+            fp.write(orjson.dumps(list(record)))
+            fp.write(b"\n")
+            count += 1
+    return count
+
+
+def load_parsed(path: Path) -> Iterator[ParsedRecord]:
+    """Read the records written by `dump_parsed`."""
+    with path.open("rb") as fp:
+        for line in fp:
+            yield ParsedRecord(*orjson.loads(line))
 
-def shave_marks(txt: str) -> str:
-    """Remove all diacritic marks."""
-    norm_txt = unicodedata.normalize("NFD", txt)
-    shaved = "".join(c for c in norm_txt if not unicodedata.combining(c))
-    return unicodedata.normalize("NFC", shaved)
+
+def iter_parsed(
+    records: Iterable[tuple[str, str]], *, jobs: int = 1, validator: Validator | None = None
+) -> Iterator[ParsedRecord]:
+    """Parse records in order, in a pool of `jobs` processes if more than one.
+
+    Which records to validate is decided in order in the calling process, so the
+    same records are validated regardless of `jobs`, but they are validated by
+    the process that parses them. Defaults to validating every record.
+    """
+    validator = validator or Validator()
+    batches = (
+        (chunk, [validator.should_validate() for _ in chunk])
+        for chunk in parallel.chunked(records, RECORDS_PER_CHUNK)
+    )
+    if jobs > 1:
+        return itertools.chain.from_iterable(
+            parallel.ordered_map(parse_batch, batches, jobs=jobs)
+        )
+    return itertools.chain.from_iterable(map(parse_batch, batches))
 
 
 class FulaOrdTxt2JsonConverter:
     """Convert Fula Ordboken from txt to jsonl."""
 
-    def __init__(self) -> None:
-        """Construct the converter."""
-        self.fulaord_ids: set[str] = set()
-        self.fulaord_wordforms: dict[str, str] = {}
-
-    def generate_id(self, baseform: str) -> str:
-        """Generate id unique for this resource."""
-        i = 1
-        baseform = baseform.replace(" ", "_").replace(",", "_").lower()
-        baseform = shave_marks(baseform)
-        entry_id = f"{baseform}..{i}"
-        while entry_id in self.fulaord_ids:
-            i += 1
-            entry_id = f"{baseform}..{i}"
-        self.fulaord_ids.add(entry_id)
-        return entry_id
-
-    def convert_entry(self, fp) -> Generator[FulaOrd, None, None]:  # noqa: ANN001
-        """Generate converted entries from file."""
-        next_word = None
-        while True:
-            try:
-                if next_word:
-                    word_word = next_word
-                    next_word = None
-                else:
-                    word_word = next(fp)
-            except StopIteration:
-                break
-            word_text = ""
-            while True:
-                try:
-                    _word_text = next(fp)
-                except StopIteration:
-                    break
-                if _word_text.startswith("%word_word%"):
-                    next_word = _word_text
-                    break
-                else:
-                    word_text += _word_text
-            _word_word = text.unescape_str(word_word.split("%word_word%")[-1])
-            if "%word_text%" in _word_word:
-                _tmp_words = _word_word.split("%word_text%")
-                words = text.unescape_str(_tmp_words[0])
-                _word_text = text.unescape_str(_tmp_words[-1])
-                if word_text:
-                    _word_text += word_text
-            else:
-                words = _word_word
-                _word_text = text.unescape_str(word_text.split("%word_text%")[-1].strip())
-            _wordforms = words.split(", ")
-            entry = {"baseform": _wordforms[0].strip()}
-            entry["id"] = self.generate_id(entry["baseform"])
-            self.fulaord_wordforms[entry["baseform"]] = entry["id"]
-            if len(_wordforms) > 1:
-                wordforms = [s.strip() for s in _wordforms[1:]]
-                for wordform in wordforms:
-                    self.fulaord_wordforms[wordform] = entry["id"]
-            else:
-                wordforms = []
-            if also_match := ALSO_PROG.findall(_word_text):
-                for m in also_match:
-                    wordforms.extend(m.split(", "))
-            entry["wordforms"] = wordforms
-            # entry["word"] = words.strip()
-            entry["text"] = _word_text.strip()
-            jfr_match = JFR_PROG.search(_word_text)
-            jfr = None
-            if jfr_match:
-                jfr_text = jfr_match.group(0)
-                jfr = EM_PROG.findall(jfr_text)
-                entry["jfr"] = jfr
-            yield FulaOrd(**entry)
+    def __init__(
+        self, id_allocator: IdAllocator | None = None, *, budget: MemoryBudget | None = None
+    ) -> None:
+        """Construct the converter.
+
+        Args:
+            id_allocator (IdAllocator | None, optional): gives out the ids, with a registry for stable ids. Defaults to a new one.
+            budget (MemoryBudget | None, optional): move the wordform map, and the ids of a new allocator, to disk when it is exceeded. Defaults to None.
+        """  # noqa: E501
+        self.id_allocator = id_allocator or IdAllocator(budget=budget)
+        self.fulaord_ids = self.id_allocator.ids
+        self.fulaord_wordforms: MutableMapping[str, str] = (
+            SpillDict(budget, "wordforms") if budget else {}
+        )
+
+    def generate_id(self, baseform: str, entry_text: str = "") -> str:
+        """Generate id unique for this resource.
+
+        With a registry the id may be pending until the second pass, see `id_registry`.
+        """
+        return self.id_allocator.allocate(baseform, entry_text)
+
+    def convert_entry(self, fp, *, jobs: int = 1) -> Generator[FulaOrd, None, None]:  # noqa: ANN001
+        """Generate converted entries from file.
+
+        With `jobs` > 1 the records are parsed in a pool of processes, while ids
+        and the wordform map are assigned here in input order, so the result is
+        identical to the serial conversion.
+        """
+        yield from self.convert_records(iter_records(fp), jobs=jobs)
+
+    def convert_records(
+        self, records: Iterable[tuple[str, str]], *, jobs: int = 1
+    ) -> Generator[FulaOrd, None, None]:
+        """Generate converted entries from (header, rest) records.
+
+        See `iter_records` and the `record_scanner` module for how to split an
+        export into records. Every record is validated when it is parsed.
+        """
+        for record in iter_parsed(records, jobs=jobs):
+            yield self.build_entry(record)
+
+    def convert_compact(
+        self,
+        records: Iterable[tuple[str, str]],
+        *,
+        jobs: int = 1,
+        validator: Validator | None = None,
+    ) -> Generator[FulaOrdRecord, None, None]:
+        """Generate compact entries from (header, rest) records.
+
+        Like `convert_records`, but only the records picked by `validator` are
+        validated as `FulaOrd`, see `iter_parsed`. Defaults to validating every record.
+        """
+        yield from self.convert_parsed(iter_parsed(records, jobs=jobs, validator=validator))
+
+    def convert_parsed(
+        self, parsed_records: Iterable[ParsedRecord]
+    ) -> Generator[FulaOrdRecord, None, None]:
+        """Generate compact entries from records that are already parsed and validated.
+
+        Ids are assigned in the order of `parsed_records`, see `convert_compact`.
+        """
+        for parsed in parsed_records:
+            yield self.build_record(parsed)
+
+    def build_record(self, record: ParsedRecord) -> FulaOrdRecord:
+        """Assign an id to a parsed record and register its wordforms."""
+        entry_id = self.generate_id(record.baseform, record.text)
+        self.fulaord_wordforms[record.baseform] = entry_id
+        for wordform in record.wordforms:
+            self.fulaord_wordforms[wordform] = entry_id
+        return FulaOrdRecord(
+            baseform=record.baseform,
+            id=entry_id,
+            wordforms=record.wordforms + record.alternates,
+            text=record.text,
+            jfr=record.jfr,
+        )
+
+    def build_entry(self, record: ParsedRecord) -> FulaOrd:
+        """Assign an id to a validated record and register its wordforms."""
+        return FulaOrd.model_construct(**self.build_record(record).to_dict())
+
+    def resolve_jfr(self, jfrs: list[str]) -> list[str]:
+        """Replace the wordforms in jfr with the ids of their entries, when known."""
+        final_id = self.id_allocator.final_id
+        return [final_id(self.fulaord_wordforms.get(jfr, jfr)) for jfr in jfrs]
 
     def update_jfr(self, lex_iter: Iterable[FulaOrd]) -> Generator[FulaOrd, None, None]:
-        """Update jfr field."""
+        """Update jfr field, and settle the ids of all converted entries.
+
+        With a registry, all entries must be converted before this is called.
+        """
+        self.id_allocator.finish()
         for obj in lex_iter:
+            obj.id = self.id_allocator.final_id(obj.id)
             if obj.jfr:
-                new_jfrs = []
-                for jfr in obj.jfr:
-                    if jfr in self.fulaord_wordforms:
-                        new_jfrs.append(self.fulaord_wordforms[jfr])
-                    else:
-                        new_jfrs.append(jfr)
-                obj.jfr = new_jfrs
+                obj.jfr = self.resolve_jfr(obj.jfr)
             yield obj
+
+    def spill_entries(
+        self,
+        records: Iterable[tuple[str, str]],
+        spill_path: Path,
+        *,
+        jobs: int = 1,
+        validator: Validator | None = None,
+    ) -> int:
+        """Convert records to a spill file (first pass).
+
+        Only the id set and the wordform map are kept in memory, the entries are
+        written as compact json lines to `spill_path`. See `convert_compact` for
+        `validator`.
+
+        Returns:
+            int: the number of entries written
+        """
+        return self.spill_parsed(
+            iter_parsed(records, jobs=jobs, validator=validator), spill_path
+        )
+
+    def spill_parsed(self, parsed_records: Iterable[ParsedRecord], spill_path: Path) -> int:
+        """Convert parsed and validated records to a spill file, like `spill_entries`.
+
+        Returns:
+            int: the number of entries written
+        """
+        return self.spill_records(self.convert_parsed(parsed_records), spill_path)
+
+    @staticmethod
+    def spill_records(records: Iterable[FulaOrdRecord], spill_path: Path) -> int:
+        """Write converted records to a spill file, for `iter_spilled`.
+
+        Returns:
+            int: the number of entries written
+        """
+        count = 0
+        with spill_path.open("wb") as spill:
+            for record in records:
+                spill.write(orjson.dumps(record.to_dict()))
+                spill.write(b"\n")
+                count += 1
+        return count
+
+    def iter_spilled(self, spill_path: Path) -> Iterator[dict[str, Any]]:
+        """Stream entries back from a spill file with jfr resolved (second pass)."""
+        self.id_allocator.finish()
+        with spill_path.open("rb") as spill:
+            for line in spill:
+                entry = orjson.loads(line)
+                entry["id"] = self.id_allocator.final_id(entry["id"])
+                if entry["jfr"]:
+                    entry["jfr"] = self.resolve_jfr(entry["jfr"])
+                yield entry
@@ -0,0 +1,217 @@
+"""Allocate entry ids, kept stable across releases by a registry.
+
+An id is the baseform in lower case, with spaces and commas replaced by '_' and
+the diacritics shaved off, followed by a counter: 'sätta på' gets 'satta_pa..1'.
+Homographs, and other baseforms with the same key, get the next counter.
+
+The registry remembers the ids every baseform had in the previous releases,
+with a fingerprint of the text of their entries. An entry of a baseform in the
+registry gets the id of the entry with the same text, or else, in order, one of
+the ids whose entries changed or were removed. Only the remaining entries get a
+new id, so ids don't shift when entries are added or removed elsewhere in the
+export, and an id is never given to an entry with another baseform.
+
+The ids of the baseforms in the registry are only known when all entries have
+been allocated, until then they get a pending id. `finish` settles them and
+`final_id` replaces a pending id with its final one:
+
+    allocator = IdAllocator(IdRegistry.load(path))
+    entry_ids = [allocator.allocate(entry.baseform, entry.text) for entry in entries]
+    allocator.finish()
+    entry_ids = [allocator.final_id(entry_id) for entry_id in entry_ids]
+"""
+
+import functools
+import hashlib
+from collections.abc import Iterable, MutableMapping, MutableSet
+from pathlib import Path
+from typing import Any
+
+import orjson
+
+from resource_fula_ordboken import text
+from resource_fula_ordboken.shared.memory_budget import MemoryBudget, SpillDict, SpillSet
+
+REGISTRY_FORMAT = "1"
+KEY_MEMO_SIZE = 1 << 16
+PENDING_PREFIX = "..pending."
+
+
+@functools.lru_cache(maxsize=KEY_MEMO_SIZE)
+def id_key(baseform: str) -> str:
+    """Fold a baseform to the key of its ids.
+
+    >>> id_key('Sätta på')
+    'satta_pa'
+    """
+    return text.shave_marks(baseform.replace(" ", "_").replace(",", "_").lower())
+
+
+def fingerprint(entry_text: str) -> str:
+    """Hash the text of an entry, to recognize it in the next release."""
+    return hashlib.blake2b(entry_text.encode(), digest_size=8).hexdigest()
+
+
+class IdRegistry:
+    """The ids and text fingerprints of every baseform, in the order of their entries."""
+
+    def __init__(self, ids: dict[str, list[tuple[str, str]]] | None = None) -> None:
+        """Create a registry from the (id, fingerprint) pairs of every baseform."""
+        self.ids = ids or {}
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[dict[str, Any]]) -> "IdRegistry":
+        """Seed a registry from converted entries, like those of the previous release."""
+        ids: dict[str, list[tuple[str, str]]] = {}
+        for entry in entries:
+            ids.setdefault(entry["baseform"], []).append(
+                (entry["id"], fingerprint(entry["text"]))
+            )
+        return cls(ids)
+
+    @classmethod
+    def from_jsonl(cls, path: Path) -> "IdRegistry":
+        """Seed a registry from the converted jsonl of the previous release."""
+        import json_arrays
+
+        return cls.from_entries(json_arrays.load_from_file(path))
+
+    @classmethod
+    def load(cls, path: Path) -> "IdRegistry":
+        """Read a registry written by `write`.
+
+        Raises:
+            ValueError: if the file is not an id registry.
+        """
+        data = orjson.loads(path.read_bytes())
+        if not isinstance(data, dict) or data.get("format") != REGISTRY_FORMAT:
+            raise ValueError(f"'{path}' is not an id registry")
+        return cls({baseform: list(map(tuple, ids)) for baseform, ids in data["ids"].items()})
+
+    def digest(self) -> str:
+        """Hash the registry, for the key of a cached conversion."""
+        return hashlib.sha256(orjson.dumps(self.ids)).hexdigest()
+
+    def write(self, path: Path) -> None:
+        """Write the registry as json, replacing the file when done."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_bytes(orjson.dumps({"format": REGISTRY_FORMAT, "ids": self.ids}))
+        tmp_path.replace(path)
+
+
+class IdAllocator:
+    """Give out unique ids, keeping the ids of a registry."""
+
+    def __init__(
+        self,
+        registry: IdRegistry | None = None,
+        *,
+        keep_registry: bool = False,
+        budget: MemoryBudget | None = None,
+    ) -> None:
+        """Start allocating.
+
+        Args:
+            registry (IdRegistry | None, optional): the ids of the previous release. Defaults to None.
+            keep_registry (bool, optional): collect the ids for `registry`, also without a previous one. Defaults to False.
+            budget (MemoryBudget | None, optional): move the given out ids to disk when it is exceeded. Defaults to None.
+        """  # noqa: E501
+        self.previous = registry.ids if registry else {}
+        self.ids: MutableSet[str] = SpillSet(budget, "ids") if budget else set()
+        self._reserved = {entry_id for ids in self.previous.values() for entry_id, _ in ids}
+        self._next: MutableMapping[str, int] = SpillDict(budget, "id counters") if budget else {}
+        # the (pending id, fingerprint) of the entries of every baseform in the registry
+        self._pending: dict[str, list[tuple[str, str]]] = {}
+        self._num_pending = 0
+        self._final: dict[str, str] = {}
+        self._finished = False
+        self._assigned: dict[str, list[tuple[str, str]]] | None = (
+            {} if registry is not None or keep_registry else None
+        )
+
+    def allocate(self, baseform: str, entry_text: str = "") -> str:
+        """Give the next entry with baseform its id, or a pending id, see `final_id`.
+
+        Raises:
+            ValueError: if the pending ids are already settled.
+        """
+        if baseform in self.previous:
+            if self._finished:
+                raise ValueError("the ids are already settled, allocate all before 'finish'")
+            pending_id = f"{PENDING_PREFIX}{self._num_pending}"
+            self._num_pending += 1
+            self._pending.setdefault(baseform, []).append((pending_id, fingerprint(entry_text)))
+            return pending_id
+        entry_id = self._new_id(baseform)
+        if self._assigned is not None:
+            self._assigned.setdefault(baseform, []).append((entry_id, fingerprint(entry_text)))
+        return entry_id
+
+    def _new_id(self, baseform: str) -> str:
+        key = id_key(baseform)
+        # every id of a key is allocated from its counter, so the counter is
+        # the first free id unless the registry holds some of the next ones
+        i = self._next.get(key, 1)
+        entry_id = f"{key}..{i}"
+        while entry_id in self.ids or entry_id in self._reserved:
+            i += 1
+            entry_id = f"{key}..{i}"
+        self._next[key] = i + 1
+        self.ids.add(entry_id)
+        return entry_id
+
+    def finish(self) -> None:
+        """Settle the pending ids, once all entries are allocated."""
+        if self._finished:
+            return
+        self._finished = True
+        for baseform, pending in self._pending.items():
+            previous = self.previous[baseform]
+            unclaimed = dict.fromkeys(range(len(previous)))
+            by_fingerprint: dict[str, list[int]] = {}
+            for nr, (_, fp) in enumerate(previous):
+                by_fingerprint.setdefault(fp, []).append(nr)
+            claimed: list[int | None] = []
+            for _, fp in pending:
+                match = next((nr for nr in by_fingerprint.get(fp, []) if nr in unclaimed), None)
+                if match is not None:
+                    del unclaimed[match]
+                claimed.append(match)
+            # entries with a changed text take the ids of the changed or removed ones
+            leftover = iter(list(unclaimed))
+            for pos, claimed_nr in enumerate(claimed):
+                if claimed_nr is None:
+                    claimed[pos] = next(leftover, None)
+            for (pending_id, fp), claimed_nr in zip(pending, claimed, strict=True):
+                entry_id = (
+                    self._new_id(baseform) if claimed_nr is None else previous[claimed_nr][0]
+                )
+                self.ids.add(entry_id)
+                self._final[pending_id] = entry_id
+                if self._assigned is not None:
+                    self._assigned.setdefault(baseform, []).append((entry_id, fp))
+
+    def final_id(self, entry_id: str) -> str:
+        """Replace a pending id with its final id, other ids are returned as they are."""
+        return self._final.get(entry_id, entry_id) if self._final else entry_id
+
+    def registry(self) -> IdRegistry:
+        """Return the registry for the next release.
+
+        It has the ids given out now, followed by the ids of the previous
+        releases that were not used now, so they stay reserved.
+
+        Raises:
+            ValueError: if the allocator doesn't keep a registry.
+        """
+        if self._assigned is None:
+            raise ValueError("the allocator was created without keep_registry")
+        self.finish()
+        ids = {baseform: list(previous) for baseform, previous in self.previous.items()}
+        for baseform, assigned in self._assigned.items():
+            used = {entry_id for entry_id, _ in assigned}
+            ids[baseform] = assigned + [
+                (entry_id, fp) for entry_id, fp in ids.get(baseform, []) if entry_id not in used
+            ]
+        return IdRegistry(ids)
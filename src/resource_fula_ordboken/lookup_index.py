@@ -0,0 +1,317 @@
+"""Look up single entries of a converted release without reading all of it.
+
+The jsonl of a release is written in blocked mode, as independent gzip members
+of about `DEFAULT_BLOCK_SIZE` bytes, and a SQLite index is written next to it
+with the gzip member and position of every entry, and the ids of the entries of
+every baseform and wordform. An entry is then read by decompressing only its
+member:
+
+    with LookupIndex.open(Path("fula_ordboken.jsonl.gz")) as index:
+        index.get("knulla..1")
+        index.entries_for("sätta på")
+        index.search("sät")
+
+The wordforms are those of the entries, so they include what the converter
+resolves jfr references with. Looking up and searching forms ignores case.
+"""
+
+import sqlite3
+import zlib
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any
+
+import orjson
+
+from resource_fula_ordboken.shared import files, jsonl_sink
+
+INDEX_FORMAT = "1"
+DEFAULT_BLOCK_SIZE = 64 << 10
+DEFAULT_SEARCH_LIMIT = 50
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE blocks (
+    nr INTEGER PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    data_offset INTEGER NOT NULL
+);
+CREATE TABLE entries (
+    id TEXT PRIMARY KEY,
+    block INTEGER NOT NULL,
+    data_offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE forms (
+    folded TEXT NOT NULL,
+    form TEXT NOT NULL,
+    id TEXT NOT NULL,
+    PRIMARY KEY (folded, form, id)
+) WITHOUT ROWID;
+"""
+
+
+def default_index_path(jsonl: Path) -> Path:
+    """Name the index after the jsonl.
+
+    >>> default_index_path(Path('out/fula_ordboken.jsonl.gz'))
+    PosixPath('out/fula_ordboken.lookup.sqlite')
+    """
+    return jsonl.with_name(f"{files.real_stem(jsonl.name)}.lookup.sqlite")
+
+
+class LookupIndexWriter:
+    """Write entries as blocked jsonl and index them, see `write_indexed`."""
+
+    def __init__(
+        self,
+        jsonl: Path,
+        index_path: Path | None = None,
+        *,
+        compresslevel: int = jsonl_sink.DEFAULT_COMPRESSLEVEL,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+    ) -> None:
+        """Start writing jsonl, the index is written when closed.
+
+        Raises:
+            ValueError: if jsonl is not gzipped, only gzip members can be read alone
+        """
+        if jsonl.suffix != ".gz":
+            raise ValueError(f"a lookup index needs a gzipped jsonl, not '{jsonl.name}'")
+        self.jsonl = jsonl
+        self.index_path = index_path or default_index_path(jsonl)
+        self.sink = jsonl_sink.JsonlSink(
+            jsonl, compress=True, compresslevel=compresslevel, block_size=block_size
+        )
+        self._tmp_path = self.index_path.with_name(f"{self.index_path.name}.swp")
+        self._tmp_path.unlink(missing_ok=True)
+        self._conn = sqlite3.connect(self._tmp_path)
+        self._conn.executescript(_SCHEMA)
+        # the uncompressed offset of every block: the sink cuts a block when it
+        # hands over its buffer, so the lines of a block share the offset of the buffer
+        self._block_starts: list[int] = []
+
+    def write(self, entry: dict[str, Any]) -> None:
+        """Write an entry and index its id, baseform and wordforms."""
+        block_start = self.sink.bytes_in
+        if not self._block_starts or self._block_starts[-1] != block_start:
+            self._block_starts.append(block_start)
+        start = self.sink.size
+        self.sink.write(entry)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+            (
+                entry["id"],
+                len(self._block_starts) - 1,
+                start - block_start,
+                self.sink.size - start,
+            ),
+        )
+        forms = dict.fromkeys([entry["baseform"], *entry["wordforms"]])
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO forms VALUES (?, ?, ?)",
+            ((form.casefold(), form, entry["id"]) for form in forms),
+        )
+
+    def write_all(self, entries: Iterable[dict[str, Any]]) -> int:
+        """Write all entries.
+
+        Returns:
+            int: the number of entries written
+        """
+        count = 0
+        for entry in entries:
+            self.write(entry)
+            count += 1
+        return count
+
+    def close(self) -> None:
+        """Close the jsonl and write the index next to it."""
+        self.sink.close()
+        self._conn.executemany(
+            "INSERT INTO blocks VALUES (?, ?, ?, ?)",
+            (
+                (nr, block.offset, block.length, data_offset)
+                for nr, (block, data_offset) in enumerate(
+                    zip(self.sink.blocks, self._block_starts, strict=True)
+                )
+            ),
+        )
+        stat = self.jsonl.stat()
+        self._conn.executemany(
+            "INSERT INTO meta VALUES (?, ?)",
+            [
+                ("format", INDEX_FORMAT),
+                ("size", str(stat.st_size)),
+                ("mtime_ns", str(stat.st_mtime_ns)),
+                ("digest", self.sink.sha256),
+            ],
+        )
+        self._conn.commit()
+        self._conn.close()
+        self._tmp_path.replace(self.index_path)
+
+    def abort(self) -> None:
+        """Stop writing, the index is not written."""
+        self.sink.close()
+        self._conn.close()
+        self._tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "LookupIndexWriter":  # noqa: D105
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, *_exc: object) -> None:
+        """Write the index, unless failing."""
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_indexed(
+    entries: Iterable[dict[str, Any]],
+    jsonl: Path,
+    index_path: Path | None = None,
+    *,
+    compresslevel: int = jsonl_sink.DEFAULT_COMPRESSLEVEL,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> jsonl_sink.JsonlSink:
+    """Write entries as blocked jsonl with a lookup index next to it.
+
+    Returns:
+        jsonl_sink.JsonlSink: the closed sink of the jsonl, with its statistics
+    """
+    with LookupIndexWriter(
+        jsonl, index_path, compresslevel=compresslevel, block_size=block_size
+    ) as writer:
+        writer.write_all(entries)
+    return writer.sink
+
+
+class LookupIndex:
+    """Read entries of a converted release by id, form or prefix of a form."""
+
+    def __init__(self, conn: sqlite3.Connection, jsonl: Path) -> None:
+        """Use an open index, see `LookupIndex.open`."""
+        self.conn = conn
+        self.jsonl = jsonl
+        self._fp = jsonl.open("rb")
+        # the last decompressed block, lookups of related entries often share it
+        self._block: tuple[int, bytes] | None = None
+
+    @classmethod
+    def open(cls, jsonl: Path, index_path: Path | None = None) -> "LookupIndex":
+        """Open the index of a converted jsonl.
+
+        Raises:
+            ValueError: if the index is missing or stale
+        """
+        index_path = index_path or default_index_path(jsonl)
+        if not index_path.exists():
+            raise ValueError(
+                f"no lookup index found at '{index_path}',"
+                " write it with 'clean2karp --lookup-index'"
+            )
+        conn = sqlite3.connect(f"{index_path.resolve().as_uri()}?mode=ro", uri=True)
+        index = cls(conn, jsonl)
+        if index.is_stale():
+            index.close()
+            raise ValueError(f"the lookup index '{index_path}' doesn't match '{jsonl}'")
+        return index
+
+    def close(self) -> None:
+        """Close the index and the jsonl."""
+        self.conn.close()
+        self._fp.close()
+
+    def __enter__(self) -> "LookupIndex":  # noqa: D105
+        return self
+
+    def __exit__(self, *_exc: object) -> None:  # noqa: D105
+        self.close()
+
+    def meta(self) -> dict[str, str]:
+        """Return the recorded metadata of the index."""
+        return dict(self.conn.execute("SELECT key, value FROM meta"))
+
+    def is_stale(self) -> bool:
+        """Check if the jsonl has changed since the index was written.
+
+        The digest is only computed when the size matches but the mtime has changed.
+        """
+        meta = self.meta()
+        if meta.get("format") != INDEX_FORMAT:
+            return True
+        stat = self.jsonl.stat()
+        if str(stat.st_size) != meta.get("size"):
+            return True
+        if str(stat.st_mtime_ns) == meta.get("mtime_ns"):
+            return False
+        return files.file_digest(self.jsonl) != meta.get("digest")
+
+    def __len__(self) -> int:  # noqa: D105
+        return self.conn.execute("SELECT count(*) FROM entries").fetchone()[0]
+
+    def __contains__(self, entry_id: object) -> bool:  # noqa: D105
+        return (
+            self.conn.execute("SELECT 1 FROM entries WHERE id = ?", (entry_id,)).fetchone()
+            is not None
+        )
+
+    def get(self, entry_id: str) -> dict[str, Any] | None:
+        """Read the entry with the given id."""
+        row = self.conn.execute(
+            "SELECT block, data_offset, length FROM entries WHERE id = ?", (entry_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        block_nr, start, length = row
+        return orjson.loads(self._read_block(block_nr)[start : start + length])
+
+    def ids_for(self, form: str) -> list[str]:
+        """Return the ids of the entries with form as baseform or wordform, in order."""
+        return [
+            entry_id
+            for (entry_id,) in self.conn.execute(
+                "SELECT DISTINCT forms.id FROM forms JOIN entries ON entries.id = forms.id"
+                " WHERE folded = ? ORDER BY block, data_offset",
+                (form.casefold(),),
+            )
+        ]
+
+    def entries_for(self, form: str) -> list[dict[str, Any]]:
+        """Read the entries with form as baseform or wordform."""
+        return [entry for entry_id in self.ids_for(form) if (entry := self.get(entry_id))]
+
+    def search(self, prefix: str, *, limit: int = DEFAULT_SEARCH_LIMIT) -> list[tuple[str, str]]:
+        """Return (form, id) of the forms starting with prefix, in alphabetical order."""
+        folded = prefix.casefold()
+        return list(
+            self.conn.execute(
+                "SELECT form, id FROM forms WHERE folded >= ? AND folded < ?"
+                " ORDER BY folded, form, id LIMIT ?",
+                (folded, f"{folded}\U0010ffff", limit),
+            )
+        )
+
+    def iter_ids(self) -> Iterator[str]:
+        """Yield every indexed id, in the order of the jsonl."""
+        return (
+            entry_id
+            for (entry_id,) in self.conn.execute(
+                "SELECT id FROM entries ORDER BY block, data_offset"
+            )
+        )
+
+    def _read_block(self, block_nr: int) -> bytes:
+        if self._block is not None and self._block[0] == block_nr:
+            return self._block[1]
+        offset, length = self.conn.execute(
+            "SELECT offset, length FROM blocks WHERE nr = ?", (block_nr,)
+        ).fetchone()
+        self._fp.seek(offset)
+        # every block is a complete gzip member
+        data = zlib.decompress(self._fp.read(length), wbits=31)
+        self._block = (block_nr, data)
+        return data
@@ -1,8 +1,17 @@
 """Data models for Fula Ordboken."""
 
+from typing import Any
+
 import karp_lex_types
 import pydantic
 
+# re-exported, they used to live here
+from resource_fula_ordboken.validation import (  # noqa: F401
+    DEFAULT_VALIDATE_EVERY,
+    Validation,
+    Validator,
+)
+
 
 class FulaOrd(pydantic.BaseModel):
     """Data model for a Fula Ordboken entry."""
@@ -23,3 +32,72 @@ UpdateFulaOrdEntry = karp_lex_types.commands.GenericUpdateEntry[FulaOrd]
 DeleteFulaOrdEntry = karp_lex_types.commands.DeleteEntry
 
 FulaOrdEntryCmd = AddFulaOrdEntry | DeleteFulaOrdEntry | UpdateFulaOrdEntry
+
+
+class FulaOrdRecord:
+    """Compact, unvalidated Fula Ordboken entry for the conversion hot path.
+
+    `to_dict` gives the same dict as `FulaOrd.model_dump`.
+    """
+
+    __slots__ = ("baseform", "id", "jfr", "text", "wordforms")
+
+    def __init__(
+        self,
+        baseform: str,
+        id: str,  # noqa: A002
+        wordforms: list[str],
+        text: str,
+        jfr: list[str] | None,
+    ) -> None:
+        """Create a record, nothing is validated."""
+        self.baseform = baseform
+        self.id = id
+        self.wordforms = wordforms
+        self.text = text
+        self.jfr = jfr
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert to a dict with the fields of `FulaOrd`."""
+        return {
+            "baseform": self.baseform,
+            "id": self.id,
+            "wordforms": self.wordforms,
+            "text": self.text,
+            "jfr": self.jfr,
+        }
+
+    def validate(self) -> FulaOrd:
+        """Validate the record as a `FulaOrd`."""
+        return FulaOrd(**self.to_dict())
+
+
+class FulaOrdExportRecord:
+    """Compact, unvalidated entry from a Karp export for the diff hot path."""
+
+    __slots__ = ("entry", "id", "resource", "version")
+
+    def __init__(
+        self,
+        id: str,  # noqa: A002
+        version: int | None,
+        resource: str | None,
+        entry: dict[str, Any],
+    ) -> None:
+        """Create a record, nothing is validated."""
+        self.id = id
+        self.version = version
+        self.resource = resource
+        self.entry = entry
+
+    @classmethod
+    def from_export(cls, obj: dict[str, Any], *, validate: bool = True) -> "FulaOrdExportRecord":
+        """Create a record from an exported object, validating it as a `FulaOrdEntry`."""
+        if validate:
+            entry = FulaOrdEntry(**obj)
+            return cls(str(entry.id), entry.version, entry.resource, entry.entry.model_dump())
+        return cls(obj["id"], obj.get("version"), obj.get("resource"), obj["entry"])
+
+    def __reduce__(self) -> tuple[type["FulaOrdExportRecord"], tuple[Any, ...]]:
+        """Pickle as a plain tuple, records are sent back from worker processes."""
+        return type(self), (self.id, self.version, self.resource, self.entry)
@@ -0,0 +1,137 @@
+"""Reconvert only the records that changed since the previous release.
+
+A record manifest, written next to the converted jsonl, maps the hash of every
+raw record of the export to the record as it was parsed. When the next export
+is converted with the manifest of the previous release, unchanged records are
+taken from the manifest instead of being parsed and validated again.
+
+Ids are still assigned and jfr references resolved over all records in export
+order, so the result is identical to converting the whole export. A manifest
+written by another version of this package is not used, since the parser may
+have changed.
+"""
+
+import gzip
+import hashlib
+import itertools
+from collections import deque
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+import orjson
+
+import resource_fula_ordboken
+from resource_fula_ordboken.fula_ord_converter import (
+    RECORDS_PER_CHUNK,
+    ParsedRecord,
+    parse_batch,
+)
+from resource_fula_ordboken.shared import files, jsonl_sink, parallel
+from resource_fula_ordboken.validation import Validator
+
+MANIFEST_FORMAT = "1"
+
+
+def manifest_path(json_output: Path) -> Path:
+    """Name the record manifest after the converted jsonl.
+
+    >>> manifest_path(Path('out/fula_ordboken.jsonl.gz'))
+    PosixPath('out/fula_ordboken.records.jsonl.gz')
+    """
+    return json_output.with_name(f"{files.real_stem(json_output.name)}.records.jsonl.gz")
+
+
+def record_hash(header: str, rest: str) -> str:
+    """Hash a raw (header, rest) record."""
+    return hashlib.blake2b(f"{header}{rest}".encode(), digest_size=16).hexdigest()
+
+
+class RecordManifest:
+    """The parsed records of the previous release, by the hash of their raw record."""
+
+    def __init__(self, previous: dict[str, ParsedRecord] | None = None) -> None:
+        """Reuse the given parsed records, or none."""
+        self.previous = previous or {}
+        self.reused = 0
+        self.parsed = 0
+
+    @classmethod
+    def load(cls, path: Path) -> "RecordManifest":
+        """Read a manifest, one written by another version is read as empty.
+
+        Raises:
+            ValueError: if the file is not a record manifest.
+        """
+        previous: dict[str, ParsedRecord] = {}
+        with gzip.open(path, "rb") as fp:
+            header = orjson.loads(fp.readline() or b"null")
+            if not isinstance(header, dict) or header.get("format") != MANIFEST_FORMAT:
+                raise ValueError(f"'{path}' is not a record manifest")
+            if header.get("version") != resource_fula_ordboken.__version__:
+                return cls()
+            for line in fp:
+                digest, *fields = orjson.loads(line)
+                previous[digest] = ParsedRecord(*fields)
+        return cls(previous)
+
+    def iter_parsed(
+        self,
+        records: Iterable[tuple[str, str]],
+        *,
+        jobs: int = 1,
+        sink: jsonl_sink.JsonlSink | None = None,
+        validator: Validator | None = None,
+    ) -> Iterator[ParsedRecord]:
+        """Parse the records that are not in the manifest, in order.
+
+        The new records are parsed, and those picked by `validator` validated, in
+        a pool of `jobs` processes if more than one. Reused records were validated
+        when they were first parsed. Every record is also written to `sink`, see
+        `open_sink`, to make the manifest of this release.
+
+        Yields:
+            ParsedRecord: the parsed record
+        """
+        validator = validator or Validator()
+        # the hash and the reused record, if any, of each chunk sent to be parsed
+        plans: deque[list[tuple[str, ParsedRecord | None]]] = deque()
+
+        def new_records() -> Iterator[tuple[list[tuple[str, str]], list[bool]]]:
+            for chunk in parallel.chunked(records, RECORDS_PER_CHUNK):
+                plan = [
+                    (digest, self.previous.get(digest))
+                    for digest in itertools.starmap(record_hash, chunk)
+                ]
+                plans.append(plan)
+                new = [
+                    record
+                    for record, (_, reused) in zip(chunk, plan, strict=True)
+                    if reused is None
+                ]
+                yield new, [validator.should_validate() for _ in new]
+
+        parsed_chunks = (
+            parallel.ordered_map(parse_batch, new_records(), jobs=jobs)
+            if jobs > 1
+            else map(parse_batch, new_records())
+        )
+        for parsed_chunk in parsed_chunks:
+            parsed = iter(parsed_chunk)
+            for digest, reused in plans.popleft():
+                if reused is None:
+                    record = next(parsed)
+                    self.parsed += 1
+                else:
+                    record = reused
+                    self.reused += 1
+                if sink is not None:
+                    sink.write([digest, *record])
+                yield record
+
+
+def open_sink(path: Path) -> jsonl_sink.JsonlSink:
+    """Start writing the manifest of this release, pass it to `iter_parsed`."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    sink = jsonl_sink.JsonlSink(path, compress=True)
+    sink.write({"format": MANIFEST_FORMAT, "version": resource_fula_ordboken.__version__})
+    return sink
@@ -0,0 +1,114 @@
+"""Find the records of the cleaned Fula Ordboken export in large buffers.
+
+A record starts at the beginning of the export or at a line starting with
+'%word_word%' and its first line is the header. These scanners yield the same
+(header, rest) pairs as `fula_ord_converter.iter_records` does for the lines of
+the file, but search for the record boundaries in memory-mapped files or large
+buffers instead of looking at every line.
+"""
+
+import io
+import mmap
+from collections.abc import Iterator
+from pathlib import Path
+from typing import IO
+
+from resource_fula_ordboken.fula_ord_converter import iter_records
+
+RECORD_MARKER = b"\n%word_word%"
+DEFAULT_BUFFER_SIZE = 1 << 22
+_STR_MARKER = RECORD_MARKER.decode()
+
+
+def iter_buffer_records(
+    buf: bytes | mmap.mmap, *, block_size: int = DEFAULT_BUFFER_SIZE
+) -> Iterator[tuple[str, str]]:
+    """Yield the records of an utf-8 encoded buffer.
+
+    The buffer is cut into blocks of whole records, each block is decoded
+    straight from a slice of the buffer and split on the record marker in one
+    search. Buffers with carriage returns are decoded with universal newlines,
+    like a text file.
+
+    Yields:
+        tuple[str, str]: the header line and the rest of the record
+    """
+    if buf.find(b"\r") != -1:
+        yield from iter_records(io.StringIO(str(buf[:], "utf-8"), newline=None))
+        return
+    with memoryview(buf) as view:
+        for start, end in _iter_blocks(buf, block_size):
+            pieces = str(view[start:end], "utf-8").split(_STR_MARKER)
+            last = len(pieces) - 1
+            for nr, piece in enumerate(pieces):
+                prefix = "%word_word%" if nr else ""
+                suffix = "\n" if nr < last else ""
+                header_end = piece.find("\n")
+                if header_end == -1:
+                    yield prefix + piece + suffix, ""
+                else:
+                    yield prefix + piece[: header_end + 1], piece[header_end + 1 :] + suffix
+
+
+def _iter_blocks(buf: bytes | mmap.mmap, block_size: int) -> Iterator[tuple[int, int]]:
+    """Cut the buffer into blocks ending right before a record marker."""
+    size = len(buf)
+    start = 0
+    while start < size:
+        end = min(start + block_size, size)
+        if end < size:
+            boundary = buf.rfind(RECORD_MARKER, start, end)
+            if boundary == -1:
+                boundary = buf.find(RECORD_MARKER, end)
+            end = size if boundary == -1 else boundary + 1
+        yield start, end
+        start = end
+
+
+def iter_file_records(path: Path) -> Iterator[tuple[str, str]]:
+    """Yield the records of a cleaned export by memory-mapping it.
+
+    Yields:
+        tuple[str, str]: the header line and the rest of the record
+    """
+    with path.open("rb") as fp:
+        if path.stat().st_size == 0:
+            return
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            yield from iter_buffer_records(buf)
+
+
+def iter_stream_records(
+    fp: IO[bytes], *, buffer_size: int = DEFAULT_BUFFER_SIZE
+) -> Iterator[tuple[str, str]]:
+    """Yield the records of a binary stream, for example a member of a zip archive.
+
+    The stream is read in large buffers and only the records completed by each
+    buffer are scanned, the incomplete last record is carried over to the next.
+    Newlines are translated like in a text file, one buffer at a time.
+
+    Yields:
+        tuple[str, str]: the header line and the rest of the record
+    """
+    tail = b""
+    carry_cr = False
+    while chunk := fp.read(buffer_size):
+        if carry_cr:
+            chunk = b"\r" + chunk
+        # a trailing '\r' may be the first half of a '\r\n' in the next buffer
+        carry_cr = chunk.endswith(b"\r")
+        if carry_cr:
+            chunk = chunk[:-1]
+        if b"\r" in chunk:
+            chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        buf = tail + chunk if tail else chunk
+        boundary = buf.rfind(RECORD_MARKER)
+        if boundary == -1:
+            tail = buf
+            continue
+        yield from iter_buffer_records(buf[: boundary + 1])
+        tail = buf[boundary + 1 :]
+    if carry_cr:
+        tail += b"\n"
+    if tail:
+        yield from iter_buffer_records(tail)
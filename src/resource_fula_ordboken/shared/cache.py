@@ -0,0 +1,67 @@
+"""Persistent caches shared between runs."""
+
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import orjson
+
+if TYPE_CHECKING:
+    from chardet.resultdict import ResultDict
+
+CACHE_DIR_ENV = "RESOURCE_FULA_ORDBOKEN_CACHE_DIR"
+
+
+def default_cache_dir() -> Path:
+    """Return the cache directory.
+
+    Uses the environment variable RESOURCE_FULA_ORDBOKEN_CACHE_DIR if set,
+    otherwise 'resource-fula-ordboken' under XDG_CACHE_HOME or '~/.cache'.
+    """
+    if cache_dir := os.environ.get(CACHE_DIR_ENV):
+        return Path(cache_dir)
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+    base = Path(xdg_cache_home) if xdg_cache_home else Path.home() / ".cache"
+    return base / "resource-fula-ordboken"
+
+
+class EncodingCache:
+    """Detected encodings keyed by content digest, stored as a json file."""
+
+    def __init__(self, path: Path) -> None:
+        """Use the cache stored at path, it is created on the first `put`."""
+        self.path = path
+        self._results: dict[str, ResultDict] | None = None
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def in_dir(cls, cache_dir: Path | None = None) -> "EncodingCache":
+        """Create the cache in the given or the default cache directory."""
+        return cls((cache_dir or default_cache_dir()) / "encodings.json")
+
+    def _load(self) -> dict[str, "ResultDict"]:
+        if self._results is None:
+            try:
+                self._results = orjson.loads(self.path.read_bytes())
+            except (FileNotFoundError, orjson.JSONDecodeError):
+                self._results = {}
+        return self._results
+
+    def get(self, key: str) -> "ResultDict | None":
+        """Look up the encoding of the content with the given digest."""
+        result = self._load().get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, key: str, result: "ResultDict") -> None:
+        """Store the encoding of the content with the given digest."""
+        results = self._load()
+        results[key] = result
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.swp")
+        tmp_path.write_bytes(orjson.dumps(results))
+        tmp_path.replace(self.path)
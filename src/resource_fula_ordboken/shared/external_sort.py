@@ -0,0 +1,82 @@
+"""External merge sort for streams of JSON objects."""
+
+import gzip
+import heapq
+import tempfile
+from collections.abc import Callable, Iterable, Iterator
+from pathlib import Path
+from typing import Any
+
+import orjson
+
+DEFAULT_CHUNK_SIZE = 10_000
+
+
+def sort_json_objects(
+    objs: Iterable[Any],
+    *,
+    key: Callable[[Any], str],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    tmpdir: Path | None = None,
+) -> Iterator[Any]:
+    """Sort JSON objects by key, spilling sorted runs to disk.
+
+    At most `chunk_size` objects are held in memory while reading the input.
+    If the input fits in one chunk it is sorted in memory, otherwise every chunk
+    is written as a sorted gzipped JSON-lines run and the runs are merged lazily.
+
+    The sort is stable, so objects with equal keys keep their input order.
+
+    Args:
+        objs (Iterable[Any]): the objects to sort
+        key (Callable[[Any], str]): function extracting the sort key
+        chunk_size (int, optional): objects per sorted run. Defaults to DEFAULT_CHUNK_SIZE.
+        tmpdir (Path | None, optional): where to write the runs. Defaults to None.
+
+    Yields:
+        Any: the objects in key order
+    """
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+    with tempfile.TemporaryDirectory(dir=tmpdir, prefix="sort-") as run_dir:
+        runs: list[Path] = []
+        chunk: list[Any] = []
+        for obj in objs:
+            chunk.append(obj)
+            if len(chunk) >= chunk_size:
+                runs.append(
+                    _write_run(chunk, key, Path(run_dir) / f"run-{len(runs):05d}.jsonl.gz")
+                )
+                chunk = []
+        if not runs:
+            chunk.sort(key=key)
+            yield from chunk
+            return
+        if chunk:
+            runs.append(_write_run(chunk, key, Path(run_dir) / f"run-{len(runs):05d}.jsonl.gz"))
+            chunk = []
+        # run and line numbers break ties so that the merge stays stable
+        yield from (
+            obj
+            for _, _, _, obj in heapq.merge(
+                *(_read_run(run, key, nr) for nr, run in enumerate(runs)),
+            )
+        )
+
+
+def _write_run(chunk: list[Any], key: Callable[[Any], str], path: Path) -> Path:
+    chunk.sort(key=key)
+    with gzip.open(path, "wb", compresslevel=1) as fp:
+        for obj in chunk:
+            fp.write(orjson.dumps(obj))
+            fp.write(b"\n")
+    return path
+
+
+def _read_run(
+    path: Path, key: Callable[[Any], str], run_nr: int
+) -> Iterator[tuple[str, int, int, Any]]:
+    with gzip.open(path, "rb") as fp:
+        for line_nr, line in enumerate(fp):
+            obj = orjson.loads(line)
+            yield key(obj), run_nr, line_nr, obj
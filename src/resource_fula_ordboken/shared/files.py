@@ -1,11 +1,25 @@
 """Common file related utilities."""
 
+import codecs
+import hashlib
+import io
+import shutil
+import zipfile
+from collections.abc import Iterator
 from pathlib import Path
-
-from chardet import UniversalDetector
-from chardet.resultdict import ResultDict
+from typing import IO, TYPE_CHECKING
 
 from resource_fula_ordboken import text
+from resource_fula_ordboken.shared.cache import EncodingCache
+
+if TYPE_CHECKING:
+    from chardet.resultdict import ResultDict
+
+DETECT_BUFFER_SIZE = 1 << 20
+DETECT_NUM_SAMPLES = 8
+DETECT_SAMPLE_SIZE = 1 << 16
+# the ioctl cloning a file on Linux (linux/fs.h), supported by btrfs, xfs and others
+_FICLONE = 0x40049409
 
 
 def normalize_file_name(name: str) -> str:
@@ -49,20 +63,114 @@ def real_stem(possible_stem: str) -> str:
         path = Path(path.stem)
 
 
-def detect_encoding(path: Path) -> ResultDict:
+def file_digest(path: Path, *, chunk_size: int = 1 << 20) -> str:
+    """Compute the sha256 digest of a file.
+
+    Args:
+        path (Path): the file to hash
+        chunk_size (int, optional): bytes to read at a time. Defaults to 1 MiB.
+
+    Returns:
+        str: the hex digest
+    """
+    digest = hashlib.sha256()
+    with path.open("rb") as fp:
+        while chunk := fp.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def detect_encoding(path: Path, *, cache: EncodingCache | None = None) -> "ResultDict":
     """Detect encoding of file by reading as little as possible.
 
     Args:
         path (Path): the file to scan
+        cache (EncodingCache | None, optional): cache keyed by the sha256 of the file. Defaults to None.
 
     Returns:
         dict: the result
-    """
-    detector = UniversalDetector()
-    for line in path.open("rb"):
-        detector.feed(line)
-        if detector.done:
+    """  # noqa: E501
+    if cache is None:
+        with path.open("rb") as fp:
+            return detect_stream_encoding(fp)
+    key = f"sha256:{file_digest(path)}"
+    if result := cache.get(key):
+        return result
+    with path.open("rb") as fp:
+        result = detect_stream_encoding(fp)
+    cache.put(key, result)
+    return result
+
+
+def detect_stream_encoding(
+    fp: IO[bytes],
+    *,
+    buffer_size: int = DETECT_BUFFER_SIZE,
+    num_samples: int = DETECT_NUM_SAMPLES,
+    sample_size: int = DETECT_SAMPLE_SIZE,
+    size: int | None = None,
+) -> "ResultDict":
+    """Detect encoding of a binary stream.
+
+    The stream is first checked for valid utf-8 with large buffered reads, which
+    stops at the first invalid byte. Valid utf-8 starting with a byte order mark is
+    reported as UTF-8-SIG, like chardet does, so that decoding drops the mark. Otherwise chardet is fed bounded samples: one
+    around the invalid byte and, if the stream is seekable, up to `num_samples`
+    from evenly spaced offsets.
+
+    Args:
+        fp (IO[bytes]): the stream to scan, it is left partially read
+        buffer_size (int, optional): bytes per read in the utf-8 check. Defaults to 1 MiB.
+        num_samples (int, optional): maximum number of samples for chardet. Defaults to 8.
+        sample_size (int, optional): bytes per sample. Defaults to 64 KiB.
+        size (int | None, optional): size of the stream, if known. Defaults to seeking to the end.
+
+    Returns:
+        dict: the result
+    """  # noqa: E501
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    is_ascii = True
+    num_read = 0
+    failed_chunk, failed_at = b"", 0
+    has_bom = False
+    while chunk := fp.read(buffer_size):
+        if not num_read:
+            has_bom = chunk.startswith(codecs.BOM_UTF8)
+        num_read += len(chunk)
+        if is_ascii and chunk.isascii():
+            continue
+        is_ascii = False
+        try:
+            decoder.decode(chunk)
+        except UnicodeDecodeError as exc:
+            failed_chunk, failed_at = chunk, exc.start
             break
+    else:
+        try:
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            # only a truncated sequence at the end, the whole stream has been read
+            size = num_read
+        else:
+            return {
+                "encoding": "ascii" if is_ascii else "UTF-8-SIG" if has_bom else "utf-8",
+                "confidence": 1.0,
+                "language": "",
+            }
+
+    from chardet import UniversalDetector
+
+    detector = UniversalDetector()
+    start = max(failed_at - sample_size // 2, 0)
+    detector.feed(failed_chunk[start : start + sample_size])
+    if not detector.done and fp.seekable():
+        end = size if size is not None else fp.seek(0, io.SEEK_END)
+        step = max(end // num_samples, sample_size)
+        for offset in range(0, end, step)[:num_samples]:
+            fp.seek(offset)
+            detector.feed(fp.read(sample_size))
+            if detector.done:
+                break
     return detector.close()
 
 
@@ -104,3 +212,116 @@ def change_encoding_to_utf8(src_path: Path, encoding: str | None = None) -> None
             dst_file.write(line)
 
     dst_path.replace(src_path)
+
+
+def detect_zip_member_encoding(
+    zipf: zipfile.ZipFile, info: zipfile.ZipInfo, *, cache: EncodingCache | None = None
+) -> "ResultDict":
+    """Detect the encoding of a member of a zip archive.
+
+    Args:
+        zipf (zipfile.ZipFile): the archive
+        info (zipfile.ZipInfo): the member
+        cache (EncodingCache | None, optional): cache for detected encodings, keyed by the
+            crc32 and size of the member as recorded in the archive. Defaults to None.
+
+    Returns:
+        dict: the result
+    """
+    key = f"zip-crc32:{info.CRC:08x}:{info.file_size}"
+    result = cache.get(key) if cache is not None else None
+    if result is None:
+        with zipf.open(info) as fp:
+            result = detect_stream_encoding(fp, size=info.file_size)
+        if cache is not None:
+            cache.put(key, result)
+    return result
+
+
+def clean_zip_member(
+    zipf: zipfile.ZipFile,
+    name: str,
+    dst_path: Path,
+    encoding: str | None = None,
+    *,
+    cache: EncodingCache | None = None,
+) -> None:
+    """Transcode and unescape a member of a zip archive in one pass.
+
+    The member is decoded incrementally, each line is unescaped and the result
+    is written once as utf-8 to dst_path, without extracting the member first.
+
+    Args:
+        zipf (zipfile.ZipFile): the archive
+        name (str): name of the member
+        dst_path (Path): where to write the cleaned file
+        encoding (str | None, optional): encoding of the member. Defaults to detecting it.
+        cache (EncodingCache | None, optional): cache for detected encodings, keyed by the
+            crc32 and size of the member as recorded in the archive. Defaults to None.
+    """
+    if not encoding:
+        encoding = detect_zip_member_encoding(zipf, zipf.getinfo(name), cache=cache)["encoding"]
+    with zipf.open(name) as src:
+        write_unescaped_utf8(src, dst_path, encoding=encoding)
+
+
+def write_unescaped_utf8(src: IO[bytes], dst_path: Path, *, encoding: str | None) -> None:
+    """Decode src, unescape each line and write it as utf-8 to dst_path.
+
+    Args:
+        src (IO[bytes]): the stream to read
+        dst_path (Path): the file to write
+        encoding (str | None): encoding of src, ascii or None are read as utf-8
+    """
+    with dst_path.open("w", encoding="utf-8") as dst_file:
+        dst_file.writelines(iter_unescaped_lines(src, encoding=encoding))
+
+
+def iter_unescaped_lines(src: IO[bytes], *, encoding: str | None) -> Iterator[str]:
+    """Decode src and yield each line unescaped, src is left open.
+
+    Args:
+        src (IO[bytes]): the stream to read
+        encoding (str | None): encoding of src, ascii, utf-8 or None are read as utf-8
+            without a byte order mark
+
+    Yields:
+        str: the unescaped lines
+    """
+    if encoding in {None, "ascii", "utf-8"}:
+        encoding = "utf-8-sig"
+    src_file = io.TextIOWrapper(src, encoding=encoding)
+    try:
+        for line in src_file:
+            yield text.unescape_str(line)
+    finally:
+        src_file.detach()
+
+
+def clone_or_copy(src: Path, dst: Path) -> None:
+    """Copy src to dst, as a copy-on-write clone if the file system supports it.
+
+    A clone shares its blocks with src until one of them is written to, so it is
+    made in constant time, but unlike a hard link writing to one of the files
+    doesn't change the other.
+
+    Args:
+        src (Path): the file to copy
+        dst (Path): the new path, replaced if it exists
+    """
+    dst.unlink(missing_ok=True)
+    if not _clone(src, dst):
+        shutil.copyfile(src, dst)
+
+
+def _clone(src: Path, dst: Path) -> bool:
+    try:
+        import fcntl
+    except ImportError:  # not on windows
+        return False
+    with src.open("rb") as src_fp, dst.open("wb") as dst_fp:
+        try:
+            fcntl.ioctl(dst_fp.fileno(), _FICLONE, src_fp.fileno())
+        except OSError:
+            return False
+    return True
@@ -0,0 +1,176 @@
+"""Per-stage measurements and a machine-readable report of a run.
+
+A run is started for a command with `start_run`, the use cases wrap their
+stages in `stage(...)` and fill in what they process, and the run is written as
+json with `Run.write`. Without a started run, stages are measured but not kept.
+
+    with instrumentation.stage("convert") as st:
+        st.entries += converter.spill_entries(...)
+        st.add_written(json_output)
+"""
+
+import contextlib
+import contextvars
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from collections.abc import Generator
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+import orjson
+
+import resource_fula_ordboken
+
+REPORT_FORMAT = "1"
+
+
+def max_rss_bytes() -> int:
+    """Return the peak resident set size of this process so far."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS but in KiB elsewhere
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+@dataclass
+class Stage:
+    """Measurements of one stage, the counters are filled in by the stage itself."""
+
+    name: str
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    max_rss_bytes: int = 0
+    peak_traced_bytes: int | None = None
+    entries: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    caches: dict[str, dict[str, int]] = field(default_factory=dict)
+
+    def add_read(self, *paths: Path) -> None:
+        """Count the size of files read by the stage."""
+        self.bytes_read += sum(path.stat().st_size for path in paths)
+
+    def add_written(self, *paths: Path) -> None:
+        """Count the size of files written by the stage."""
+        self.bytes_written += sum(path.stat().st_size for path in paths)
+
+    def add_cache(self, name: str, *, hits: int, misses: int) -> None:
+        """Record the lookups in a cache during the stage."""
+        self.caches[name] = {"hits": hits, "misses": misses}
+
+    def to_dict(self) -> dict[str, Any]:
+        """Return the measurements with throughput and cache hit rates."""
+        result = asdict(self)
+        result["entries_per_s"] = self.entries / self.wall_s if self.wall_s else None
+        for counts in result["caches"].values():
+            lookups = counts["hits"] + counts["misses"]
+            counts["hit_rate"] = counts["hits"] / lookups if lookups else None
+        return result
+
+
+class Run:
+    """The stages measured while running a command."""
+
+    def __init__(self, command: str, *, trace_memory: bool = False) -> None:
+        """Start measuring a run of command."""
+        self.command = command
+        self.trace_memory = trace_memory
+        self.stages: list[Stage] = []
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self._path: list[str] = []
+        # peaks of the open stages that tracemalloc lost when a nested stage reset it
+        self._carried_peaks: list[int] = []
+        self.status = "running"
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Generator[Stage, None, None]:
+        """Measure a stage, nested stages are named 'outer/inner'."""
+        self._path.append(name)
+        current = Stage("/".join(self._path))
+        if self.trace_memory:
+            self._carry_peak()
+            self._carried_peaks.append(0)
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield current
+        finally:
+            current.wall_s = time.perf_counter() - start
+            current.cpu_s = time.process_time() - start_cpu
+            current.max_rss_bytes = max_rss_bytes()
+            if self.trace_memory:
+                current.peak_traced_bytes = max(
+                    self._carried_peaks.pop(), tracemalloc.get_traced_memory()[1]
+                )
+                self._carry_peak(current.peak_traced_bytes)
+            self._path.pop()
+            self.stages.append(current)
+
+    def _carry_peak(self, peak: int | None = None) -> None:
+        """Keep the peak of the innermost open stage before tracemalloc is reset."""
+        if self._carried_peaks:
+            if peak is None:
+                peak = tracemalloc.get_traced_memory()[1]
+            self._carried_peaks[-1] = max(self._carried_peaks[-1], peak)
+
+    def finish(self, status: str = "ok") -> None:
+        """Mark the run as done, later stages are no longer collected."""
+        self.status = status
+        if self.trace_memory:
+            tracemalloc.stop()
+        if _current_run.get() is self:
+            _current_run.set(None)
+
+    def to_dict(self) -> dict[str, Any]:
+        """Return the report of the run."""
+        return {
+            "format": REPORT_FORMAT,
+            "command": self.command,
+            "argv": sys.argv,
+            "version": resource_fula_ordboken.__version__,
+            "python": platform.python_version(),
+            "status": self.status,
+            "started_at": self.started_at,
+            "wall_s": time.perf_counter() - self._start,
+            "cpu_s": time.process_time() - self._start_cpu,
+            "max_rss_bytes": max_rss_bytes(),
+            "stages": [stage.to_dict() for stage in self.stages],
+        }
+
+    def write(self, path: Path) -> None:
+        """Write the report of the run as json."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(orjson.dumps(self.to_dict(), option=orjson.OPT_INDENT_2))
+
+
+_current_run: contextvars.ContextVar[Run | None] = contextvars.ContextVar(
+    "current_run", default=None
+)
+
+
+def start_run(command: str, *, trace_memory: bool = False) -> Run:
+    """Start a run that collects the stages measured from now on."""
+    run = Run(command, trace_memory=trace_memory)
+    _current_run.set(run)
+    return run
+
+
+def current_run() -> Run | None:
+    """Return the started run, if any."""
+    return _current_run.get()
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Generator[Stage, None, None]:
+    """Measure a stage of the current run, or just the stage if no run is started."""
+    run = _current_run.get() or Run("")
+    with run.stage(name) as current:
+        yield current
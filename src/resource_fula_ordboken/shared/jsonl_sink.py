@@ -0,0 +1,223 @@
+"""Fast JSON-lines writer with gzip compression in a background thread."""
+
+import gzip
+import hashlib
+import queue
+import threading
+import zlib
+from collections.abc import Callable, Iterable
+from pathlib import Path
+from types import TracebackType
+from typing import IO, Any, NamedTuple
+
+import orjson
+
+DEFAULT_COMPRESSLEVEL = 6
+DEFAULT_BUFFER_SIZE = 1 << 20
+_QUEUE_SIZE = 4
+
+
+class GzipBlock(NamedTuple):
+    """An independently decompressible gzip member written in blocked mode."""
+
+    offset: int
+    length: int
+    first_line: int
+    num_lines: int
+
+
+class JsonlSink:
+    """Write objects as JSON lines, serialized with orjson.
+
+    Lines are collected in a buffer that is handed to a background thread for
+    compression and writing, so serialization and compression overlap.
+
+    Compression is used when writing to a path ending with '.gz' or when
+    `compress` is given. In blocked mode (`block_size` given) every block of
+    about `block_size` uncompressed bytes, always ending on a line boundary, is
+    written as a separate gzip member. The file is still a valid gzip file, and
+    the members are listed in `blocks` so single blocks can be read by offset.
+    """
+
+    def __init__(
+        self,
+        output: Path | IO[bytes],
+        *,
+        compress: bool | None = None,
+        compresslevel: int = DEFAULT_COMPRESSLEVEL,
+        block_size: int | None = None,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        default: Callable[[Any], Any] | None = None,
+    ) -> None:
+        """Open the sink.
+
+        Args:
+            output (Path | IO[bytes]): path or binary file object to write to
+            compress (bool | None, optional): gzip the output. Defaults to paths ending with '.gz'.
+            compresslevel (int, optional): gzip compression level. Defaults to 6.
+            block_size (int | None, optional): write gzip members of this size. Defaults to one member.
+            buffer_size (int, optional): bytes to collect before handing over. Defaults to 1 MiB.
+            default (Callable[[Any], Any] | None, optional): convert objects orjson can't serialize. Defaults to None.
+        """  # noqa: E501
+        if isinstance(output, Path):
+            self._fp: IO[bytes] = output.open("wb")
+            self._close_fp = True
+            compress = output.suffix == ".gz" if compress is None else compress
+        else:
+            self._fp = output
+            self._close_fp = False
+            compress = bool(compress)
+        self.compress = compress
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        self._default = default
+        self._buffer_size = block_size or buffer_size
+        self._buffer = bytearray()
+        self._buffer_lines = 0
+        self.num_lines = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.blocks: list[GzipBlock] = []
+        self._digest = hashlib.sha256()
+        self._compressor = (
+            zlib.compressobj(compresslevel, zlib.DEFLATED, 31)
+            if compress and not block_size
+            else None
+        )
+        self._queue: queue.Queue[tuple[bytes, int, int] | None] = queue.Queue(_QUEUE_SIZE)
+        self._error: BaseException | None = None
+        self._thread = threading.Thread(target=self._run, name="jsonl-sink", daemon=True)
+        self._thread.start()
+        self._closed = False
+
+    @property
+    def size(self) -> int:
+        """Uncompressed bytes written so far, including those not handed over yet."""
+        return self.bytes_in + len(self._buffer)
+
+    @property
+    def sha256(self) -> str:
+        """The sha256 of the bytes written to the output, complete once closed."""
+        return self._digest.hexdigest()
+
+    def write(self, obj: Any) -> None:
+        """Serialize and write one object."""
+        self._buffer += orjson.dumps(obj, default=self._default)
+        self._buffer += b"\n"
+        self._buffer_lines += 1
+        if len(self._buffer) >= self._buffer_size:
+            self._flush_buffer()
+
+    def write_all(self, objs: Iterable[Any]) -> int:
+        """Write all objects.
+
+        Returns:
+            int: the number of objects written
+        """
+        count = 0
+        for obj in objs:
+            self.write(obj)
+            count += 1
+        return count
+
+    def close(self) -> None:
+        """Flush everything and close the output if it was opened here."""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._flush_buffer()
+            self._queue.put(None)
+            self._thread.join()
+            self._raise_error()
+        finally:
+            if self._close_fp:
+                self._fp.close()
+
+    def __enter__(self) -> "JsonlSink":  # noqa: D105
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Close the sink, not raising errors from the writer when already failing."""
+        if exc_type is None:
+            self.close()
+            return
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _flush_buffer(self) -> None:
+        if not self._buffer:
+            return
+        self._raise_error()
+        data = bytes(self._buffer)
+        self._queue.put((data, self.num_lines, self._buffer_lines))
+        self.num_lines += self._buffer_lines
+        self.bytes_in += len(data)
+        self._buffer.clear()
+        self._buffer_lines = 0
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def _run(self) -> None:
+        try:
+            while (item := self._queue.get()) is not None:
+                data, first_line, num_lines = item
+                if self._compressor is not None:
+                    self._write_out(self._compressor.compress(data))
+                elif self.compress:
+                    offset = self.bytes_out
+                    member = gzip.compress(data, compresslevel=self.compresslevel, mtime=0)
+                    self._write_out(member)
+                    self.blocks.append(GzipBlock(offset, len(member), first_line, num_lines))
+                else:
+                    self._write_out(data)
+            if self._compressor is not None:
+                self._write_out(self._compressor.flush())
+            self._fp.flush()
+        except BaseException as exc:
+            self._error = exc
+            # keep draining so that the producer never blocks on a full queue
+            while self._queue.get() is not None:
+                pass
+
+    def _write_out(self, data: bytes) -> None:
+        if data:
+            self._fp.write(data)
+            self._digest.update(data)
+            self.bytes_out += len(data)
+
+
+def dump_to_file(
+    objs: Iterable[Any],
+    path: Path,
+    *,
+    compresslevel: int = DEFAULT_COMPRESSLEVEL,
+    block_size: int | None = None,
+    default: Callable[[Any], Any] | None = None,
+) -> JsonlSink:
+    """Write objects as JSON lines to path, gzipped if path ends with '.gz'.
+
+    Args:
+        objs (Iterable[Any]): the objects to write
+        path (Path): the file to write
+        compresslevel (int, optional): gzip compression level. Defaults to 6.
+        block_size (int | None, optional): write gzip members of this size. Defaults to one member.
+        default (Callable[[Any], Any] | None, optional): convert objects orjson can't serialize. Defaults to None.
+
+    Returns:
+        JsonlSink: the closed sink, with statistics and the written blocks
+    """  # noqa: E501
+    with JsonlSink(
+        path, compresslevel=compresslevel, block_size=block_size, default=default
+    ) as sink:
+        sink.write_all(objs)
+    return sink
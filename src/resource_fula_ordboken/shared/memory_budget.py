@@ -0,0 +1,271 @@
+"""Keep the large structures of a run within a memory budget.
+
+The structures that grow with the size of the lexicon charge a shared
+`MemoryBudget` for what they hold. `SpillDict` and `SpillSet` start as a plain
+dict and set, and move their contents to a SQLite file in the spill directory
+when the budget is exceeded; the diff instead switches to merging sorted runs
+on disk, see `find_updates`.
+
+The charges are estimates of the size of the python objects, not measurements,
+so the budget bounds what the structures hold rather than the size of the
+process.
+
+    with MemoryBudget(parse_size("512M"), spill_dir=workdir) as budget:
+        wordforms = SpillDict(budget)
+"""
+
+import re
+import sqlite3
+import sys
+import tempfile
+from collections.abc import Iterable, Iterator, MutableMapping, MutableSet
+from pathlib import Path
+from typing import Any, TypeVar
+
+V = TypeVar("V", str, int)
+
+# what a dict or set spends per item besides its keys and values, with some slack
+SLOT_BYTES = 40
+
+_SIZE_PROG = re.compile(r"(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?", re.IGNORECASE)
+_SIZE_UNITS = {"": 0, "k": 10, "m": 20, "g": 30, "t": 40}
+
+
+def parse_size(size: str) -> int:
+    """Parse a size like '512M' or '1.5GiB' as a number of bytes.
+
+    >>> parse_size('512M')
+    536870912
+
+    Raises:
+        ValueError: if size is not a number of bytes with an optional unit.
+    """
+    match = _SIZE_PROG.fullmatch(size.strip())
+    if match is None:
+        raise ValueError(f"'{size}' is not a size, like '512M' or '2G'")
+    return int(float(match.group(1)) * (1 << _SIZE_UNITS[match.group(2).lower()]))
+
+
+def item_bytes(*objs: Any) -> int:
+    """Estimate what an item of a dict or set with these keys and values holds."""
+    return SLOT_BYTES + sum(map(sys.getsizeof, objs))
+
+
+class MemoryBudget:
+    """The bytes the structures of a run may hold in memory together."""
+
+    def __init__(self, max_bytes: int, *, spill_dir: Path | None = None) -> None:
+        """Create a budget, spilling to a temporary directory in spill_dir.
+
+        Raises:
+            ValueError: if max_bytes is not positive.
+        """
+        if max_bytes < 1:
+            raise ValueError(f"the memory budget must be positive, got {max_bytes}")
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.spill_dir = spill_dir
+        # the names of the structures that were moved to disk
+        self.spilled: list[str] = []
+        self._in_memory: list[SpillDict[Any] | SpillSet] = []
+        self._tmpdir: tempfile.TemporaryDirectory[str] | None = None
+        self._conn: sqlite3.Connection | None = None
+
+    @property
+    def exceeded(self) -> bool:
+        """Whether more is charged than the budget allows."""
+        return self.used > self.max_bytes
+
+    def remaining(self) -> int:
+        """Return the bytes left in the budget."""
+        return max(self.max_bytes - self.used, 0)
+
+    def charge(self, nbytes: int) -> None:
+        """Charge the budget, spilling the largest structures if it is exceeded."""
+        self.used += nbytes
+        if self.used > self.max_bytes and self._in_memory:
+            for spillable in sorted(self._in_memory, key=lambda s: -s.charged):
+                spillable.spill()
+                if self.used <= self.max_bytes:
+                    break
+
+    def release(self, nbytes: int) -> None:
+        """Give back bytes that are no longer held."""
+        self.used -= nbytes
+
+    def register(self, spillable: "SpillDict[Any] | SpillSet") -> None:
+        """Spill the structure when the budget is exceeded."""
+        self._in_memory.append(spillable)
+
+    def open_table(self, spillable: "SpillDict[Any] | SpillSet", columns: str) -> "_Table":
+        """Create a table for a structure moving to disk, and stop charging for it."""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.temp_dir() / "spill.sqlite")
+            # the database is thrown away with the run, so it needs no journal
+            self._conn.execute("PRAGMA journal_mode = OFF")
+            self._conn.execute("PRAGMA synchronous = OFF")
+        table = _Table(self._conn, f"spill_{len(self.spilled)}", columns)
+        self.spilled.append(spillable.name)
+        self._in_memory.remove(spillable)
+        self.release(spillable.charged)
+        return table
+
+    def temp_dir(self) -> Path:
+        """Return a temporary directory for spilled data, removed by `close`."""
+        if self._tmpdir is None:
+            if self.spill_dir is not None:
+                self.spill_dir.mkdir(parents=True, exist_ok=True)
+            self._tmpdir = tempfile.TemporaryDirectory(dir=self.spill_dir, prefix="spill-")
+        return Path(self._tmpdir.name)
+
+    def close(self) -> None:
+        """Remove the spilled data, the spilled structures can't be used after this."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._tmpdir is not None:
+            self._tmpdir.cleanup()
+            self._tmpdir = None
+
+    def __enter__(self) -> "MemoryBudget":  # noqa: D105
+        return self
+
+    def __exit__(self, *exc: object) -> None:  # noqa: D105
+        self.close()
+
+
+class _Table:
+    """A table of a spilled structure, keyed on text."""
+
+    def __init__(self, conn: sqlite3.Connection, name: str, columns: str) -> None:
+        self.conn = conn
+        conn.execute(f"CREATE TABLE {name} (key TEXT PRIMARY KEY{columns}) WITHOUT ROWID")
+        self._select = f"SELECT * FROM {name} WHERE key = ?"
+        self._insert = f"INSERT OR REPLACE INTO {name} VALUES (?{', ?' if columns else ''})"
+        self._delete = f"DELETE FROM {name} WHERE key = ?"
+        self._keys = f"SELECT key FROM {name}"
+        self._count = f"SELECT count(*) FROM {name}"
+
+    def get(self, key: object) -> tuple[Any, ...] | None:
+        return self.conn.execute(self._select, (key,)).fetchone()
+
+    def put(self, *row: Any) -> None:
+        self.conn.execute(self._insert, row)
+
+    def put_many(self, rows: Iterable[tuple[Any, ...]]) -> None:
+        self.conn.executemany(self._insert, rows)
+
+    def delete(self, key: object) -> bool:
+        return self.conn.execute(self._delete, (key,)).rowcount > 0
+
+    def keys(self) -> Iterator[str]:
+        return (key for (key,) in self.conn.execute(self._keys))
+
+    def __len__(self) -> int:
+        return self.conn.execute(self._count).fetchone()[0]
+
+
+class SpillDict(MutableMapping[str, V]):
+    """A dict with str keys that moves to disk when its budget is exceeded.
+
+    The values must be str or int, which SQLite keeps as they are.
+    """
+
+    def __init__(self, budget: MemoryBudget, name: str = "dict") -> None:
+        """Create an empty dict charging budget."""
+        self.budget = budget
+        self.name = name
+        self.charged = 0
+        self.data: dict[str, V] = {}
+        self.table: _Table | None = None
+        budget.register(self)
+
+    def spill(self) -> None:
+        """Move the items to the database of the budget."""
+        if self.table is None:
+            self.table = self.budget.open_table(self, ", value")
+            self.table.put_many(self.data.items())
+            self.data = {}
+            self.charged = 0
+
+    def __getitem__(self, key: str) -> V:  # noqa: D105
+        if self.table is None:
+            return self.data[key]
+        if (row := self.table.get(key)) is None:
+            raise KeyError(key)
+        return row[1]
+
+    def __setitem__(self, key: str, value: V) -> None:  # noqa: D105
+        if self.table is not None:
+            self.table.put(key, value)
+        elif key not in self.data:
+            self.data[key] = value
+            nbytes = item_bytes(key, value)
+            self.charged += nbytes
+            self.budget.charge(nbytes)
+        else:
+            self.data[key] = value
+
+    def __delitem__(self, key: str) -> None:  # noqa: D105
+        if self.table is None:
+            del self.data[key]
+        elif not self.table.delete(key):
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:  # noqa: D105
+        if self.table is None:
+            return key in self.data
+        return self.table.get(key) is not None
+
+    def __iter__(self) -> Iterator[str]:  # noqa: D105
+        return iter(self.data) if self.table is None else self.table.keys()
+
+    def __len__(self) -> int:  # noqa: D105
+        return len(self.data) if self.table is None else len(self.table)
+
+
+class SpillSet(MutableSet[str]):
+    """A set of str that moves to disk when its budget is exceeded."""
+
+    def __init__(self, budget: MemoryBudget, name: str = "set") -> None:
+        """Create an empty set charging budget."""
+        self.budget = budget
+        self.name = name
+        self.charged = 0
+        self.data: set[str] = set()
+        self.table: _Table | None = None
+        budget.register(self)
+
+    def spill(self) -> None:
+        """Move the items to the database of the budget."""
+        if self.table is None:
+            self.table = self.budget.open_table(self, "")
+            self.table.put_many((key,) for key in self.data)
+            self.data = set()
+            self.charged = 0
+
+    def add(self, value: str) -> None:  # noqa: D102
+        if self.table is not None:
+            self.table.put(value)
+        elif value not in self.data:
+            self.data.add(value)
+            nbytes = item_bytes(value)
+            self.charged += nbytes
+            self.budget.charge(nbytes)
+
+    def discard(self, value: str) -> None:  # noqa: D102
+        if self.table is None:
+            self.data.discard(value)
+        else:
+            self.table.delete(value)
+
+    def __contains__(self, value: object) -> bool:  # noqa: D105
+        if self.table is None:
+            return value in self.data
+        return self.table.get(value) is not None
+
+    def __iter__(self) -> Iterator[str]:  # noqa: D105
+        return iter(self.data) if self.table is None else self.table.keys()
+
+    def __len__(self) -> int:  # noqa: D105
+        return len(self.data) if self.table is None else len(self.table)
@@ -0,0 +1,70 @@
+"""Helpers for running work in a pool of processes."""
+
+import itertools
+import os
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from typing import TYPE_CHECKING, TypeVar
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor, Future
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def resolve_jobs(jobs: int) -> int:
+    """Resolve the number of workers to use, 0 or less means one per core."""
+    return jobs if jobs > 0 else os.cpu_count() or 1
+
+
+def chunked(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    """Split items into lists of at most `size` items.
+
+    >>> list(chunked(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    it = iter(items)
+    while chunk := list(itertools.islice(it, size)):
+        yield chunk
+
+
+def ordered_map(
+    fn: Callable[[T], R],
+    items: Iterable[T],
+    *,
+    jobs: int,
+    executor: "Executor | None" = None,
+    max_in_flight: int | None = None,
+) -> Iterator[R]:
+    """Map `fn` over items in a process pool, yielding results in input order.
+
+    Unlike `Executor.map` the input is consumed lazily, at most `max_in_flight`
+    items are submitted at a time, so memory stays bounded for long inputs.
+
+    Args:
+        fn (Callable[[T], R]): picklable function to apply
+        items (Iterable[T]): the items
+        jobs (int): number of worker processes
+        executor (Executor | None, optional): pool to use instead of creating one. Defaults to None.
+        max_in_flight (int | None, optional): submitted but not yielded items. Defaults to 2 * jobs.
+
+    Yields:
+        R: the results in input order
+    """  # noqa: E501
+    max_in_flight = max_in_flight or 2 * jobs
+    if executor is None:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            yield from ordered_map(
+                fn, items, jobs=jobs, executor=pool, max_in_flight=max_in_flight
+            )
+        return
+    pending: deque[Future[R]] = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
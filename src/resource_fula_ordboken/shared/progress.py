@@ -0,0 +1,87 @@
+"""Pluggable progress reporting.
+
+Long running loops report progress through `progress`, which uses tqdm by
+default, imported with the first progress bar. Batch jobs can turn progress off
+with `set_progress_factory(None)`, then iterables are passed through untouched
+and manual bars do nothing.
+"""
+
+from collections.abc import Callable, Iterable
+from typing import Any, Protocol, TypeVar
+
+T = TypeVar("T")
+
+
+class ProgressBar(Protocol):
+    """What the code expects from a manually updated progress bar."""
+
+    def update(self, n: int = 1) -> Any: ...  # noqa: D102
+
+    def close(self) -> None: ...  # noqa: D102
+
+    def __enter__(self) -> "ProgressBar": ...  # noqa: D105
+
+    def __exit__(self, *exc: object) -> Any: ...  # noqa: D105
+
+
+ProgressFactory = Callable[..., Any]
+
+
+class NullProgress:
+    """A progress bar that does nothing."""
+
+    def update(self, n: int = 1) -> None:  # noqa: D102
+        pass
+
+    def close(self) -> None:  # noqa: D102
+        pass
+
+    def __enter__(self) -> "NullProgress":  # noqa: D105
+        return self
+
+    def __exit__(self, *exc: object) -> None:  # noqa: D105
+        pass
+
+
+def _tqdm(*args: Any, **kwargs: Any) -> Any:
+    from tqdm import tqdm
+
+    return tqdm(*args, **kwargs)
+
+
+_factory: ProgressFactory | None = _tqdm
+
+
+def set_progress_factory(factory: ProgressFactory | None) -> ProgressFactory | None:
+    """Set what creates progress bars, None turns progress off.
+
+    The factory is called like `tqdm.tqdm`, with an optional iterable and the
+    keyword arguments `desc`, `unit` and `total`.
+
+    Returns:
+        ProgressFactory | None: the previous factory
+    """
+    global _factory
+    previous, _factory = _factory, factory
+    return previous
+
+
+def progress_enabled() -> bool:
+    """Tell if progress is reported."""
+    return _factory is not None
+
+
+def progress(
+    iterable: Iterable[T], *, desc: str, unit: str = " entries", total: int | None = None
+) -> Iterable[T]:
+    """Report progress while iterating, or return the iterable when progress is off."""
+    if _factory is None:
+        return iterable
+    return _factory(iterable, desc=desc, unit=unit, total=total)
+
+
+def progress_bar(*, desc: str, unit: str = " entries", total: int | None = None) -> ProgressBar:
+    """Create a progress bar that is updated manually."""
+    if _factory is None:
+        return NullProgress()
+    return _factory(desc=desc, unit=unit, total=total)
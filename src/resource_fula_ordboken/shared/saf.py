@@ -0,0 +1,113 @@
+"""Write Simple Archive Format zips without staging the payload.
+
+The archives have the layout written by `simple_archive`: one item, `item_000`,
+with the files, a `contents` file and `dublin_core.xml`. The payload is read
+from where it already is, or streamed into the archive while it is produced,
+instead of being copied to a work directory and read back. Members that are
+already compressed are stored as they are.
+
+    with SimpleArchiveZip(output_path, title=title, date_issued=date_issued) as saf:
+        saf.add_file(json_output)
+        with saf.open("notes.txt") as fp:
+            fp.write(b"...")
+"""
+
+import time
+import zipfile
+from pathlib import Path
+from types import TracebackType
+from typing import IO
+from xml.etree.ElementTree import Element, ElementTree, SubElement
+
+STORED_SUFFIXES = frozenset({".gz", ".zip", ".bz2", ".xz", ".zst"})
+ITEM_DIR = "item_000"
+
+
+def compress_type(name: str) -> int:
+    """Store members that are already compressed, deflate the rest."""
+    return zipfile.ZIP_STORED if Path(name).suffix in STORED_SUFFIXES else zipfile.ZIP_DEFLATED
+
+
+def dublin_core_xml(*, title: str, date_issued: str) -> ElementTree:
+    """Build the metadata of an item like `simple_archive` does from metadata.csv."""
+    root = Element("dublin_core")
+    for element, qualifier, value in (("title", "none", title), ("date", "issued", date_issued)):
+        dcvalue = SubElement(root, "dcvalue", {"element": element, "qualifier": qualifier})
+        if value:
+            dcvalue.text = value
+    return ElementTree(root)
+
+
+class SimpleArchiveZip:
+    """A Simple Archive with one item, written as a zip."""
+
+    def __init__(self, output_path: Path, *, title: str, date_issued: str) -> None:
+        """Start writing the archive to output_path."""
+        self.output_path = output_path
+        self.title = title
+        self.date_issued = date_issued
+        self.names: list[str] = []
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        self._zipf = zipfile.ZipFile(output_path, "w", compression=zipfile.ZIP_DEFLATED)
+
+    def _add_name(self, name: str) -> str:
+        if name in self.names:
+            raise ValueError(f"'{name}' is already in the archive")
+        self.names.append(name)
+        return f"{ITEM_DIR}/{name}"
+
+    def add_file(self, path: Path, name: str | None = None) -> None:
+        """Add a file to the item, read in place.
+
+        Args:
+            path (Path): the file to add
+            name (str | None, optional): name in the archive. Defaults to the name of path.
+        """
+        name = name or path.name
+        self._zipf.write(path, self._add_name(name), compress_type=compress_type(name))
+
+    def open(self, name: str) -> IO[bytes]:
+        """Open a file of the item for writing, to stream its content into the archive."""
+        info = zipfile.ZipInfo(self._add_name(name), date_time=time.localtime()[:6])
+        info.compress_type = compress_type(name)
+        info.external_attr = 0o644 << 16
+        return self._zipf.open(info, "w", force_zip64=True)
+
+    def close(self) -> None:
+        """Write the contents and the metadata of the item and close the archive."""
+        self._zipf.writestr(f"{ITEM_DIR}/contents", "".join(f"{name}\n" for name in self.names))
+        with self._zipf.open(f"{ITEM_DIR}/dublin_core.xml", "w") as fp:
+            dublin_core_xml(title=self.title, date_issued=self.date_issued).write(fp)
+        self._zipf.close()
+
+    def __enter__(self) -> "SimpleArchiveZip":  # noqa: D105
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Finish the archive, or remove it if writing failed."""
+        if exc_type is None:
+            self.close()
+        else:
+            self._zipf.close()
+            self.output_path.unlink(missing_ok=True)
+
+
+def write_simple_archive(
+    output_path: Path, paths: list[Path], *, title: str, date_issued: str
+) -> None:
+    """Write the given files as a Simple Archive zip.
+
+    Args:
+        output_path (Path): where to write the archive
+        paths (list[Path]): the files of the item, read in place
+        title (str): title to use
+        date_issued (str): date issued
+    """
+    with SimpleArchiveZip(output_path, title=title, date_issued=date_issued) as saf:
+        for path in paths:
+            saf.add_file(path)
@@ -0,0 +1,183 @@
+"""Content-addressed cache of the outputs of pipeline stages.
+
+A stage that reads files and writes files asks the cache before doing any work:
+
+    key = stage_cache.key("clean", [raw], title=title)
+    if not stage_cache.restore(key, {"saf": output}):
+        ...  # run the stage
+        stage_cache.put(key, {"saf": output})
+"""
+
+import hashlib
+import os
+import shutil
+from pathlib import Path
+from typing import Any
+
+import orjson
+
+import resource_fula_ordboken
+from resource_fula_ordboken.shared import files
+from resource_fula_ordboken.shared.cache import default_cache_dir
+
+DEFAULT_STAGE_CACHE_SIZE = 2 << 30
+_META = "meta.json"
+
+
+class StageCache:
+    """Outputs of pipeline stages, addressed by the digests of their inputs.
+
+    The key of a stage combines the stage name, the package version, the digests
+    of the input files and the parameters that change the output. Outputs are
+    stored and restored as copy-on-write clones where the file system supports
+    them, and as copies otherwise, so writing to an output never changes the
+    cache. The least recently used entries are evicted when the cache grows
+    beyond `max_bytes`.
+    """
+
+    def __init__(self, root: Path, *, max_bytes: int = DEFAULT_STAGE_CACHE_SIZE) -> None:
+        """Use the cache stored under root, it is created on the first `put`."""
+        self.root = root
+        self.max_bytes = max_bytes
+        self._digests: dict[str, list[Any]] | None = None
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def in_dir(
+        cls, cache_dir: Path | None = None, *, max_bytes: int = DEFAULT_STAGE_CACHE_SIZE
+    ) -> "StageCache":
+        """Create the cache in the given or the default cache directory."""
+        return cls((cache_dir or default_cache_dir()) / "stages", max_bytes=max_bytes)
+
+    def digest(self, path: Path) -> str:
+        """Return the sha256 of a file, remembered as long as its size and mtime are the same."""
+        stat = path.stat()
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        digests = self._load_digests()
+        known = digests.get(str(path.resolve()))
+        if known is not None and known[:2] == stamp:
+            return known[2]
+        digest = files.file_digest(path)
+        digests[str(path.resolve())] = [*stamp, digest]
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.root / f"digests.json.{os.getpid()}.swp"
+        tmp_path.write_bytes(orjson.dumps(digests))
+        tmp_path.replace(self.root / "digests.json")
+        return digest
+
+    def _load_digests(self) -> dict[str, list[Any]]:
+        if self._digests is None:
+            try:
+                self._digests = orjson.loads((self.root / "digests.json").read_bytes())
+            except (FileNotFoundError, orjson.JSONDecodeError):
+                self._digests = {}
+        return self._digests
+
+    def key(self, stage: str, inputs: list[Path], **params: Any) -> str:
+        """Compute the key of a stage from its inputs and parameters."""
+        parts = {
+            "stage": stage,
+            "version": resource_fula_ordboken.__version__,
+            "inputs": [self.digest(path) for path in inputs],
+            "params": params,
+        }
+        return hashlib.sha256(
+            orjson.dumps(parts, option=orjson.OPT_SORT_KEYS, default=str)
+        ).hexdigest()
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def restore(self, key: str, outputs: dict[str, Path]) -> bool:
+        """Restore the cached outputs of a stage.
+
+        Args:
+            key (str): the key of the stage
+            outputs (dict[str, Path]): where to put each named output
+
+        Returns:
+            bool: True if the outputs were cached
+        """
+        entry_dir = self._entry_dir(key)
+        meta_path = entry_dir / _META
+        if not meta_path.exists() or not all((entry_dir / name).exists() for name in outputs):
+            self.misses += 1
+            return False
+        try:
+            for name, path in outputs.items():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                files.clone_or_copy(entry_dir / name, path)
+            meta_path.touch()
+        except FileNotFoundError:
+            # evicted by another process meanwhile
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def put(self, key: str, outputs: dict[str, Path]) -> None:
+        """Store the outputs of a stage and evict old entries if needed.
+
+        Several processes may share the cache. If another one stores the same key
+        first, its entry is kept, since the outputs of a key are the same.
+        """
+        entry_dir = self._entry_dir(key)
+        if (entry_dir / _META).exists():
+            return
+        tmp_dir = entry_dir.with_name(f".{key}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        for name, path in outputs.items():
+            files.clone_or_copy(path, tmp_dir / name)
+        size = sum(path.stat().st_size for path in outputs.values())
+        (tmp_dir / _META).write_bytes(orjson.dumps({"key": key, "size": size}))
+        # the remains of an entry that was being evicted, if any
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        try:
+            tmp_dir.rename(entry_dir)
+        except OSError:
+            # another process stored the same key in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def evict(self, max_bytes: int | None = None) -> list[Path]:
+        """Remove the least recently used entries until the cache fits in max_bytes.
+
+        Returns:
+            list[Path]: the removed entries
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for _, size, entry_dir in sorted(entries):
+            if total <= max_bytes:
+                break
+            # another process may be evicting the same entry
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+            removed.append(entry_dir)
+        return removed
+
+    def _entries(self) -> list[tuple[int, int, Path]]:
+        """List the last use, size and directory of every entry."""
+        entries = (_entry_info(meta_path) for meta_path in self.root.glob(f"*/*/{_META}"))
+        return [entry for entry in entries if entry is not None]
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        shutil.rmtree(self.root, ignore_errors=True)
+        self._digests = None
+
+
+def _entry_info(meta_path: Path) -> tuple[int, int, Path] | None:
+    """Read the last use and size of an entry, None if it was just removed."""
+    try:
+        return (
+            meta_path.stat().st_mtime_ns,
+            orjson.loads(meta_path.read_bytes())["size"],
+            meta_path.parent,
+        )
+    except FileNotFoundError:
+        return None
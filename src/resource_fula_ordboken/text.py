@@ -6,6 +6,37 @@ from typing import Any
 unescape_str = html.unescape
 
 
+class _ShavedChars(dict[int, str]):  # str.translate needs a dict, not a UserDict
+    """Every character seen by `shave_marks`, without its diacritic marks."""
+
+    def __missing__(self, codepoint: int) -> str:
+        import unicodedata
+
+        norm_char = unicodedata.normalize("NFD", chr(codepoint))
+        shaved = self[codepoint] = "".join(c for c in norm_char if not unicodedata.combining(c))
+        return shaved
+
+
+_SHAVED_CHARS = _ShavedChars()
+
+
+def shave_marks(txt: str) -> str:
+    """Remove all diacritic marks.
+
+    The characters are shaved one by one through a memo, which gives the same
+    result as shaving the decomposed string since all combining marks are
+    dropped, and composed again only if something besides ascii is left.
+    """
+    if txt.isascii():
+        return txt
+    shaved = txt.translate(_SHAVED_CHARS)
+    if shaved.isascii():
+        return shaved
+    import unicodedata
+
+    return unicodedata.normalize("NFC", shaved)
+
+
 def unescape_any(s: Any) -> Any:
     """Unescape str or list[str] or dict[Any,str] recursively.
 
@@ -1,16 +1,33 @@
 """Use cases."""
 
-import csv
+import collections
+import contextlib
+import functools
+import io
+import itertools
 import shutil
+import time
 import zipfile
+from collections.abc import Callable, Generator, Iterable, Iterator
 from pathlib import Path
+from typing import IO, TYPE_CHECKING, Any, NamedTuple
 
-import json_arrays
-from simple_archive.use_cases import CreateSimpleArchiveFromCSVWriteToPath, create_unique_path
+from resource_fula_ordboken.batch_shards import ShardedBatchWriter, Sharding
+from resource_fula_ordboken.shared import files, instrumentation, jsonl_sink, parallel, saf
+from resource_fula_ordboken.shared.cache import EncodingCache
+from resource_fula_ordboken.shared.stage_cache import StageCache
+from resource_fula_ordboken.validation import Validator
 
-from resource_fula_ordboken import find_updates
-from resource_fula_ordboken.fula_ord_converter import FulaOrdTxt2JsonConverter
-from resource_fula_ordboken.shared import files
+# the converter, the diff and simple_archive pull in pydantic and karp_lex_types, so
+# they are imported by the use cases that need them
+if TYPE_CHECKING:
+    from resource_fula_ordboken.baseline_index import BaselineIndex
+    from resource_fula_ordboken.batch_verifier import Verification
+    from resource_fula_ordboken.fula_ord_converter import ParsedRecord
+    from resource_fula_ordboken.id_registry import IdRegistry
+    from resource_fula_ordboken.models import FulaOrdEntryCmd
+    from resource_fula_ordboken.record_manifest import RecordManifest
+    from resource_fula_ordboken.shared.memory_budget import MemoryBudget
 
 
 def package_file_as_simple_archive(
@@ -19,7 +36,7 @@ def package_file_as_simple_archive(
     title: str,
     date_issued: str,
     output_path: Path,
-    workdir: Path | None = None,
+    workdir: Path | None = None,  # noqa: ARG001
 ) -> None:
     """Create Simple Archive Format for given file.
 
@@ -28,33 +45,20 @@ def package_file_as_simple_archive(
         title (str): title to used
         date_issued (str): date issued
         output_path (Path): where to write the simple_archive,
-        workdir (Path | None, optional): specify where the temporary files should be stored. Defaults to None.
-    """  # noqa: E501
-    working_dir = workdir or Path("tmp")
-
-    working_dir = create_unique_path(working_dir, file.stem)
-
-    working_dir.mkdir(parents=True)
-
-    local_file = working_dir / file.name
-    shutil.copy(file, local_file)
-
-    csv_path = working_dir / "metadata.csv"
-
-    with csv_path.open("w", encoding="utf-8") as fp:
-        csv_writer = csv.DictWriter(fp, fieldnames=("files", "dc.title", "dc.date.issued"))
-        csv_writer.writeheader()
-        csv_writer.writerow(
-            {"files": local_file.name, "dc.title": title, "dc.date.issued": date_issued}
-        )
-
-    create_simplearchive = CreateSimpleArchiveFromCSVWriteToPath()
-
-    create_simplearchive.execute(csv_path, output_path=output_path, create_zip=True)
+        workdir (Path | None, optional): not used, the file is read in place. Defaults to None.
+    """
+    _package([file], title=title, date_issued=date_issued, output_path=output_path)
 
 
 def clean_data_and_package(
-    file: Path, *, title: str, date_issued: str, output_path: Path, workdir: Path | None = None
+    file: Path,
+    *,
+    title: str,
+    date_issued: str,
+    output_path: Path,
+    workdir: Path | None = None,
+    encoding_cache: EncodingCache | None = None,
+    stage_cache: StageCache | None = None,
 ) -> None:
     """Clean data and package as Simple Archive Format.
 
@@ -63,38 +67,50 @@ def clean_data_and_package(
         title (str): title to use
         date_issued (str): date issued
         output_path (Path): where to write the simple archive
-        workdir (Path | None, optional): specify where the temporary files should be stored. Defaults to None.
+        workdir (Path | None, optional): not used, the cleaned files are written straight into the archive. Defaults to None.
+        encoding_cache (EncodingCache | None, optional): cache of detected encodings. Defaults to None.
+        stage_cache (StageCache | None, optional): reuse the output of an earlier run on the same file. Defaults to None.
     """  # noqa: E501
-    working_dir = workdir or Path("tmp")
-
-    working_dir = create_unique_path(working_dir, file.stem)
-
-    working_dir.mkdir(parents=True)
-
-    with zipfile.ZipFile(file) as zipf:
-        zipf.extractall(path=working_dir)
-
-    file_names = []
-    for path in working_dir.iterdir():
-        if path.is_dir():
-            continue
-
-        files.change_encoding_to_utf8(path)
-
-        files.unescape_file(path)
-        file_names.append(path.name)
-
-    csv_path = working_dir / "metadata.csv"
-    with csv_path.open("w", encoding="utf-8") as fp:
-        csv_writer = csv.DictWriter(fp, fieldnames=("files", "dc.title", "dc.date.issued"))
-        csv_writer.writeheader()
-        csv_writer.writerow(
-            {"files": "||".join(file_names), "dc.title": title, "dc.date.issued": date_issued}
+    if stage_cache is not None:
+        _run_cached(
+            stage_cache,
+            "clean_data_and_package",
+            inputs=[file],
+            outputs={"saf": output_path},
+            params={"title": title, "date_issued": date_issued},
+            run=functools.partial(
+                clean_data_and_package,
+                file,
+                title=title,
+                date_issued=date_issued,
+                output_path=output_path,
+                workdir=workdir,
+                encoding_cache=encoding_cache,
+            ),
         )
-
-    create_simplearchive = CreateSimpleArchiveFromCSVWriteToPath()
-
-    create_simplearchive.execute(csv_path, output_path=output_path, create_zip=True)
+        return
+    hits, misses = (encoding_cache.hits, encoding_cache.misses) if encoding_cache else (0, 0)
+    with instrumentation.stage("clean") as stage:
+        with (
+            zipfile.ZipFile(file) as zipf,
+            saf.SimpleArchiveZip(output_path, title=title, date_issued=date_issued) as archive,
+        ):
+            for info in zipf.infolist():
+                if info.is_dir() or "/" in info.filename:
+                    continue
+                encoding = files.detect_zip_member_encoding(zipf, info, cache=encoding_cache)
+                with zipf.open(info) as src, _open_text(archive, info.filename) as dst:
+                    dst.writelines(
+                        files.iter_unescaped_lines(src, encoding=encoding["encoding"])
+                    )
+                stage.bytes_read += info.file_size
+        stage.add_written(output_path)
+        if encoding_cache:
+            stage.add_cache(
+                "encoding",
+                hits=encoding_cache.hits - hits,
+                misses=encoding_cache.misses - misses,
+            )
 
 
 def convert_and_package(
@@ -105,9 +121,35 @@ def convert_and_package(
     json_output: Path,
     saf_output: Path,
     workdir: Path | None = None,
+    jobs: int = 1,
+    validator: Validator | None = None,
+    compresslevel: int = jsonl_sink.DEFAULT_COMPRESSLEVEL,
+    gzip_block_size: int | None = None,
+    shard_by_member: bool = False,
+    stage_cache: StageCache | None = None,
+    previous_records: "RecordManifest | None" = None,
+    record_manifest: Path | None = None,
+    previous_ids: "IdRegistry | None" = None,
+    id_registry: Path | None = None,
+    max_memory: int | None = None,
+    lookup_index: bool = False,
 ) -> None:
     """Convert Fula Ordboken txt to karp7 jsonl.
 
+    The `.txt` members of a zip are converted as one export: ids are unique over
+    all members and jfr references are resolved across members. With more than
+    one member and `jobs` > 1, each member is parsed in its own process while ids
+    are assigned here in member order, so the result is the same as converting
+    the members one after another.
+
+    With the record manifest of the previous release, only the records that
+    changed since are parsed and validated, see `record_manifest`. With the id
+    registry of the previous release, entries keep their ids, see `id_registry`.
+    With `max_memory`, the ids and the wordform map move to disk when they
+    outgrow it, see `memory_budget`. With `lookup_index`, every jsonl is written
+    in blocked gzip with an index next to it for reading single entries, see
+    `lookup_index`.
+
     Args:
         file (Path): file with cleaned data
         title (str): title the use
@@ -115,69 +157,914 @@ def convert_and_package(
         json_output (Path): path where to write karp json
         saf_output (Path): path to create the Simple Archive
         workdir (Path | None, optional): workdir. Defaults to None.
+        jobs (int, optional): number of processes parsing entries. Defaults to 1.
+        validator (Validator | None, optional): which entries to validate. Defaults to all.
+        compresslevel (int, optional): gzip compression level of json_output. Defaults to 6.
+        gzip_block_size (int | None, optional): write json_output as gzip members of this size. Defaults to one member.
+        shard_by_member (bool, optional): write one jsonl per member of a zip, named after json_output and the member. Defaults to False.
+        stage_cache (StageCache | None, optional): reuse the outputs of an earlier run on the same file. Defaults to None.
+        previous_records (RecordManifest | None, optional): the records of the previous release to reuse. Defaults to None.
+        record_manifest (Path | None, optional): where to write the record manifest of this release. Defaults to None.
+        previous_ids (IdRegistry | None, optional): the ids of the previous release to keep. Defaults to None.
+        id_registry (Path | None, optional): where to write the id registry of this release. Defaults to None.
+        max_memory (int | None, optional): bytes the ids and wordforms may take in memory. Defaults to no limit.
+        lookup_index (bool, optional): write a lookup index next to every jsonl. Defaults to False.
 
     Raises:
         ValueError: If the extension of file is unknown.
-    """
-    working_dir = workdir or Path("tmp")
-
-    working_dir = create_unique_path(working_dir, file.stem)
-
-    working_dir.mkdir(parents=True)
-
-    converter = FulaOrdTxt2JsonConverter()
-
-    json_output.parent.mkdir(parents=True, exist_ok=True)
-    if file.suffix == ".txt":
-        with file.open(encoding="utf-8") as fp:
-            fulaord = list(converter.convert_entry(fp))
-            json_arrays.dump_to_file(converter.update_jfr(fulaord), json_output)
-    elif file.suffix == ".zip":
-        with zipfile.ZipFile(file) as zipf:
-            for file_name in zipf.namelist():
-                if file_name.endswith(".txt"):
-                    file_path = zipfile.Path(zipf, at=file_name)
-                    with file_path.open(encoding="utf-8") as fp:
-                        fulaord = list(converter.convert_entry(fp))
-                        json_arrays.dump_to_file(
-                            (entry.model_dump() for entry in converter.update_jfr(fulaord)),
-                            json_output,
-                        )
-    else:
+    """  # noqa: E501
+    if file.suffix not in {".txt", ".zip"}:
         raise ValueError(f"unknown file extension ('{file.suffix}')")
+    members = _zip_text_members(file) if file.suffix == ".zip" else []
+    json_outputs = (
+        [member_shard_path(json_output, member) for member in members]
+        if shard_by_member and members
+        else [json_output]
+    )
+    if len(set(json_outputs)) != len(json_outputs):
+        raise ValueError(f"the members of '{file}' can't be told apart by their names")
+    from resource_fula_ordboken.lookup_index import DEFAULT_BLOCK_SIZE as LOOKUP_BLOCK_SIZE
+    from resource_fula_ordboken.lookup_index import default_index_path, write_indexed
 
-    local_file = working_dir / json_output.name
-    shutil.copy(json_output, local_file)
-
-    csv_path = working_dir / "metadata.csv"
+    if stage_cache is not None:
+        _run_cached(
+            stage_cache,
+            "convert_and_package",
+            inputs=[file],
+            outputs={"saf": saf_output}
+            | {f"json.{nr}": path for nr, path in enumerate(json_outputs)}
+            | ({"records": record_manifest} if record_manifest else {})
+            | ({"ids": id_registry} if id_registry else {})
+            | (
+                {
+                    f"lookup.{nr}": default_index_path(path)
+                    for nr, path in enumerate(json_outputs)
+                }
+                if lookup_index
+                else {}
+            ),
+            params={
+                "title": title,
+                "date_issued": date_issued,
+                "json_name": json_output.name,
+                "compresslevel": compresslevel,
+                "gzip_block_size": gzip_block_size,
+                "shard_by_member": shard_by_member,
+                "record_manifest": record_manifest is not None,
+                "previous_ids": previous_ids.digest() if previous_ids else None,
+                "id_registry": id_registry is not None,
+                "lookup_index": lookup_index,
+            },
+            run=functools.partial(
+                convert_and_package,
+                file,
+                title=title,
+                date_issued=date_issued,
+                json_output=json_output,
+                saf_output=saf_output,
+                workdir=workdir,
+                jobs=jobs,
+                validator=validator,
+                compresslevel=compresslevel,
+                gzip_block_size=gzip_block_size,
+                shard_by_member=shard_by_member,
+                previous_records=previous_records,
+                record_manifest=record_manifest,
+                previous_ids=previous_ids,
+                id_registry=id_registry,
+                max_memory=max_memory,
+                lookup_index=lookup_index,
+            ),
+        )
+        return
+    from resource_fula_ordboken import record_scanner
+    from resource_fula_ordboken.fula_ord_converter import FulaOrdTxt2JsonConverter
+    from resource_fula_ordboken.id_registry import IdAllocator
+    from resource_fula_ordboken.record_manifest import RecordManifest
 
-    with csv_path.open("w", encoding="utf-8") as fp:
-        csv_writer = csv.DictWriter(fp, fieldnames=("files", "dc.title", "dc.date.issued"))
-        csv_writer.writeheader()
-        csv_writer.writerow(
-            {"files": local_file.name, "dc.title": title, "dc.date.issued": date_issued}
+    with (
+        _working_dir(workdir, file.stem) as working_dir,
+        _open_budget(max_memory, spill_dir=working_dir) as budget,
+    ):
+        converter = FulaOrdTxt2JsonConverter(
+            IdAllocator(previous_ids, keep_registry=id_registry is not None, budget=budget),
+            budget=budget,
         )
 
-    create_simplearchive = CreateSimpleArchiveFromCSVWriteToPath()
+        json_output.parent.mkdir(parents=True, exist_ok=True)
 
-    create_simplearchive.execute(csv_path, output_path=saf_output, create_zip=True)
+        def write_json_output(entries: Iterable[dict[str, Any]], path: Path) -> None:
+            with instrumentation.stage("write") as stage:
+                sink = (
+                    write_indexed(
+                        entries,
+                        path,
+                        compresslevel=compresslevel,
+                        block_size=gzip_block_size or LOOKUP_BLOCK_SIZE,
+                    )
+                    if lookup_index
+                    else jsonl_sink.dump_to_file(
+                        entries, path, compresslevel=compresslevel, block_size=gzip_block_size
+                    )
+                )
+                stage.entries += sink.num_lines
+                stage.bytes_written += sink.bytes_out
+
+        if previous_records is not None or record_manifest is not None:
+            num_spills = 1 if file.suffix == ".txt" else len(members)
+            spill_paths = [working_dir / f"{nr}.spill.jsonl" for nr in range(num_spills)]
+            records = previous_records or RecordManifest()
+            with (
+                instrumentation.stage("convert") as stage,
+                _write_record_manifest(record_manifest) as sink,
+            ):
+                for spill_path, member_records in zip(
+                    spill_paths, _iter_member_records(file, members), strict=True
+                ):
+                    stage.entries += converter.spill_parsed(
+                        records.iter_parsed(
+                            member_records, jobs=jobs, sink=sink, validator=validator
+                        ),
+                        spill_path,
+                    )
+                stage.add_read(file)
+                stage.add_cache("records", hits=records.reused, misses=records.parsed)
+        elif file.suffix == ".txt":
+            spill_paths = [working_dir / f"{files.real_stem(json_output.name)}.spill.jsonl"]
+            with instrumentation.stage("convert") as stage:
+                stage.entries += converter.spill_entries(
+                    record_scanner.iter_file_records(file),
+                    spill_paths[0],
+                    jobs=jobs,
+                    validator=validator,
+                )
+                stage.add_read(file)
+        else:
+            spill_paths = [working_dir / f"{nr}.spill.jsonl" for nr in range(len(members))]
+            with instrumentation.stage("convert") as stage:
+                for spill_path, parsed_records in zip(
+                    spill_paths,
+                    _iter_parsed_members(
+                        file, members, working_dir, jobs=jobs, validator=validator
+                    ),
+                    strict=True,
+                ):
+                    stage.entries += converter.spill_parsed(parsed_records, spill_path)
+                stage.add_read(file)
+        if len(json_outputs) == 1:
+            write_json_output(
+                itertools.chain.from_iterable(map(converter.iter_spilled, spill_paths)),
+                json_output,
+            )
+        else:
+            for spill_path, path in zip(spill_paths, json_outputs, strict=True):
+                write_json_output(converter.iter_spilled(spill_path), path)
+        if id_registry:
+            converter.id_allocator.registry().write(id_registry)
+
+    _package(json_outputs, title=title, date_issued=date_issued, output_path=saf_output)
 
 
 def create_karp_batch_from_export(
-    raw_entries: Path, *, baseline: Path, output_path: Path, msg: str
+    raw_entries: Path,
+    *,
+    baseline: Path,
+    output_path: Path,
+    msg: str,
+    streaming: bool = False,
+    use_index: bool = False,
+    index_path: Path | None = None,
+    validator: Validator | None = None,
+    compresslevel: int = jsonl_sink.DEFAULT_COMPRESSLEVEL,
+    gzip_block_size: int | None = None,
+    jobs: int = 1,
+    sharding: Sharding | None = None,
+    max_memory: int | None = None,
 ) -> None:
     """Create Karp batch from karp baseline.
 
+    With `max_memory`, the entries are diffed in memory while they fit in it,
+    and else by merging sorted runs on disk, see `find_updates.find_updates_within`.
+
     Args:
         raw_entries (Path): the current raw entries
         baseline (Path): the old entries exported from karp
         output_path (Path): file to write to
         msg (str): message to use
+        streaming (bool, optional): use the sorted-merge diff with bounded memory. Defaults to False.
+        use_index (bool, optional): compare against the content-hash index of the baseline. Defaults to False.
+        index_path (Path | None, optional): the index to use. Defaults to the sidecar of the baseline.
+        validator (Validator | None, optional): which baseline rows to validate. Defaults to all.
+        compresslevel (int, optional): gzip compression level of the batch. Defaults to 6.
+        gzip_block_size (int | None, optional): write the batch as gzip members of this size. Defaults to one member.
+        jobs (int, optional): number of processes decoding the baseline. Defaults to 1.
+        sharding (Sharding | None, optional): split the batch in shards with a manifest, named after output_path. Defaults to one file.
+        max_memory (int | None, optional): bytes the loaded entries may take in memory. Defaults to no limit.
+    """  # noqa: E501
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with (
+        instrumentation.stage("diff") as stage,
+        _open_index(baseline, index_path, use_index=use_index) as index,
+        _open_budget(max_memory) as budget,
+    ):
+        stage.add_read(raw_entries, baseline)
+        cmds = _find_updates(
+            raw_entries,
+            baseline,
+            index=index,
+            msg=msg,
+            streaming=streaming,
+            validator=validator,
+            jobs=jobs,
+            budget=budget,
+        )
+        num_cmds, bytes_written = _write_batch(
+            cmds,
+            output_path,
+            sharding=sharding,
+            compresslevel=compresslevel,
+            gzip_block_size=gzip_block_size,
+        )
+        stage.entries += num_cmds
+        stage.bytes_written += bytes_written
+
+
+def raw_to_batch(
+    file: Path,
+    *,
+    baseline: Path,
+    msg: str,
+    title: str,
+    date_issued: str,
+    clean_saf_output: Path,
+    json_output: Path,
+    processed_saf_output: Path,
+    batch_output: Path,
+    workdir: Path | None = None,
+    encoding_cache: EncodingCache | None = None,
+    jobs: int = 1,
+    validator: Validator | None = None,
+    streaming: bool = False,
+    use_index: bool = False,
+    index_path: Path | None = None,
+    compresslevel: int = jsonl_sink.DEFAULT_COMPRESSLEVEL,
+    gzip_block_size: int | None = None,
+    sharding: Sharding | None = None,
+    previous_ids: "IdRegistry | None" = None,
+    id_registry: Path | None = None,
+    max_memory: int | None = None,
+) -> None:
+    """Clean, convert and diff a raw export in one process.
+
+    Every member of the raw zip is read once: it is decoded and unescaped, the
+    cleaned lines are streamed into the cleaned Simple Archive and at the same
+    time split into records and converted. The converted entries are then written
+    as jsonl and diffed against the baseline in the same pass. Only the spill
+    files of the conversion are intermediate, the processed Simple Archive stores
+    the jsonl as it is, without compressing it again.
+
+    With `max_memory`, the ids, the wordform map and the diff share one budget,
+    see `convert_and_package` and `create_karp_batch_from_export`.
+
+    Args:
+        file (Path): the raw Fula Ordboken export (zip)
+        baseline (Path): the entries exported from karp
+        msg (str): message to use in the batch
+        title (str): title to use for the archives
+        date_issued (str): date issued
+        clean_saf_output (Path): where to write the cleaned Simple Archive
+        json_output (Path): where to write the karp jsonl
+        processed_saf_output (Path): where to write the processed Simple Archive
+        batch_output (Path): where to write the batch of commands
+        workdir (Path | None, optional): specify where the temporary files should be stored. Defaults to None.
+        encoding_cache (EncodingCache | None, optional): cache of detected encodings. Defaults to None.
+        jobs (int, optional): number of processes parsing entries and decoding the baseline. Defaults to 1.
+        validator (Validator | None, optional): which entries to validate. Defaults to all.
+        streaming (bool, optional): use the sorted-merge diff with bounded memory. Defaults to False.
+        use_index (bool, optional): compare against the content-hash index of the baseline. Defaults to False.
+        index_path (Path | None, optional): the index to use. Defaults to the sidecar of the baseline.
+        compresslevel (int, optional): gzip compression level of the jsonl outputs. Defaults to 6.
+        gzip_block_size (int | None, optional): write the jsonl outputs as gzip members of this size. Defaults to one member.
+        sharding (Sharding | None, optional): split the batch in shards with a manifest, named after batch_output. Defaults to one file.
+        previous_ids (IdRegistry | None, optional): the ids of the previous release to keep. Defaults to None.
+        id_registry (Path | None, optional): where to write the id registry of this release. Defaults to None.
+        max_memory (int | None, optional): bytes the ids, wordforms and diff may take in memory. Defaults to no limit.
+    """  # noqa: E501
+    from resource_fula_ordboken.fula_ord_converter import FulaOrdTxt2JsonConverter, iter_records
+    from resource_fula_ordboken.id_registry import IdAllocator
+
+    # each member and the diff count their records from the start, like the three steps
+    validator = validator or Validator()
+    with (
+        _working_dir(workdir, file.stem) as working_dir,
+        _open_budget(max_memory, spill_dir=working_dir) as budget,
+    ):
+        converter = FulaOrdTxt2JsonConverter(
+            IdAllocator(previous_ids, keep_registry=id_registry is not None, budget=budget),
+            budget=budget,
+        )
+        spill_paths: list[Path] = []
+        hits, misses = (encoding_cache.hits, encoding_cache.misses) if encoding_cache else (0, 0)
+        with instrumentation.stage("clean_and_convert") as stage:
+            with (
+                zipfile.ZipFile(file) as zipf,
+                saf.SimpleArchiveZip(
+                    clean_saf_output, title=f"{title} (cleaned)", date_issued=date_issued
+                ) as clean_archive,
+            ):
+                for info, lines in _iter_cleaned_members(
+                    zipf, clean_archive, cache=encoding_cache
+                ):
+                    if info.filename.endswith(".txt"):
+                        spill_path = working_dir / f"{len(spill_paths)}.spill.jsonl"
+                        stage.entries += converter.spill_entries(
+                            iter_records(lines),
+                            spill_path,
+                            jobs=jobs,
+                            validator=Validator(validator.mode, validator.every),
+                        )
+                        spill_paths.append(spill_path)
+                    else:
+                        collections.deque(lines, maxlen=0)
+                    stage.bytes_read += info.file_size
+            stage.add_written(clean_saf_output)
+            if encoding_cache:
+                stage.add_cache(
+                    "encoding",
+                    hits=encoding_cache.hits - hits,
+                    misses=encoding_cache.misses - misses,
+                )
+
+        json_output.parent.mkdir(parents=True, exist_ok=True)
+        batch_output.parent.mkdir(parents=True, exist_ok=True)
+        with (
+            instrumentation.stage("write_and_diff") as stage,
+            _open_index(baseline, index_path, use_index=use_index) as index,
+            jsonl_sink.JsonlSink(
+                json_output, compresslevel=compresslevel, block_size=gzip_block_size
+            ) as json_sink,
+        ):
+            stage.add_read(baseline)
+            entries = _tee_objs(
+                itertools.chain.from_iterable(map(converter.iter_spilled, spill_paths)),
+                json_sink,
+            )
+            cmds = _find_updates(
+                entries,
+                baseline,
+                index=index,
+                msg=msg,
+                streaming=streaming,
+                validator=Validator(validator.mode, validator.every),
+                jobs=jobs,
+                budget=budget,
+            )
+            num_cmds, bytes_written = _write_batch(
+                cmds,
+                batch_output,
+                sharding=sharding,
+                compresslevel=compresslevel,
+                gzip_block_size=gzip_block_size,
+            )
+            stage.entries += num_cmds
+            stage.bytes_written += bytes_written
+        if id_registry:
+            converter.id_allocator.registry().write(id_registry)
+
+    _package(
+        [json_output],
+        title=f"{title} (processed)",
+        date_issued=date_issued,
+        output_path=processed_saf_output,
+    )
+
+
+def member_shard_path(json_output: Path, member: str) -> Path:
+    """Name the jsonl of one member of a zip after json_output and the member.
+
+    >>> member_shard_path(Path('out/fula_ordboken.jsonl.gz'), 'Ord A-K.txt')
+    PosixPath('out/fula_ordboken.ord_a-k.jsonl.gz')
+    """
+    stem = files.real_stem(json_output.name)
+    member_stem = files.normalize_file_name(files.real_stem(Path(member).name))
+    return json_output.with_name(f"{stem}.{member_stem}{json_output.name[len(stem) :]}")
+
+
+def _zip_text_members(file: Path) -> list[str]:
+    with zipfile.ZipFile(file) as zipf:
+        return [name for name in zipf.namelist() if name.endswith(".txt")]
+
+
+def _iter_parsed_members(
+    file: Path,
+    members: list[str],
+    working_dir: Path,
+    *,
+    jobs: int,
+    validator: Validator | None = None,
+) -> Iterator[Iterable["ParsedRecord"]]:
+    """Parse the members of a zip in order, one process per member if there are several.
+
+    The records of each member are validated by the process that parses them,
+    picked by a fresh copy of `validator` so that the same records are validated
+    regardless of `jobs`. Each yielded iterable must be consumed before the next
+    one is requested.
+    """
+    from resource_fula_ordboken import fula_ord_converter, record_scanner
+
+    validator = validator or Validator()
+    if jobs > 1 and len(members) > 1:
+        tasks = [
+            (
+                file,
+                member,
+                working_dir / f"{nr}.parsed.jsonl",
+                Validator(validator.mode, validator.every),
+            )
+            for nr, member in enumerate(members)
+        ]
+        done = parallel.ordered_map(_dump_parsed_member, tasks, jobs=min(jobs, len(members)))
+        for (_, _, parsed_path, _), _count in zip(tasks, done, strict=True):
+            yield fula_ord_converter.load_parsed(parsed_path)
+            parsed_path.unlink()
+        return
+    with zipfile.ZipFile(file) as zipf:
+        for member in members:
+            with zipf.open(member) as fp:
+                yield fula_ord_converter.iter_parsed(
+                    record_scanner.iter_stream_records(fp),
+                    jobs=jobs,
+                    validator=Validator(validator.mode, validator.every),
+                )
+
+
+def _iter_member_records(file: Path, members: list[str]) -> Iterator[Iterator[tuple[str, str]]]:
+    """Yield the records of a txt file, or of each member of a zip in turn."""
+    from resource_fula_ordboken import record_scanner
+
+    if file.suffix == ".txt":
+        yield record_scanner.iter_file_records(file)
+        return
+    with zipfile.ZipFile(file) as zipf:
+        for member in members:
+            with zipf.open(member) as fp:
+                yield record_scanner.iter_stream_records(fp)
+
+
+@contextlib.contextmanager
+def _write_record_manifest(
+    path: Path | None,
+) -> Generator[jsonl_sink.JsonlSink | None, None, None]:
+    """Write a record manifest next to path and move it in place when done.
+
+    The manifest of the previous release may be read from the same path, so it is
+    replaced rather than overwritten.
     """
-    dumped_cmds = (
-        cmd.serialize()
-        for cmd in find_updates.find_updates_from_export(raw_entries, baseline, msg=msg)
+    if path is None:
+        yield None
+        return
+    from resource_fula_ordboken import record_manifest
+
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    try:
+        with record_manifest.open_sink(tmp_path) as sink:
+            yield sink
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    tmp_path.replace(path)
+
+
+def _dump_parsed_member(task: tuple[Path, str, Path, Validator]) -> int:
+    """Parse and validate a member of a zip to a file, run in a worker process."""
+    from resource_fula_ordboken import fula_ord_converter, record_scanner
+
+    file, member, parsed_path, validator = task
+    with zipfile.ZipFile(file) as zipf, zipf.open(member) as fp:
+        return fula_ord_converter.dump_parsed(
+            record_scanner.iter_stream_records(fp), parsed_path, validator=validator
+        )
+
+
+def _run_cached(
+    stage_cache: StageCache,
+    name: str,
+    *,
+    inputs: list[Path],
+    outputs: dict[str, Path],
+    params: dict[str, Any],
+    run: Callable[[], None],
+) -> None:
+    """Restore the outputs of a use case from the cache, or run it and cache them."""
+    with instrumentation.stage("cache") as stage:
+        key = stage_cache.key(name, inputs, **params)
+        restored = stage_cache.restore(key, outputs)
+        stage.add_cache("stage", hits=int(restored), misses=int(not restored))
+    if restored:
+        return
+    # the outputs may be links to an older cache entry, which must be left untouched
+    for path in outputs.values():
+        path.unlink(missing_ok=True)
+    run()
+    stage_cache.put(key, outputs)
+
+
+def _open_budget(
+    max_memory: int | None, *, spill_dir: Path | None = None
+) -> contextlib.AbstractContextManager["MemoryBudget | None"]:
+    if max_memory:
+        from resource_fula_ordboken.shared.memory_budget import MemoryBudget
+
+        return MemoryBudget(max_memory, spill_dir=spill_dir)
+    return contextlib.nullcontext()
+
+
+@contextlib.contextmanager
+def _working_dir(workdir: Path | None, stem: str) -> Iterator[Path]:
+    """Create a unique working directory under workdir, removed with its contents on exit."""
+    from simple_archive.use_cases import create_unique_path
+
+    working_dir = create_unique_path(workdir or Path("tmp"), stem)
+    working_dir.mkdir(parents=True)
+    try:
+        yield working_dir
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def _open_index(
+    baseline: Path, index_path: Path | None, *, use_index: bool
+) -> contextlib.AbstractContextManager["BaselineIndex | None"]:
+    if use_index:
+        from resource_fula_ordboken.baseline_index import BaselineIndex
+
+        return BaselineIndex.open(baseline, index_path)
+    return contextlib.nullcontext()
+
+
+def _find_updates(
+    current: Path | Iterable[dict[str, Any]],
+    baseline: Path,
+    *,
+    index: "BaselineIndex | None",
+    msg: str,
+    streaming: bool,
+    validator: Validator | None,
+    jobs: int,
+    budget: "MemoryBudget | None" = None,
+) -> Iterable["FulaOrdEntryCmd"]:
+    """Select how to diff the current entries against the baseline."""
+    from resource_fula_ordboken import find_updates
+
+    if index is not None:
+        return find_updates.find_updates_from_index(current, index, msg=msg)
+    if streaming and budget is not None:
+        return find_updates.iter_updates_from_export(
+            current,
+            baseline,
+            msg=msg,
+            chunk_size=find_updates.chunk_size_within(budget),
+            tmpdir=budget.temp_dir(),
+            validator=validator,
+        )
+    if streaming:
+        return find_updates.iter_updates_from_export(
+            current, baseline, msg=msg, validator=validator
+        )
+    if budget is not None:
+        return find_updates.find_updates_within(
+            current, baseline, msg=msg, budget=budget, validator=validator, jobs=jobs
+        )
+    return find_updates.find_updates_from_export(
+        current, baseline, msg=msg, validator=validator, jobs=jobs
     )
 
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    json_arrays.dump_to_file(dumped_cmds, output_path)
+
+def _write_batch(
+    cmds: Iterable["FulaOrdEntryCmd"],
+    output_path: Path,
+    *,
+    sharding: Sharding | None,
+    compresslevel: int,
+    gzip_block_size: int | None,
+) -> tuple[int, int]:
+    """Write the commands to output_path, or to its shards.
+
+    Returns:
+        tuple[int, int]: the number of commands and of bytes written
+    """
+    dumped_cmds = (cmd.serialize() for cmd in cmds)
+    if sharding is None:
+        sink = jsonl_sink.dump_to_file(
+            dumped_cmds,
+            output_path,
+            compresslevel=compresslevel,
+            block_size=gzip_block_size,
+            default=_serialize_id,
+        )
+        return sink.num_lines, sink.bytes_out
+    with ShardedBatchWriter(
+        output_path,
+        sharding,
+        compresslevel=compresslevel,
+        block_size=gzip_block_size,
+        default=_serialize_id,
+    ) as writer:
+        writer.write_all(dumped_cmds)
+    manifest = writer.close()
+    return manifest["commands"], manifest["bytes"]
+
+
+def _serialize_id(obj: Any) -> str:
+    """Write the ULIDs of commands as strings, orjson doesn't know about them."""
+    import ulid
+
+    if isinstance(obj, ulid.ULID):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _iter_cleaned_members(
+    zipf: zipfile.ZipFile,
+    archive: saf.SimpleArchiveZip,
+    *,
+    cache: EncodingCache | None,
+) -> Iterator[tuple[zipfile.ZipInfo, Iterator[str]]]:
+    """Clean the top-level members of a raw zip into archive, yielding the lines of each.
+
+    Each line is written to the archive as it is read, so each yielded iterator must
+    be consumed before the next member is requested.
+    """
+    for info in zipf.infolist():
+        if info.is_dir() or "/" in info.filename:
+            continue
+        encoding = files.detect_zip_member_encoding(zipf, info, cache=cache)
+        with zipf.open(info) as src, _open_text(archive, info.filename) as clean_fp:
+            yield (
+                info,
+                _tee_lines(
+                    files.iter_unescaped_lines(src, encoding=encoding["encoding"]), clean_fp
+                ),
+            )
+
+
+def _tee_lines(lines: Iterable[str], fp: IO[str]) -> Iterator[str]:
+    for line in lines:
+        fp.write(line)
+        yield line
+
+
+def _tee_objs(
+    objs: Iterable[dict[str, Any]], sink: jsonl_sink.JsonlSink
+) -> Iterator[dict[str, Any]]:
+    for obj in objs:
+        sink.write(obj)
+        yield obj
+
+
+def _package(paths: list[Path], *, title: str, date_issued: str, output_path: Path) -> None:
+    """Package files as a Simple Archive, reading them in place."""
+    with instrumentation.stage("package") as stage:
+        saf.write_simple_archive(output_path, paths, title=title, date_issued=date_issued)
+        stage.add_written(output_path)
+
+
+@contextlib.contextmanager
+def _open_text(archive: saf.SimpleArchiveZip, name: str) -> Generator[IO[str], None, None]:
+    """Open a file of the archive for writing utf-8 text."""
+    with archive.open(name) as fp, io.TextIOWrapper(fp, encoding="utf-8") as text_fp:
+        yield text_fp
+
+
+def index_baseline(
+    baseline: Path, *, index_path: Path | None = None, validator: Validator | None = None
+) -> Path:
+    """Build the content-hash index for a Karp baseline export.
+
+    Args:
+        baseline (Path): the entries exported from karp
+        index_path (Path | None, optional): where to write the index. Defaults to a sidecar of the baseline.
+        validator (Validator | None, optional): which baseline rows to validate. Defaults to all.
+
+    Returns:
+        Path: the path of the written index
+    """  # noqa: E501
+    from resource_fula_ordboken import baseline_index
+    from resource_fula_ordboken.baseline_index import BaselineIndex
+
+    index_path = index_path or baseline_index.default_index_path(baseline)
+    with instrumentation.stage("index") as stage:
+        with BaselineIndex.build(baseline, index_path, validator=validator) as index:
+            stage.entries += len(index)
+        stage.add_read(baseline)
+        stage.add_written(index_path)
+    return index_path
+
+
+def verify_batch(
+    batch: Path,
+    *,
+    current: Path,
+    baseline: Path,
+    use_index: bool = False,
+    index_path: Path | None = None,
+    max_memory: int | None = None,
+) -> "Verification":
+    """Check a batch by replaying it on the baseline and comparing with the current entries.
+
+    Args:
+        batch (Path): the batch, or the path its shards and manifest are named after
+        current (Path): the converted entries the batch was made from
+        baseline (Path): the entries exported from karp
+        use_index (bool, optional): read the content-hash index instead of the baseline. Defaults to False.
+        index_path (Path | None, optional): the index to use. Defaults to the sidecar of the baseline.
+        max_memory (int | None, optional): bytes the replayed entries may take in memory. Defaults to no limit.
+
+    Returns:
+        Verification: the commands replayed and the problems found
+    """  # noqa: E501
+    from resource_fula_ordboken import batch_verifier
+
+    with (
+        instrumentation.stage("verify") as stage,
+        _open_index(baseline, index_path, use_index=use_index) as index,
+        _open_budget(max_memory) as budget,
+    ):
+        verification = batch_verifier.verify_batch(
+            batch, current=current, baseline=baseline, index=index, budget=budget
+        )
+        stage.entries += verification.entries
+        stage.add_read(current, *(path for path, _ in batch_verifier.batch_files(batch)))
+        if index is None:
+            stage.add_read(baseline)
+    return verification
+
+
+class ReleaseResult(NamedTuple):
+    """How rebuilding one release went, see `rebuild_releases`."""
+
+    path: Path
+    date_issued: str
+    clean_s: float
+    convert_s: float
+    error: str | None = None
+
+
+def release_outputs(file: Path, output_dir: Path) -> tuple[Path, Path, Path]:
+    """Name the outputs of a raw export like 'raw2clean' and 'raw2batch' do.
+
+    Returns:
+        tuple[Path, Path, Path]: the cleaned archive, the jsonl and the processed archive
+    """
+    output_name = files.normalize_file_name(file.stem)
+    return (
+        output_dir / "data_clean" / f"{output_name}.clean.saf.zip",
+        output_dir / "data_processed" / f"{output_name}.jsonl.gz",
+        output_dir / "data_processed" / f"{output_name}.processed.saf.zip",
+    )
+
+
+def rebuild_releases(
+    raw_files: list[Path],
+    *,
+    output_dir: Path,
+    jobs: int = 1,
+    workdir: Path | None = None,
+    cache_dir: Path | None = None,
+    encoding_cache: bool = True,
+    stage_cache: bool = True,
+    validator: Validator | None = None,
+    compresslevel: int = jsonl_sink.DEFAULT_COMPRESSLEVEL,
+    max_memory: int | None = None,
+) -> list[ReleaseResult]:
+    """Clean, convert and package a number of raw exports, `jobs` at a time.
+
+    Every release is cleaned and converted like 'raw2clean' followed by
+    'clean2karp', in a pool of `jobs` processes if more than one. A release that
+    fails doesn't stop the others, its error is in its result.
+
+    Args:
+        raw_files (list[Path]): the raw Fula Ordboken exports (zip)
+        output_dir (Path): where to write the outputs, see `release_outputs`
+        jobs (int, optional): number of releases rebuilt at once. Defaults to 1.
+        workdir (Path | None, optional): where the temporary files should be stored. Defaults to None.
+        cache_dir (Path | None, optional): where to keep the caches. Defaults to the default cache directory.
+        encoding_cache (bool, optional): cache detected encodings. Defaults to True.
+        stage_cache (bool, optional): reuse the outputs of unchanged inputs. Defaults to True.
+        validator (Validator | None, optional): which entries to validate. Defaults to all.
+        compresslevel (int, optional): gzip compression level of the jsonl. Defaults to 6.
+        max_memory (int | None, optional): bytes the ids and wordforms of a release may take in memory. Defaults to no limit.
+
+    Returns:
+        list[ReleaseResult]: the result of every release, in the order of raw_files
+    """  # noqa: E501
+    from resource_fula_ordboken.shared.progress import progress
+
+    rebuild = functools.partial(
+        _rebuild_release,
+        output_dir=output_dir,
+        workdir=workdir,
+        cache_dir=cache_dir,
+        encoding_cache=encoding_cache,
+        stage_cache=stage_cache,
+        validator=validator,
+        compresslevel=compresslevel,
+        max_memory=max_memory,
+        quiet=jobs > 1,
+    )
+    results = (
+        parallel.ordered_map(rebuild, raw_files, jobs=jobs)
+        if jobs > 1 and len(raw_files) > 1
+        else map(rebuild, raw_files)
+    )
+    return list(
+        progress(results, desc="Rebuilding releases", unit=" releases", total=len(raw_files))
+    )
+
+
+def _rebuild_release(
+    file: Path,
+    *,
+    output_dir: Path,
+    workdir: Path | None,
+    cache_dir: Path | None,
+    encoding_cache: bool,
+    stage_cache: bool,
+    validator: Validator | None,
+    compresslevel: int,
+    max_memory: int | None,
+    quiet: bool,
+) -> ReleaseResult:
+    """Clean and convert one release, run in a worker process by `rebuild_releases`."""
+    if quiet:
+        from resource_fula_ordboken.shared.progress import set_progress_factory
+
+        # the progress bars of the workers would be drawn over each other
+        set_progress_factory(None)
+    date_issued = file.stem.split(" ")[-1]
+    clean_output, json_output, processed_output = release_outputs(file, output_dir)
+    clean_s = convert_s = 0.0
+    converting = False
+    start = time.perf_counter()
+    try:
+        clean_data_and_package(
+            file,
+            title=f"{file.stem} (cleaned)",
+            date_issued=date_issued,
+            output_path=clean_output,
+            workdir=workdir,
+            encoding_cache=EncodingCache.in_dir(cache_dir) if encoding_cache else None,
+            stage_cache=StageCache.in_dir(cache_dir) if stage_cache else None,
+        )
+        clean_s = time.perf_counter() - start
+        converting = True
+        start = time.perf_counter()
+        convert_and_package(
+            clean_output,
+            title=f"{file.stem} (processed)",
+            date_issued=date_issued,
+            json_output=json_output,
+            saf_output=processed_output,
+            workdir=workdir,
+            validator=validator,
+            compresslevel=compresslevel,
+            stage_cache=StageCache.in_dir(cache_dir) if stage_cache else None,
+            max_memory=max_memory,
+        )
+        convert_s = time.perf_counter() - start
+    except Exception as exc:  # the other releases go on
+        error = f"{type(exc).__name__}: {exc}"
+        if converting:
+            convert_s = time.perf_counter() - start
+        else:
+            clean_s = time.perf_counter() - start
+        return ReleaseResult(file, date_issued, clean_s, convert_s, error)
+    return ReleaseResult(file, date_issued, clean_s, convert_s)
+
+
+def cleanup_workdirs(
+    workdir: Path | None = None, *, older_than: float, dry_run: bool = False
+) -> list[Path]:
+    """Remove work directories left behind by earlier runs.
+
+    Args:
+        workdir (Path | None, optional): where the work directories are created. Defaults to 'tmp'.
+        older_than (float): only remove directories not modified for this many seconds
+        dry_run (bool, optional): only list the directories to remove. Defaults to False.
+
+    Returns:
+        list[Path]: the removed directories
+    """  # noqa: E501
+    working_dir = workdir or Path("tmp")
+    if not working_dir.is_dir():
+        return []
+    limit = time.time() - older_than
+    stale = sorted(
+        path
+        for path in working_dir.iterdir()
+        if path.is_dir() and not path.is_symlink() and path.stat().st_mtime < limit
+    )
+    if not dry_run:
+        for path in stale:
+            shutil.rmtree(path)
+    return stale
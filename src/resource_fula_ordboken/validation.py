@@ -0,0 +1,41 @@
+"""Choose which records to validate, importable without loading pydantic."""
+
+import enum
+
+
+class Validation(str, enum.Enum):
+    """How much of the data to validate with pydantic."""
+
+    STRICT = "strict"
+    SAMPLED = "sampled"
+    OFF = "off"
+
+
+DEFAULT_VALIDATE_EVERY = 100
+
+
+class Validator:
+    """Decide which records to validate.
+
+    With `Validation.SAMPLED` the first record and then every `every`-th is validated.
+    """
+
+    def __init__(
+        self, mode: Validation = Validation.STRICT, every: int = DEFAULT_VALIDATE_EVERY
+    ) -> None:
+        """Create a validator for the given mode."""
+        if every < 1:
+            raise ValueError(f"every must be positive, got {every}")
+        self.mode = mode
+        self.every = every
+        self.count = 0
+
+    def should_validate(self) -> bool:
+        """Count a record and tell if it should be validated."""
+        count = self.count
+        self.count += 1
+        if self.mode is Validation.STRICT:
+            return True
+        if self.mode is Validation.OFF:
+            return False
+        return count % self.every == 0
@@ -0,0 +1,29 @@
+from pathlib import Path
+
+import json_arrays
+import pytest
+
+from tests.helpers import make_entry, make_exported
+
+
+@pytest.fixture(name="export_files")
+def fixture_export_files(tmp_path: Path) -> tuple[Path, Path]:
+    baseline = tmp_path / "baseline.jsonl.gz"
+    current = tmp_path / "current.jsonl.gz"
+    json_arrays.dump_to_file(
+        [
+            make_exported(make_entry("c..1", "ccc"), "01HZ0000000000000000000003", version=3),
+            make_exported(make_entry("a..1", "aaa"), "01HZ0000000000000000000001"),
+            make_exported(make_entry("b..1", "bbb"), "01HZ0000000000000000000002", version=2),
+        ],
+        baseline,
+    )
+    json_arrays.dump_to_file(
+        [
+            make_entry("d..1", "ddd") | {"jfr": None},
+            make_entry("b..1", "bbb") | {"jfr": None},
+            make_entry("a..1", "changed"),
+        ],
+        current,
+    )
+    return current, baseline
@@ -0,0 +1,14 @@
+"""Build Fula Ordboken entries and Karp exports for the tests."""
+
+
+def make_entry(entry_id: str, text: str) -> dict:
+    return {
+        "baseform": entry_id.partition("..")[0],
+        "id": entry_id,
+        "wordforms": [],
+        "text": text,
+    }
+
+
+def make_exported(entry: dict, entity_id: str, version: int = 1) -> dict:
+    return {"entry": entry, "id": entity_id, "version": version, "resource": "fulaord"}
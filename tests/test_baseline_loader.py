@@ -0,0 +1,83 @@
+from pathlib import Path
+
+import json_arrays
+import pytest
+from pydantic import ValidationError
+
+from resource_fula_ordboken import baseline_loader, find_updates
+from resource_fula_ordboken.models import (
+    FulaOrdEntryCmd,
+    FulaOrdExportRecord,
+    Validation,
+    Validator,
+)
+from tests.helpers import make_entry, make_exported
+
+
+@pytest.fixture(name="large_baseline")
+def fixture_large_baseline(tmp_path: Path) -> Path:
+    baseline = tmp_path / "baseline.jsonl.gz"
+    json_arrays.dump_to_file(
+        (
+            make_exported(make_entry(f"w{nr:04}..1", f"text {nr}"), f"01HZ{nr:022}", version=nr)
+            for nr in range(250)
+        ),
+        baseline,
+    )
+    return baseline
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+@pytest.mark.parametrize("suffix", [".jsonl.gz", ".jsonl", ".json"])
+def test_batches_match_the_export(
+    large_baseline: Path, tmp_path: Path, jobs: int, suffix: str
+) -> None:
+    expected = list(json_arrays.load_from_file(large_baseline))
+    baseline = tmp_path / f"export{suffix}"
+    json_arrays.dump_to_file(expected, baseline)
+
+    batches = list(baseline_loader.iter_baseline_batches(baseline, jobs=jobs, batch_size=64))
+
+    assert [len(batch) for batch in batches] == [64, 64, 64, 58]
+    records = [record for batch in batches for record in batch]
+    assert [(r.id, r.version, r.resource, r.entry) for r in records] == [
+        (r.id, r.version, r.resource, r.entry)
+        for r in map(FulaOrdExportRecord.from_export, expected)
+    ]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_sampled_validation_does_not_depend_on_jobs(tmp_path: Path, jobs: int) -> None:
+    baseline = tmp_path / "baseline.jsonl.gz"
+    objs = [make_exported(make_entry(f"w{nr}..1", "text"), f"01HZ{nr:022}") for nr in range(30)]
+    del objs[14]["entry"]["baseform"]
+    json_arrays.dump_to_file(objs, baseline)
+
+    def load(every: int) -> None:
+        for _ in baseline_loader.iter_baseline_batches(
+            baseline,
+            jobs=jobs,
+            batch_size=4,
+            validator=Validator(Validation.SAMPLED, every),
+        ):
+            pass
+
+    load(every=5)
+    with pytest.raises(ValidationError):
+        load(every=7)
+
+
+def test_parallel_load_gives_the_same_diff(export_files: tuple[Path, Path]) -> None:
+    current, baseline = export_files
+
+    cmds = find_updates.find_updates_from_export(current, baseline, msg="test", jobs=2)
+
+    assert list(map(_comparable, cmds)) == list(
+        map(_comparable, find_updates.find_updates_from_export(current, baseline, msg="test"))
+    )
+
+
+def _comparable(cmd: FulaOrdEntryCmd) -> dict:
+    """Drop the fields that are generated when a command is created."""
+    generated = {"timestamp", "id"} if cmd.cmdtype == "add_entry" else {"timestamp"}
+    return {key: value for key, value in cmd.serialize().items() if key not in generated}
@@ -0,0 +1,142 @@
+import gzip
+from pathlib import Path
+
+import orjson
+import pytest
+
+from resource_fula_ordboken import use_cases
+from resource_fula_ordboken.batch_shards import (
+    ShardedBatchWriter,
+    Sharding,
+    load_manifest,
+    manifest_path,
+    shard_path,
+)
+from resource_fula_ordboken.shared import files
+
+
+def _cmds(num_entries: int) -> list[dict]:
+    cmds = []
+    for nr in range(num_entries):
+        cmds.append({"cmdtype": "update_entry", "id": f"01HZ{nr:022}", "entry": {"nr": nr}})
+        if nr % 3 == 0:
+            cmds.append({"cmdtype": "delete_entry", "id": f"01HZ{nr:022}"})
+    return cmds
+
+
+def _read(path: Path) -> list[dict]:
+    return [orjson.loads(line) for line in gzip.decompress(path.read_bytes()).splitlines()]
+
+
+def test_commands_for_an_entry_share_a_shard(tmp_path: Path) -> None:
+    output_path = tmp_path / "batch.jsonl.gz"
+    cmds = _cmds(100)
+
+    with ShardedBatchWriter(output_path, Sharding(num_shards=4)) as writer:
+        writer.write_all(cmds)
+
+    manifest = load_manifest(output_path)
+    assert manifest["commands"] == len(cmds)
+    assert [shard["path"] for shard in manifest["shards"]] == [
+        shard_path(output_path, nr).name for nr in range(4)
+    ]
+    shard_of_id: dict[str, int] = {}
+    written = []
+    for nr, shard in enumerate(manifest["shards"]):
+        path = tmp_path / shard["path"]
+        assert shard["sha256"] == files.file_digest(path)
+        assert shard["bytes"] == path.stat().st_size
+        shard_cmds = _read(path)
+        assert shard["commands"] == len(shard_cmds)
+        assert sum(shard["cmdtypes"].values()) == len(shard_cmds)
+        for cmd in shard_cmds:
+            assert shard_of_id.setdefault(cmd["id"], nr) == nr
+        written.extend(shard_cmds)
+    assert sorted(written, key=orjson.dumps) == sorted(cmds, key=orjson.dumps)
+
+
+def test_shards_are_filled_up_to_the_limit(tmp_path: Path) -> None:
+    output_path = tmp_path / "batch.jsonl.gz"
+    cmds = _cmds(10)
+
+    with ShardedBatchWriter(output_path, Sharding(max_commands=4)) as writer:
+        writer.write_all(cmds)
+
+    manifest = load_manifest(output_path)
+    assert [shard["commands"] for shard in manifest["shards"]] == [4, 4, 4, 2]
+    assert [
+        cmd for shard in manifest["shards"] for cmd in _read(tmp_path / shard["path"])
+    ] == cmds
+
+
+def test_commands_for_an_entry_in_a_full_shard_are_refused(tmp_path: Path) -> None:
+    writer = ShardedBatchWriter(tmp_path / "batch.jsonl.gz", Sharding(max_commands=1))
+    writer.write({"cmdtype": "update_entry", "id": "a"})
+    writer.write({"cmdtype": "update_entry", "id": "b"})
+    with pytest.raises(ValueError, match="split over shards"), writer:
+        writer.write({"cmdtype": "delete_entry", "id": "a"})
+
+
+def test_all_shards_are_closed_when_one_fails(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    output_path = tmp_path / "batch.jsonl.gz"
+    writer = ShardedBatchWriter(output_path, Sharding(num_shards=3))
+    failing = writer.shards[0].sink
+    close = failing.close
+
+    def broken_close() -> None:
+        close()
+        raise OSError("disk full")
+
+    monkeypatch.setattr(failing, "close", broken_close)
+
+    with pytest.raises(OSError, match="disk full"), writer:
+        writer.write_all(_cmds(10))
+
+    for shard in writer.shards[1:]:
+        assert _read(shard.path)
+    assert not manifest_path(output_path).exists()
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{}, {"num_shards": 2, "max_commands": 10}, {"num_shards": 0}]
+)
+def test_invalid_sharding(kwargs: dict) -> None:
+    with pytest.raises(ValueError):  # noqa: PT011
+        Sharding(**kwargs)
+
+
+def test_sharded_batch_has_the_same_commands(
+    tmp_path: Path, export_files: tuple[Path, Path]
+) -> None:
+    current, baseline = export_files
+    use_cases.create_karp_batch_from_export(
+        current, baseline=baseline, output_path=tmp_path / "batch.jsonl.gz", msg="test"
+    )
+    use_cases.create_karp_batch_from_export(
+        current,
+        baseline=baseline,
+        output_path=tmp_path / "sharded" / "batch.jsonl.gz",
+        msg="test",
+        sharding=Sharding(num_shards=2),
+    )
+
+    manifest = load_manifest(tmp_path / "sharded" / "batch.jsonl.gz")
+    sharded = [
+        cmd
+        for shard in manifest["shards"]
+        for cmd in _read(tmp_path / "sharded" / shard["path"])
+    ]
+    assert manifest["commands"] == len(sharded)
+    assert not (tmp_path / "sharded" / "batch.jsonl.gz").exists()
+    assert sorted(map(_comparable, sharded)) == sorted(
+        map(_comparable, _read(tmp_path / "batch.jsonl.gz"))
+    )
+
+
+def _comparable(cmd: dict) -> bytes:
+    cmd = {key: value for key, value in cmd.items() if key != "timestamp"}
+    if cmd["cmdtype"] == "add_entry":
+        del cmd["id"]
+    return orjson.dumps(cmd, option=orjson.OPT_SORT_KEYS)
@@ -0,0 +1,138 @@
+import gzip
+from pathlib import Path
+
+import json_arrays
+import orjson
+import pytest
+
+from resource_fula_ordboken import use_cases
+from resource_fula_ordboken.batch_shards import Sharding
+from resource_fula_ordboken.batch_verifier import BatchReplay, verify_batch
+from tests.helpers import make_entry, make_exported
+
+
+def _write_batch(
+    tmp_path: Path, export_files: tuple[Path, Path], sharding: Sharding | None = None
+) -> Path:
+    current, baseline = export_files
+    batch = tmp_path / "batch.jsonl.gz"
+    use_cases.create_karp_batch_from_export(
+        current, baseline=baseline, output_path=batch, msg="test", sharding=sharding
+    )
+    return batch
+
+
+def _read(path: Path) -> list[dict]:
+    return [orjson.loads(line) for line in gzip.decompress(path.read_bytes()).splitlines()]
+
+
+def _rewrite(path: Path, cmds: list[dict]) -> None:
+    path.write_bytes(gzip.compress(b"".join(orjson.dumps(cmd) + b"\n" for cmd in cmds)))
+
+
+@pytest.mark.parametrize("sharding", [None, Sharding(num_shards=2)])
+def test_batch_from_find_updates_is_correct(
+    tmp_path: Path, export_files: tuple[Path, Path], sharding: Sharding | None
+) -> None:
+    current, baseline = export_files
+    batch = _write_batch(tmp_path, export_files, sharding=sharding)
+
+    verification = verify_batch(batch, current=current, baseline=baseline)
+
+    assert verification.ok, verification.problems
+    assert verification.commands == {"add_entry": 1, "update_entry": 1, "delete_entry": 1}
+    assert verification.entries == len(list(json_arrays.load_from_file(current)))
+
+
+@pytest.mark.parametrize("max_memory", [None, 1])
+def test_verify_batch_on_the_index(
+    tmp_path: Path, export_files: tuple[Path, Path], max_memory: int | None
+) -> None:
+    current, baseline = export_files
+    batch = _write_batch(tmp_path, export_files)
+    use_cases.index_baseline(baseline)
+
+    verification = use_cases.verify_batch(
+        batch, current=current, baseline=baseline, use_index=True, max_memory=max_memory
+    )
+
+    assert verification.ok, verification.problems
+
+
+def test_missing_and_stale_commands_are_found(
+    tmp_path: Path, export_files: tuple[Path, Path]
+) -> None:
+    current, baseline = export_files
+    batch = _write_batch(tmp_path, export_files)
+    cmds = {cmd["cmdtype"]: cmd for cmd in _read(batch)}
+    # the delete is lost and the update is for an older version
+    _rewrite(batch, [cmds["add_entry"], cmds["update_entry"] | {"version": 0}])
+
+    verification = verify_batch(batch, current=current, baseline=baseline)
+
+    assert not verification.ok
+    assert verification.problems == [
+        (
+            "update_entry of '01HZ0000000000000000000001' (a..1) is for version 0,"
+            " but it is at version 1"
+        ),
+        "'a..1' differs from the current entry",
+        "'c..1' is left after the batch, but not current",
+    ]
+
+
+def test_replay_checks_every_command() -> None:
+    replay = BatchReplay()
+    replay.load_baseline([make_exported(make_entry("a..1", "aaa"), "E1", version=2)])
+
+    replay.apply_all(
+        [
+            {"cmdtype": "add_entry", "id": "E1", "entry": make_entry("b..1", "bbb")},
+            {"cmdtype": "delete_entry", "id": "E2", "version": 1},
+            {
+                "cmdtype": "update_entry",
+                "id": "E1",
+                "version": 2,
+                "entry": make_entry("a..1", "aaa"),
+            },
+            {
+                "cmdtype": "update_entry",
+                "id": "E1",
+                "version": 3,
+                "entry": make_entry("a..1", "new"),
+            },
+            {"cmdtype": "add_entry", "id": "E3", "entry": make_entry("a..1", "new")},
+            {"cmdtype": "import_entry", "id": "E4"},
+        ]
+    )
+    verification = replay.compare([make_entry("a..1", "new")])
+
+    *problems, duplicated = verification.problems
+    assert verification.num_problems == len(verification.problems)
+    assert problems == [
+        "add_entry of 'E1', which exists",
+        "delete_entry of 'E2', which doesn't exist",
+        "update_entry of 'E1' (a..1) doesn't change it",
+        "unknown command 'import_entry' for 'E4'",
+    ]
+    assert "is the entry of more than one entity" in duplicated
+
+
+def test_shards_are_checked_against_the_manifest(
+    tmp_path: Path, export_files: tuple[Path, Path]
+) -> None:
+    current, baseline = export_files
+    batch = _write_batch(tmp_path, export_files, sharding=Sharding(max_commands=1))
+    shard = next(tmp_path.glob("batch.00000.*"))
+    _rewrite(shard, _read(shard))
+
+    verification = verify_batch(batch, current=current, baseline=baseline)
+
+    assert verification.problems == ["the shard 'batch.00000.jsonl.gz' doesn't match its sha256"]
+
+
+def test_verify_batch_needs_a_batch(tmp_path: Path, export_files: tuple[Path, Path]) -> None:
+    current, baseline = export_files
+
+    with pytest.raises(ValueError, match="no batch"):
+        verify_batch(tmp_path / "batch.jsonl.gz", current=current, baseline=baseline)
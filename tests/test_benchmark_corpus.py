@@ -0,0 +1,37 @@
+import io
+from pathlib import Path
+
+from benchmarks import corpus
+from resource_fula_ordboken import text
+from resource_fula_ordboken.fula_ord_converter import FulaOrdTxt2JsonConverter, iter_records
+
+
+def test_corpus_is_deterministic(tmp_path: Path) -> None:
+    first = corpus.write_corpus(tmp_path / "first.txt", 200, encoding="latin-1", escape=True)
+    second = corpus.write_corpus(tmp_path / "second.txt", 200, encoding="latin-1", escape=True)
+
+    assert first.read_bytes() == second.read_bytes()
+    assert (
+        first.read_bytes()
+        != corpus.write_corpus(tmp_path / "other.txt", 200, seed=2).read_bytes()
+    )
+
+
+def test_raw_corpus_unescapes_to_clean_corpus() -> None:
+    raw = corpus.generate_records(200, escape=True)
+    clean = corpus.generate_records(200)
+
+    assert raw != clean
+    assert [text.unescape_str(record) for record in raw] == clean
+
+
+def test_corpus_converts_to_one_entry_per_record() -> None:
+    num_records = 500
+    records = corpus.generate_records(num_records)
+    converter = FulaOrdTxt2JsonConverter()
+
+    entries = list(converter.update_jfr(converter.convert_entry(io.StringIO("".join(records)))))
+
+    assert len(list(iter_records(io.StringIO("".join(records))))) == len(entries) == num_records
+    assert any(entry.jfr for entry in entries)
+    assert any(entry.id.endswith("..2") for entry in entries)
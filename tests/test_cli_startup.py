@@ -0,0 +1,34 @@
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = [
+    "pydantic",
+    "karp_lex_types",
+    "chardet",
+    "tqdm",
+    "ulid",
+    "simple_archive",
+    "rich",
+    "multiprocessing",
+    "unicodedata",
+    "tempfile",
+    "sqlite3",
+]
+
+
+@pytest.mark.parametrize("args", [["--help"], ["raw2clean", "--help"]])
+def test_cli_help_does_not_import_heavy_dependencies(args: list[str]) -> None:
+    script = (
+        "import sys\n"
+        "from resource_fula_ordboken.cli import subapp\n"
+        f"try:\n    subapp({args!r})\n"
+        "except SystemExit:\n    pass\n"
+        f"print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], check=True, capture_output=True, text=True
+    )
+
+    assert not result.stdout.splitlines()[-1]
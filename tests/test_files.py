@@ -0,0 +1,137 @@
+import io
+import zipfile
+from pathlib import Path
+
+import pytest
+from chardet import UniversalDetector
+
+from resource_fula_ordboken.shared import files
+from resource_fula_ordboken.shared.cache import EncodingCache
+
+
+@pytest.mark.parametrize(
+    ("content", "expected"),
+    [
+        (b"only ascii\n" * 10, "ascii"),
+        (b"a" * 5000 + "späd gädda\n".encode(), "utf-8"),
+        (b"a" * 5000 + "späd\n".encode() + b"b" * 5000 + b"\xc3", None),
+        ("\ufeff%word_word%späd\n".encode(), "UTF-8-SIG"),
+    ],
+    ids=["ascii", "late-utf-8", "truncated-utf-8", "utf-8-bom"],
+)
+def test_detect_stream_encoding_utf8_check(content: bytes, expected: str | None) -> None:
+    result = files.detect_stream_encoding(io.BytesIO(content), buffer_size=1024)
+
+    if expected:
+        assert result["encoding"] == expected
+    else:
+        assert result["encoding"] not in {"ascii", "utf-8"}
+
+
+def test_detect_stream_encoding_samples_late_non_ascii() -> None:
+    content = b"plain ascii line\n" * 10_000 + "Åsa åt gröt på ön.\n".encode("latin-1") * 50
+
+    result = files.detect_stream_encoding(io.BytesIO(content), sample_size=1024)
+
+    assert result["encoding"] is not None
+    assert content.decode(result["encoding"]).endswith("Åsa åt gröt på ön.\n")
+
+
+class _RecordingStream(io.BytesIO):
+    def __init__(self, content: bytes) -> None:
+        super().__init__(content)
+        self.reads: list[tuple[int, int]] = []
+        self.seeks: list[tuple[int, int]] = []
+
+    def read(self, size: int | None = -1, /) -> bytes:
+        offset = self.tell()
+        data = super().read(size)
+        self.reads.append((offset, len(data)))
+        return data
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET, /) -> int:
+        self.seeks.append((offset, whence))
+        return super().seek(offset, whence)
+
+
+@pytest.mark.parametrize("known_size", [True, False])
+def test_detect_stream_encoding_feeds_chardet_bounded_samples(
+    monkeypatch: pytest.MonkeyPatch, *, known_size: bool
+) -> None:
+    content = "Åsa åt gröt på ön.\n".encode("latin-1") * 4000
+    fp = _RecordingStream(content)
+    fed: list[int] = []
+    feed = UniversalDetector.feed
+
+    def record_feed(self: UniversalDetector, data: bytes) -> None:
+        fed.append(len(data))
+        feed(self, data)
+
+    monkeypatch.setattr(UniversalDetector, "feed", record_feed)
+
+    files.detect_stream_encoding(
+        fp,
+        buffer_size=16_384,
+        num_samples=4,
+        sample_size=1000,
+        size=len(content) if known_size else None,
+    )
+
+    # the failed utf-8 read, then one sample around the invalid byte and four spread ones
+    assert fp.reads[0] == (0, 16_384)
+    assert fed == [1000] * 5
+    quarter = len(content) // 4
+    assert [offset for offset, whence in fp.seeks if whence == io.SEEK_SET] == [
+        0,
+        quarter,
+        2 * quarter,
+        3 * quarter,
+    ]
+    assert ((0, io.SEEK_END) in fp.seeks) is not known_size
+
+
+def test_encoding_cache_skips_detection(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    raw_zip = tmp_path / "raw.zip"
+    with zipfile.ZipFile(raw_zip, "w") as zipf:
+        zipf.writestr("fula.txt", "gröt &amp; gädda\n".encode("latin-1"))
+    cache = EncodingCache(tmp_path / "cache" / "encodings.json")
+    with zipfile.ZipFile(raw_zip) as zipf:
+        files.clean_zip_member(zipf, "fula.txt", tmp_path / "first.txt", cache=cache)
+
+    def fail(*_args: object, **_kwargs: object) -> None:
+        raise AssertionError("detection should be cached")
+
+    monkeypatch.setattr(files, "detect_stream_encoding", fail)
+    cache = EncodingCache(tmp_path / "cache" / "encodings.json")
+    with zipfile.ZipFile(raw_zip) as zipf:
+        files.clean_zip_member(zipf, "fula.txt", tmp_path / "second.txt", cache=cache)
+
+    assert cache.hits == 1
+    assert (tmp_path / "second.txt").read_text(encoding="utf-8") == "gröt & gädda\n"
+
+
+@pytest.mark.parametrize("encoding", [None, "utf-8"], ids=["detected", "cached-utf-8"])
+def test_clean_zip_member_drops_the_utf8_byte_order_mark(
+    tmp_path: Path, encoding: str | None
+) -> None:
+    raw_zip = tmp_path / "raw.zip"
+    with zipfile.ZipFile(raw_zip, "w") as zipf:
+        zipf.writestr("fula.txt", "\ufeff%word_word%gröt &amp; gädda\n".encode())
+    with zipfile.ZipFile(raw_zip) as zipf:
+        files.clean_zip_member(zipf, "fula.txt", tmp_path / "clean.txt", encoding)
+
+    assert (tmp_path / "clean.txt").read_bytes() == "%word_word%gröt & gädda\n".encode()
+
+
+def test_clone_or_copy_gives_an_independent_file(tmp_path: Path) -> None:
+    src = tmp_path / "src.txt"
+    src.write_bytes(b"cached")
+    dst = tmp_path / "dst.txt"
+    dst.write_bytes(b"old")
+
+    files.clone_or_copy(src, dst)
+    with dst.open("r+b") as fp:
+        fp.write(b"CHANGED")
+
+    assert src.read_bytes() == b"cached"
+    assert dst.read_bytes() == b"CHANGED"
@@ -0,0 +1,178 @@
+import operator
+import os
+import shutil
+from pathlib import Path
+from typing import Any
+
+import pytest
+from typer.testing import CliRunner
+
+from resource_fula_ordboken import baseline_index, find_updates
+from resource_fula_ordboken.cli import subapp
+from resource_fula_ordboken.models import DeleteFulaOrdEntry
+from resource_fula_ordboken.shared import external_sort
+from resource_fula_ordboken.shared.memory_budget import MemoryBudget
+from resource_fula_ordboken.validation import Validation, Validator
+from tests.helpers import make_entry
+
+
+def summary(cmds: list) -> list[tuple[str, str | None]]:
+    return sorted(
+        (cmd.cmdtype, str(cmd.id) if cmd.cmdtype != "add_entry" else cmd.entry.id)
+        for cmd in cmds
+    )
+
+
+def test_find_updates_skips_unchanged_entries(export_files: tuple[Path, Path]) -> None:
+    current, baseline = export_files
+
+    cmds = find_updates.find_updates_from_export(current, baseline, msg="test")
+
+    assert summary(cmds) == [
+        ("add_entry", "d..1"),
+        ("delete_entry", "01HZ0000000000000000000003"),
+        ("update_entry", "01HZ0000000000000000000001"),
+    ]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, external_sort.DEFAULT_CHUNK_SIZE])
+def test_streaming_diff_matches_in_memory_diff(
+    export_files: tuple[Path, Path], tmp_path: Path, chunk_size: int
+) -> None:
+    current, baseline = export_files
+
+    cmds = list(
+        find_updates.iter_updates_from_export(
+            current, baseline, msg="test", chunk_size=chunk_size, tmpdir=tmp_path
+        )
+    )
+
+    assert [cmd.cmdtype for cmd in cmds] == ["update_entry", "delete_entry", "add_entry"]
+    assert summary(cmds) == summary(
+        find_updates.find_updates_from_export(current, baseline, msg="test")
+    )
+
+
+def test_sort_json_objects_is_stable_across_runs(tmp_path: Path) -> None:
+    objs: list[dict[str, Any]] = [{"k": k, "n": n} for n, k in enumerate("cabacbca")]
+
+    sorted_objs = list(
+        external_sort.sort_json_objects(
+            objs, key=operator.itemgetter("k"), chunk_size=3, tmpdir=tmp_path
+        )
+    )
+
+    assert sorted_objs == sorted(objs, key=operator.itemgetter("k"))
+
+
+def test_index_diff_matches_in_memory_diff(export_files: tuple[Path, Path]) -> None:
+    current, baseline = export_files
+    baseline_index.BaselineIndex.build(baseline).close()
+
+    with baseline_index.BaselineIndex.open(baseline) as index:
+        cmds = list(find_updates.find_updates_from_index(current, index, msg="test"))
+
+    assert summary(cmds) == summary(
+        find_updates.find_updates_from_export(current, baseline, msg="test")
+    )
+
+
+def test_index_diff_keeps_the_last_of_duplicated_ids(export_files: tuple[Path, Path]) -> None:
+    _, baseline = export_files
+    current = [
+        make_entry("a..1", "changed"),
+        make_entry("d..1", "first"),
+        make_entry("b..1", "bbb"),
+        make_entry("a..1", "aaa"),
+        make_entry("d..1", "ddd"),
+        make_entry("b..1", "changed"),
+    ]
+    baseline_index.BaselineIndex.build(baseline).close()
+
+    with baseline_index.BaselineIndex.open(baseline) as index:
+        cmds = list(find_updates.find_updates_from_index(current, index, msg="test"))
+
+    expected = find_updates.find_updates_from_export(current, baseline, msg="test")
+    changed = [cmd for cmd in cmds if not isinstance(cmd, DeleteFulaOrdEntry)]
+    assert [(cmd.cmdtype, cmd.entry.text) for cmd in changed] == [
+        ("add_entry", "ddd"),
+        ("update_entry", "changed"),
+    ]
+    assert summary(cmds) == summary(expected)
+    assert [cmd.entry for cmd in changed] == [
+        cmd.entry for cmd in expected if not isinstance(cmd, DeleteFulaOrdEntry)
+    ]
+
+
+def test_index_detects_stale_baseline(export_files: tuple[Path, Path]) -> None:
+    current, baseline = export_files
+    baseline_index.BaselineIndex.build(baseline).close()
+
+    os.utime(baseline, ns=(0, 0))
+    with baseline_index.BaselineIndex.open(baseline) as index:
+        assert not index.is_stale()
+
+    shutil.copy(current, baseline)
+    with pytest.raises(ValueError, match="stale"):
+        baseline_index.BaselineIndex.open(baseline)
+
+
+@pytest.mark.parametrize("mode", list(Validation))
+def test_validation_modes_give_the_same_diff(
+    export_files: tuple[Path, Path], mode: Validation
+) -> None:
+    current, baseline = export_files
+
+    cmds = find_updates.find_updates_from_export(
+        current, baseline, msg="test", validator=Validator(mode, every=2)
+    )
+
+    assert summary(cmds) == summary(
+        find_updates.find_updates_from_export(current, baseline, msg="test")
+    )
+
+
+@pytest.mark.parametrize(
+    ("max_bytes", "spilled"), [(1, ["diff"]), (2000, ["diff"]), (1 << 30, [])]
+)
+def test_diff_within_budget_matches_in_memory_diff(
+    export_files: tuple[Path, Path], tmp_path: Path, max_bytes: int, spilled: list[str]
+) -> None:
+    current, baseline = export_files
+
+    with MemoryBudget(max_bytes, spill_dir=tmp_path) as budget:
+        cmds = list(
+            find_updates.find_updates_within(current, baseline, msg="test", budget=budget)
+        )
+
+        assert budget.spilled == spilled
+        assert budget.used == 0
+    assert summary(cmds) == summary(
+        find_updates.find_updates_from_export(current, baseline, msg="test")
+    )
+
+
+@pytest.mark.parametrize("mode", ["--streaming", "--use-index"])
+def test_jobs_are_refused_for_the_disk_diffs(
+    export_files: tuple[Path, Path], tmp_path: Path, mode: str
+) -> None:
+    current, baseline = export_files
+
+    result = CliRunner().invoke(
+        subapp,
+        [
+            "karp-as-batch",
+            str(current),
+            "--baseline",
+            str(baseline),
+            "--output",
+            str(tmp_path / "batch.jsonl.gz"),
+            "--jobs",
+            "2",
+            mode,
+        ],
+    )
+
+    assert result.exit_code != 0
+    assert "--jobs" in result.output
+    assert not (tmp_path / "batch.jsonl.gz").exists()
@@ -0,0 +1,108 @@
+from pathlib import Path
+
+import pytest
+
+from resource_fula_ordboken import fula_ord_converter
+from resource_fula_ordboken.fula_ord_converter import (
+    FulaOrdTxt2JsonConverter,
+    ParsedRecord,
+    iter_records,
+)
+from resource_fula_ordboken.models import FulaOrdRecord
+from resource_fula_ordboken.validation import Validation, Validator
+
+SAMPLE = Path(__file__).parent / "data" / "fula_ordboken_sample.txt"
+
+
+def _convert(jobs: int) -> tuple[list[dict], dict[str, str]]:
+    converter = FulaOrdTxt2JsonConverter()
+    with SAMPLE.open(encoding="utf-8") as fp:
+        entries = list(converter.convert_entry(fp, jobs=jobs))
+    return [entry.model_dump() for entry in converter.update_jfr(entries)], dict(
+        converter.fulaord_wordforms
+    )
+
+
+def test_convert_entry() -> None:
+    entries, wordforms = _convert(jobs=1)
+
+    assert [entry["id"] for entry in entries] == [
+        "knulla..1",
+        "pippa..1",
+        "bog..1",
+        "bog..2",
+        "bog..3",
+        "satta_pa..1",
+        "fikus..1",
+        "eclair..1",
+    ]
+    assert entries[0] == {
+        "baseform": "knulla",
+        "id": "knulla..1",
+        "wordforms": ["knullar", "knullade", "knulla till"],
+        "text": "<p>Ha samlag. Även <em>knulla till</em>. Jfr <em>pippa</em>, <em>sätta på</em>.</p>",  # noqa: E501
+        "jfr": ["pippa..1", "satta_pa..1"],
+    }
+    assert entries[1]["text"].endswith(
+        "<p>Används även om f&aring;glar. Jfr <em>knullar</em>.</p>"
+    )
+    assert entries[3]["text"] == "<p>Nedsättande om man & kvinna.</p>"
+    assert entries[7]["baseform"] == "éclair"
+    assert wordforms["sätter på"] == "satta_pa..1"
+
+
+@pytest.mark.parametrize("jobs", [2, 3])
+def test_parallel_conversion_is_identical(jobs: int) -> None:
+    assert _convert(jobs=jobs) == _convert(jobs=1)
+
+
+@pytest.mark.parametrize("mode", list(Validation))
+def test_compact_records_match_models(mode: Validation) -> None:
+    expected, _ = _convert(jobs=1)
+    converter = FulaOrdTxt2JsonConverter()
+    with SAMPLE.open(encoding="utf-8") as fp:
+        records = list(
+            converter.convert_compact(iter_records(fp), validator=Validator(mode, every=3))
+        )
+
+    for record in records:
+        if record.jfr:
+            record.jfr = converter.resolve_jfr(record.jfr)
+    assert [record.to_dict() for record in records] == expected
+
+
+def test_records_are_validated_when_parsed(monkeypatch: pytest.MonkeyPatch) -> None:
+    validated = []
+
+    def validate_parsed(record: ParsedRecord) -> ParsedRecord:
+        validated.append(record.baseform)
+        return record
+
+    def fail(*_args: object) -> None:
+        raise AssertionError("converted records should not be validated again")
+
+    monkeypatch.setattr(fula_ord_converter, "validate_parsed", validate_parsed)
+    monkeypatch.setattr(FulaOrdRecord, "validate", fail)
+    converter = FulaOrdTxt2JsonConverter()
+    with SAMPLE.open(encoding="utf-8") as fp:
+        records = list(
+            converter.convert_compact(
+                iter_records(fp), validator=Validator(Validation.SAMPLED, every=3)
+            )
+        )
+
+    assert validated == [records[nr].baseform for nr in (0, 3, 6)]
+
+
+def test_sampled_validation_validates_every_nth() -> None:
+    validator = Validator(Validation.SAMPLED, every=3)
+
+    assert [validator.should_validate() for _ in range(7)] == [
+        True,
+        False,
+        False,
+        True,
+        False,
+        False,
+        True,
+    ]
@@ -0,0 +1,136 @@
+import itertools
+from pathlib import Path
+
+import json_arrays
+import pytest
+
+from resource_fula_ordboken import use_cases
+from resource_fula_ordboken.id_registry import IdAllocator, IdRegistry, fingerprint, id_key
+
+SAMPLE = Path(__file__).parent / "data" / "fula_ordboken_sample.txt"
+
+
+def _allocate(allocator: IdAllocator, entries: list[tuple[str, str]]) -> list[str]:
+    ids = list(itertools.starmap(allocator.allocate, entries))
+    allocator.finish()
+    return [allocator.final_id(entry_id) for entry_id in ids]
+
+
+def test_id_key_folds_case_marks_and_separators() -> None:
+    assert id_key("Sätta på") == "satta_pa"
+    assert id_key("éclair, glacé") == "eclair__glace"
+    assert id_key("knulla") == "knulla"
+
+
+def test_allocate_counts_per_key() -> None:
+    allocator = IdAllocator()
+
+    ids = [allocator.allocate(baseform) for baseform in ["bög", "Bög", "knulla", "bog", "bög"]]
+
+    assert ids == ["bog..1", "bog..2", "knulla..1", "bog..3", "bog..4"]
+    assert allocator.ids == set(ids)
+
+
+def test_allocate_keeps_ids_of_the_registry() -> None:
+    first = IdAllocator(keep_registry=True)
+    _allocate(first, [("bög", "a"), ("bög", "b"), ("bög", "c"), ("knulla", "k")])
+
+    # the first 'bög' is removed and a new one added in front, which would
+    # shift the ids of the others without a registry
+    second = IdAllocator(first.registry())
+    ids = _allocate(second, [("bög", "new"), ("knulla", "k"), ("bög", "c"), ("bög", "b")])
+
+    assert ids == ["bog..1", "knulla..1", "bog..3", "bog..2"]
+
+
+def test_changed_entries_take_unclaimed_ids_in_order() -> None:
+    registry = IdRegistry({"bög": [("bog..1", fingerprint("a")), ("bog..2", fingerprint("b"))]})
+    allocator = IdAllocator(registry)
+
+    ids = _allocate(allocator, [("bög", "b"), ("bög", "a2"), ("bög", "c"), ("Bög", "d")])
+
+    # "Bög" is not in the registry, so its id is given out before the pending ones
+    assert ids == ["bog..2", "bog..1", "bog..4", "bog..3"]
+
+
+def test_pending_ids_are_settled_by_finish() -> None:
+    allocator = IdAllocator(IdRegistry({"bög": [("bog..1", fingerprint("a"))]}))
+
+    pending = allocator.allocate("bög", "a")
+    allocator.finish()
+
+    assert pending != "bog..1"
+    assert allocator.final_id(pending) == "bog..1"
+    assert allocator.final_id("knulla..1") == "knulla..1"
+    with pytest.raises(ValueError, match="already settled"):
+        allocator.allocate("bög", "b")
+
+
+def test_registry_keeps_unused_ids_reserved() -> None:
+    first = IdAllocator(keep_registry=True)
+    _allocate(first, [("bög", "a"), ("bög", "b"), ("knulla", "k")])
+    second = IdAllocator(first.registry())
+    _allocate(second, [("bög", "b")])
+
+    registry = second.registry()
+    third = IdAllocator(registry)
+
+    assert [entry_id for entry_id, _ in registry.ids["bög"]] == ["bog..2", "bog..1"]
+    assert _allocate(third, [("bog", "x"), ("knulla", "k"), ("Knulla", "y")]) == [
+        "bog..3",
+        "knulla..1",
+        "knulla..2",
+    ]
+
+
+def test_registry_needs_keep_registry() -> None:
+    with pytest.raises(ValueError, match="keep_registry"):
+        IdAllocator().registry()
+
+
+def test_registry_round_trip(tmp_path: Path) -> None:
+    registry = IdRegistry({"bög": [("bog..2", fingerprint("b")), ("bog..1", fingerprint("a"))]})
+
+    registry.write(tmp_path / "ids.json")
+
+    assert IdRegistry.load(tmp_path / "ids.json").ids == registry.ids
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_load_rejects_other_files(tmp_path: Path) -> None:
+    path = tmp_path / "ids.json"
+    path.write_text('{"bög": ["bog..1"]}')
+
+    with pytest.raises(ValueError, match="not an id registry"):
+        IdRegistry.load(path)
+
+
+def test_convert_and_package_keeps_ids_across_releases(tmp_path: Path) -> None:
+    records = SAMPLE.read_text(encoding="utf-8").split("%word_word%")[1:]
+    registry_path = tmp_path / "ids.json"
+
+    def convert(name: str, records: list[str]) -> list[dict]:
+        clean_file = tmp_path / f"{name}.txt"
+        clean_file.write_text("".join(f"%word_word%{record}" for record in records))
+        json_output = tmp_path / name / "fula_ordboken.jsonl.gz"
+        use_cases.convert_and_package(
+            clean_file,
+            title="test",
+            date_issued="2024-05-22",
+            json_output=json_output,
+            saf_output=tmp_path / name / "fula_ordboken.processed.saf.zip",
+            workdir=tmp_path / "work",
+            previous_ids=IdRegistry.load(registry_path) if registry_path.exists() else None,
+            id_registry=registry_path,
+        )
+        return list(json_arrays.load_from_file(json_output))
+
+    first = convert("first", records)
+    # drop the first record and move a later one in front of the others
+    second = convert("second", [records[4], *records[1:4], *records[5:]])
+
+    first_ids = {entry["text"]: entry["id"] for entry in first}
+    assert len(second) == len(first) - 1
+    assert [entry["id"] for entry in second] == [first_ids[entry["text"]] for entry in second]
+    jfr_targets = {jfr for entry in second for jfr in entry.get("jfr") or []}
+    assert not any(target.startswith("..pending.") for target in jfr_targets)
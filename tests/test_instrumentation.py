@@ -0,0 +1,101 @@
+import json
+from collections.abc import Iterator
+from pathlib import Path
+
+import json_arrays
+import pytest
+from typer.testing import CliRunner
+
+from resource_fula_ordboken.cli import subapp
+from resource_fula_ordboken.shared import instrumentation, progress
+from resource_fula_ordboken.shared.instrumentation import Run
+
+
+def test_nested_stages_keep_their_own_peaks() -> None:
+    run = Run("test", trace_memory=True)
+    num_items = 1_000_000
+    num_entries = 3
+
+    with run.stage("outer") as outer:
+        with run.stage("inner"):
+            data = [0] * num_items
+            del data
+        outer.entries += num_entries
+    run.finish()
+
+    inner, outer = run.stages
+    assert (inner.name, outer.name) == ("outer/inner", "outer")
+    assert outer.entries == num_entries
+    assert inner.peak_traced_bytes is not None
+    assert outer.peak_traced_bytes is not None
+    # a list holds one 8-byte pointer per item
+    assert outer.peak_traced_bytes >= inner.peak_traced_bytes > 8 * num_items
+
+
+def test_stage_reports_throughput_and_cache_hit_rate() -> None:
+    run = Run("test")
+    with run.stage("clean") as stage:
+        stage.entries = 10
+        stage.add_cache("encoding", hits=3, misses=1)
+
+    (report,) = run.to_dict()["stages"]
+    assert report["entries_per_s"] > 0
+    assert report["caches"] == {"encoding": {"hits": 3, "misses": 1, "hit_rate": 0.75}}
+
+
+def test_stages_without_run_are_not_kept() -> None:
+    with instrumentation.stage("loose") as stage:
+        stage.entries += 1
+
+    assert instrumentation.current_run() is None
+
+
+@pytest.fixture(name="_restore_progress")
+def _fixture_restore_progress() -> Iterator[None]:
+    factory = progress.set_progress_factory(progress._factory)
+    yield
+    progress.set_progress_factory(factory)
+
+
+@pytest.mark.usefixtures("_restore_progress")
+def test_cli_writes_metrics_report(export_files: tuple[Path, Path], tmp_path: Path) -> None:
+    _current, baseline = export_files
+    metrics = tmp_path / "metrics.json"
+    profile = tmp_path / "run.prof"
+
+    result = CliRunner().invoke(
+        subapp,
+        [
+            "--metrics-out",
+            str(metrics),
+            "--profile",
+            str(profile),
+            "--no-progress",
+            "index-baseline",
+            str(baseline),
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    report = json.loads(metrics.read_text())
+    assert report["command"] == "index-baseline"
+    assert report["status"] == "ok"
+    (stage,) = report["stages"]
+    assert stage["name"] == "index"
+    assert stage["entries"] == len(list(json_arrays.load_from_file(baseline)))
+    assert stage["bytes_read"] == baseline.stat().st_size
+    assert profile.stat().st_size > 0
+    assert not progress.progress_enabled()
+    assert instrumentation.current_run() is None
+
+
+@pytest.mark.usefixtures("_restore_progress")
+def test_cli_reports_failed_runs(tmp_path: Path) -> None:
+    metrics = tmp_path / "metrics.json"
+
+    result = CliRunner().invoke(
+        subapp, ["--metrics-out", str(metrics), "index-baseline", str(tmp_path / "missing")]
+    )
+
+    assert result.exit_code != 0
+    assert json.loads(metrics.read_text())["status"] == "error"
@@ -0,0 +1,85 @@
+import gzip
+import io
+import zlib
+from pathlib import Path
+
+import json_arrays
+import pytest
+
+from resource_fula_ordboken.shared import jsonl_sink
+from resource_fula_ordboken.shared.jsonl_sink import JsonlSink
+
+OBJS = [
+    {"id": f"{nr:04}", "baseform": "bög", "text": "x" * (nr % 37), "nr": nr} for nr in range(500)
+]
+
+
+@pytest.mark.parametrize("block_size", [None, 1, 1000])
+@pytest.mark.parametrize("compresslevel", [1, 6, 9])
+def test_dump_to_file_matches_json_arrays(
+    tmp_path: Path, block_size: int | None, compresslevel: int
+) -> None:
+    expected_path = tmp_path / "expected.jsonl.gz"
+    json_arrays.dump_to_file(OBJS, expected_path)
+    path = tmp_path / "out.jsonl.gz"
+
+    sink = jsonl_sink.dump_to_file(
+        OBJS, path, compresslevel=compresslevel, block_size=block_size
+    )
+
+    assert gzip.decompress(path.read_bytes()) == gzip.decompress(expected_path.read_bytes())
+    assert list(json_arrays.load_from_file(path)) == OBJS
+    assert sink.num_lines == len(OBJS)
+    assert sink.bytes_out == path.stat().st_size
+
+
+def test_blocks_are_independent_gzip_members(tmp_path: Path) -> None:
+    path = tmp_path / "out.jsonl.gz"
+
+    sink = jsonl_sink.dump_to_file(OBJS, path, block_size=4096)
+
+    data = path.read_bytes()
+    assert len(sink.blocks) > 1
+    assert sum(block.num_lines for block in sink.blocks) == len(OBJS)
+    for block in sink.blocks:
+        lines = gzip.decompress(data[block.offset : block.offset + block.length]).splitlines()
+        assert len(lines) == block.num_lines
+        assert json_arrays.jsonlib.loads(lines[0]) == OBJS[block.first_line]
+
+
+def test_uncompressed_output(tmp_path: Path) -> None:
+    path = tmp_path / "out.jsonl"
+
+    jsonl_sink.dump_to_file(OBJS[:3], path)
+
+    assert (
+        path.read_bytes().splitlines()[0]
+        == b'{"id":"0000","baseform":"b\xc3\xb6g","text":"","nr":0}'
+    )
+
+
+def test_write_to_file_object() -> None:
+    fp = io.BytesIO()
+    objs = OBJS[:10]
+
+    with JsonlSink(fp, compress=True) as sink:
+        sink.write_all(objs)
+
+    assert zlib.decompress(fp.getvalue(), 31).count(b"\n") == len(objs)
+    assert not fp.closed
+
+
+def test_serialization_error_is_raised(tmp_path: Path) -> None:
+    with pytest.raises(TypeError), JsonlSink(tmp_path / "out.jsonl.gz") as sink:
+        sink.write({"id": object()})
+
+
+def test_writer_error_is_raised() -> None:
+    class BrokenFile(io.BytesIO):
+        @staticmethod
+        def write(_data: bytes) -> int:  # type: ignore[override]
+            raise OSError("disk full")
+
+    sink = JsonlSink(BrokenFile(), compress=True, buffer_size=16)
+    with pytest.raises(OSError, match="disk full"), sink:
+        sink.write_all(OBJS)
@@ -0,0 +1,108 @@
+import os
+import shutil
+from pathlib import Path
+
+import json_arrays
+import pytest
+
+from resource_fula_ordboken import use_cases
+from resource_fula_ordboken.fula_ord_converter import FulaOrdTxt2JsonConverter
+from resource_fula_ordboken.lookup_index import LookupIndex, default_index_path, write_indexed
+
+SAMPLE = Path(__file__).parent / "data" / "fula_ordboken_sample.txt"
+
+
+@pytest.fixture(name="entries")
+def fixture_entries() -> list[dict]:
+    converter = FulaOrdTxt2JsonConverter()
+    with SAMPLE.open(encoding="utf-8") as fp:
+        return [
+            entry.model_dump()
+            for entry in converter.update_jfr(list(converter.convert_entry(fp)))
+        ]
+
+
+@pytest.fixture(name="jsonl")
+def fixture_jsonl(tmp_path: Path, entries: list[dict]) -> Path:
+    jsonl = tmp_path / "fula_ordboken.jsonl.gz"
+    # small blocks, so that the entries are spread over many gzip members
+    sink = write_indexed(entries, jsonl, block_size=128)
+    assert len(sink.blocks) > 1
+    return jsonl
+
+
+def test_get_reads_every_entry(jsonl: Path, entries: list[dict]) -> None:
+    with LookupIndex.open(jsonl) as index:
+        assert len(index) == len(entries)
+        assert list(index.iter_ids()) == [entry["id"] for entry in entries]
+        for entry in reversed(entries):
+            assert entry["id"] in index
+            assert index.get(entry["id"]) == entry
+        assert index.get("no such id") is None
+    assert list(json_arrays.load_from_file(jsonl)) == entries
+
+
+def test_forms_ignore_case(jsonl: Path, entries: list[dict]) -> None:
+    entry = next(entry for entry in entries if entry["wordforms"])
+    form = entry["wordforms"][0]
+
+    with LookupIndex.open(jsonl) as index:
+        assert entry["id"] in index.ids_for(form.upper())
+        assert entry in index.entries_for(form)
+        assert index.entries_for("no such form") == []
+
+
+def test_search_lists_forms_by_prefix(jsonl: Path, entries: list[dict]) -> None:
+    prefix = entries[0]["baseform"][:2]
+    expected = sorted(
+        {
+            (form, entry["id"])
+            for entry in entries
+            for form in [entry["baseform"], *entry["wordforms"]]
+            if form.casefold().startswith(prefix.casefold())
+        },
+        key=lambda item: (item[0].casefold(), *item),
+    )
+
+    with LookupIndex.open(jsonl) as index:
+        assert index.search(prefix.upper(), limit=1000) == expected
+        assert index.search(prefix, limit=1) == expected[:1]
+
+
+def test_open_rejects_missing_and_stale_index(jsonl: Path, tmp_path: Path) -> None:
+    other = tmp_path / "other.jsonl.gz"
+    shutil.copy(jsonl, other)
+    with pytest.raises(ValueError, match="no lookup index"):
+        LookupIndex.open(other)
+
+    # the same size but other content
+    data = bytearray(jsonl.read_bytes())
+    data[-9] ^= 1
+    jsonl.write_bytes(bytes(data))
+    os.utime(jsonl, ns=(0, 0))
+    with pytest.raises(ValueError, match="doesn't match"):
+        LookupIndex.open(jsonl)
+
+
+def test_write_indexed_needs_gzip(tmp_path: Path, entries: list[dict]) -> None:
+    with pytest.raises(ValueError, match="gzipped"):
+        write_indexed(entries, tmp_path / "fula_ordboken.jsonl")
+
+
+def test_convert_and_package_writes_lookup_index(tmp_path: Path, entries: list[dict]) -> None:
+    json_output = tmp_path / "out" / "fula_ordboken.jsonl.gz"
+
+    use_cases.convert_and_package(
+        SAMPLE,
+        title="test",
+        date_issued="2024-05-22",
+        json_output=json_output,
+        saf_output=tmp_path / "out" / "fula_ordboken.processed.saf.zip",
+        workdir=tmp_path / "work",
+        lookup_index=True,
+    )
+
+    assert default_index_path(json_output).exists()
+    assert list(json_arrays.load_from_file(json_output)) == entries
+    with LookupIndex.open(json_output) as index:
+        assert [index.get(entry["id"]) for entry in entries] == entries
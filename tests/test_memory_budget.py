@@ -0,0 +1,98 @@
+from pathlib import Path
+
+import json_arrays
+import pytest
+
+from resource_fula_ordboken import use_cases
+from resource_fula_ordboken.shared.memory_budget import (
+    MemoryBudget,
+    SpillDict,
+    SpillSet,
+    item_bytes,
+    parse_size,
+)
+
+SAMPLE = Path(__file__).parent / "data" / "fula_ordboken_sample.txt"
+
+
+@pytest.mark.parametrize(
+    ("size", "expected"),
+    [
+        ("512M", 512 << 20),
+        ("2g", 2 << 30),
+        ("1.5GiB", 3 << 29),
+        ("100", 100),
+        ("64 kB", 64 << 10),
+    ],
+)
+def test_parse_size(size: str, expected: int) -> None:
+    assert parse_size(size) == expected
+
+
+@pytest.mark.parametrize("size", ["", "M", "-1M", "12X", "1.2.3G"])
+def test_parse_size_rejects_other_strings(size: str) -> None:
+    with pytest.raises(ValueError, match="is not a size"):
+        parse_size(size)
+
+
+def test_spill_dict_moves_to_disk_and_keeps_working(tmp_path: Path) -> None:
+    with MemoryBudget(3 * item_bytes("key0", "value0"), spill_dir=tmp_path) as budget:
+        wordforms: SpillDict[str] = SpillDict(budget, "wordforms")
+        for nr in range(3):
+            wordforms[f"key{nr}"] = f"value{nr}"
+        assert wordforms.table is None
+
+        wordforms["key3"] = "value3"
+        wordforms["key0"] = "changed"
+        del wordforms["key1"]
+
+        assert wordforms.table is not None
+        assert budget.spilled == ["wordforms"]
+        assert budget.used == 0
+        assert dict(wordforms) == {"key0": "changed", "key2": "value2", "key3": "value3"}
+        assert "key1" not in wordforms
+        assert wordforms.get("key1") is None
+        with pytest.raises(KeyError):
+            del wordforms["key1"]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_budget_spills_the_largest_structure_first() -> None:
+    with MemoryBudget(10 * item_bytes("id..1")) as budget:
+        ids = SpillSet(budget, "ids")
+        counters: SpillDict[int] = SpillDict(budget, "counters")
+        counters["a"] = 1
+        for nr in range(10):
+            ids.add(f"id..{nr}")
+        ids.add("id..0")
+
+        assert budget.spilled == ["ids"]
+        assert counters.table is None
+        expected = {f"id..{nr}" for nr in range(10)}
+        assert ids == expected
+        assert len(ids) == len(expected)
+        ids.discard("id..0")
+        assert "id..0" not in ids
+
+
+def test_budget_must_be_positive() -> None:
+    with pytest.raises(ValueError, match="must be positive"):
+        MemoryBudget(0)
+
+
+def test_conversion_within_a_small_budget_gives_the_same_output(tmp_path: Path) -> None:
+    def convert(name: str, max_memory: int | None) -> list[dict]:
+        json_output = tmp_path / name / "fula_ordboken.jsonl.gz"
+        use_cases.convert_and_package(
+            SAMPLE,
+            title="test",
+            date_issued="2024-05-22",
+            json_output=json_output,
+            saf_output=tmp_path / name / "fula_ordboken.processed.saf.zip",
+            workdir=tmp_path / "work",
+            max_memory=max_memory,
+        )
+        return list(json_arrays.load_from_file(json_output))
+
+    assert convert("spilled", 1) == convert("in_memory", None)
+    assert not list((tmp_path / "work").glob("*/spill-*"))
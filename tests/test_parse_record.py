@@ -0,0 +1,113 @@
+"""Compare parse_record with the split and regex cascade it replaced."""
+
+import io
+import random
+from pathlib import Path
+
+import pytest
+
+from benchmarks import corpus
+from resource_fula_ordboken import text
+from resource_fula_ordboken.fula_ord_converter import (
+    ALSO_PROG,
+    EM_PROG,
+    JFR_PROG,
+    ParsedRecord,
+    iter_records,
+    parse_record,
+)
+
+SAMPLE = Path(__file__).parent / "data" / "fula_ordboken_sample.txt"
+
+# pieces that hit the edge cases of the markup: repeated markers, entities that
+# only appear after unescaping, markers without an end and line breaks inside them
+_PIECES = [
+    "%word_word%",
+    "%word_text%",
+    "&amp;",
+    "&amp;amp;",
+    "&aring;",
+    "&percnt;word_text&percnt;",
+    "&",
+    "Även <em>",
+    "även <em>",
+    "ven <em>",
+    "<em>",
+    "</em>",
+    "<em>pippa</em>",
+    "<em>knulla till.</em>",
+    "Jfr",
+    " Jfr ",
+    "<p>",
+    "</p>",
+    "\n",
+    ", ",
+    ",",
+    ".",
+    " ",
+    "knulla",
+    "sätta på",
+    "bög-2",
+]
+
+
+def reference_parse_record(word_word: str, word_text: str) -> ParsedRecord:
+    _word_word = text.unescape_str(word_word.split("%word_word%")[-1])
+    if "%word_text%" in _word_word:
+        _tmp_words = _word_word.split("%word_text%")
+        words = text.unescape_str(_tmp_words[0])
+        _word_text = text.unescape_str(_tmp_words[-1])
+        if word_text:
+            _word_text += word_text
+    else:
+        words = _word_word
+        _word_text = text.unescape_str(word_text.split("%word_text%")[-1].strip())
+    _wordforms = words.split(", ")
+    baseform = _wordforms[0].strip()
+    wordforms = [s.strip() for s in _wordforms[1:]]
+    alternates = []
+    if also_match := ALSO_PROG.findall(_word_text):
+        for m in also_match:
+            alternates.extend(m.split(", "))
+    jfr = None
+    if jfr_match := JFR_PROG.search(_word_text):
+        jfr = EM_PROG.findall(jfr_match.group(0))
+    return ParsedRecord(
+        baseform=baseform,
+        wordforms=wordforms,
+        alternates=alternates,
+        text=_word_text.strip(),
+        jfr=jfr,
+    )
+
+
+def _random_record(rng: random.Random) -> tuple[str, str]:
+    header = "".join(rng.choices(_PIECES, k=rng.randint(0, 12))) + "\n"
+    rest = "".join(rng.choices(_PIECES, k=rng.randint(0, 30)))
+    return f"%word_word%{header}", rest
+
+
+def _assert_same(records: list[tuple[str, str]]) -> None:
+    for word_word, word_text in records:
+        assert parse_record(word_word, word_text) == reference_parse_record(
+            word_word, word_text
+        ), (word_word, word_text)
+
+
+def test_parse_record_matches_reference_on_sample() -> None:
+    with SAMPLE.open(encoding="utf-8") as fp:
+        _assert_same(list(iter_records(fp)))
+
+
+@pytest.mark.parametrize("escape", [False, True])
+def test_parse_record_matches_reference_on_corpus(escape: bool) -> None:
+    records = "".join(corpus.generate_records(2000, seed=7, escape=escape))
+
+    _assert_same(list(iter_records(io.StringIO(records))))
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_parse_record_matches_reference_on_random_records(seed: int) -> None:
+    rng = random.Random(seed)
+
+    _assert_same([_random_record(rng) for _ in range(2000)])
@@ -0,0 +1,92 @@
+import gzip
+import zipfile
+from pathlib import Path
+
+import json_arrays
+import orjson
+import pytest
+
+from resource_fula_ordboken import record_manifest, use_cases
+from resource_fula_ordboken.record_manifest import RecordManifest
+
+SAMPLE = Path("tests/data/fula_ordboken_sample.txt")
+
+
+def _convert(
+    clean_file: Path,
+    out: Path,
+    *,
+    previous: RecordManifest | None = None,
+    jobs: int = 1,
+    write_manifest: bool = True,
+) -> Path:
+    json_output = out / "fula_ordboken.jsonl.gz"
+    use_cases.convert_and_package(
+        clean_file,
+        title="test",
+        date_issued="2024-05-22",
+        json_output=json_output,
+        saf_output=out / "fula_ordboken.processed.saf.zip",
+        workdir=out / "work",
+        jobs=jobs,
+        previous_records=previous,
+        record_manifest=record_manifest.manifest_path(json_output) if write_manifest else None,
+    )
+    return json_output
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_incremental_conversion_matches_a_full_rebuild(tmp_path: Path, jobs: int) -> None:
+    records = [
+        f"%word_word%{record}"
+        for record in SAMPLE.read_text(encoding="utf-8").split("%word_word%")[1:]
+    ]
+    old_export = tmp_path / "fula_ordboken_2024-05-22.txt"
+    old_export.write_text("".join(records), encoding="utf-8")
+    old_output = _convert(old_export, tmp_path / "old")
+
+    # drop two records, change one and add one in front that takes the id of a later one
+    changed = [records[1], *records[3:]]
+    changed[1] = changed[1].replace("</p>", " Ändrad.</p>", 1)
+    changed.insert(0, records[5].replace("</p>", " Ny.</p>", 1))
+    new_export = tmp_path / "fula_ordboken_2024-06-01.txt"
+    new_export.write_text("".join(changed), encoding="utf-8")
+    previous = RecordManifest.load(record_manifest.manifest_path(old_output))
+
+    incremental = _convert(new_export, tmp_path / "new", previous=previous, jobs=jobs)
+    full = _convert(new_export, tmp_path / "full", write_manifest=False)
+
+    assert list(json_arrays.load_from_file(incremental)) == list(
+        json_arrays.load_from_file(full)
+    )
+    assert (previous.reused, previous.parsed) == (len(changed) - 2, 2)
+    again = RecordManifest.load(record_manifest.manifest_path(incremental))
+    assert len(again.previous) == len(set(changed))
+
+
+def test_zip_without_text_members_is_converted_to_no_entries(tmp_path: Path) -> None:
+    export = tmp_path / "fula_ordboken_2024-06-01.zip"
+    with zipfile.ZipFile(export, "w") as zipf:
+        zipf.writestr("README", "not an export")
+
+    output = _convert(export, tmp_path / "out", previous=RecordManifest())
+
+    assert list(json_arrays.load_from_file(output)) == []
+
+
+def test_manifest_of_another_version_is_not_used(tmp_path: Path) -> None:
+    path = tmp_path / "fula_ordboken.records.jsonl.gz"
+    with gzip.open(path, "wb") as fp:
+        fp.write(orjson.dumps({"format": record_manifest.MANIFEST_FORMAT, "version": "0.0.0"}))
+        fp.write(b'\n["0", "a", [], [], "<p>a</p>", null]\n')
+
+    assert RecordManifest.load(path).previous == {}
+
+
+def test_load_rejects_other_files(tmp_path: Path) -> None:
+    path = tmp_path / "fula_ordboken.jsonl.gz"
+    with gzip.open(path, "wb") as fp:
+        fp.write(b'{"id": "a..1"}\n')
+
+    with pytest.raises(ValueError, match="not a record manifest"):
+        RecordManifest.load(path)
@@ -0,0 +1,68 @@
+import io
+from pathlib import Path
+
+import pytest
+
+from resource_fula_ordboken import record_scanner
+from resource_fula_ordboken.fula_ord_converter import iter_records
+
+SAMPLE = Path(__file__).parent / "data" / "fula_ordboken_sample.txt"
+
+CASES = {
+    "sample": SAMPLE.read_bytes(),
+    "crlf": SAMPLE.read_bytes().replace(b"\n", b"\r\n"),
+    "cr": SAMPLE.read_bytes().replace(b"\n", b"\r"),
+    "mixed-newlines": b"%word_word%a%word_text%b\r\nx\ry\n\r\r\n%word_word%c\r",
+    "no-trailing-newline": SAMPLE.read_bytes().rstrip(b"\n"),
+    "leading-blank-line": b"\n" + SAMPLE.read_bytes(),
+    "no-marker-first": b"header\ntext\n%word_word%a%word_text%b\n",
+    "marker-inside-line": b"%word_word%a%word_text%x %word_word% y\nmore\n",
+    "empty": b"",
+}
+
+
+def _line_records(path: Path) -> list[tuple[str, str]]:
+    with path.open(encoding="utf-8") as fp:
+        return list(iter_records(fp))
+
+
+@pytest.mark.parametrize("content", CASES.values(), ids=CASES.keys())
+def test_file_records_match_line_records(tmp_path: Path, content: bytes) -> None:
+    path = tmp_path / "clean.txt"
+    path.write_bytes(content)
+
+    assert list(record_scanner.iter_file_records(path)) == _line_records(path)
+
+
+@pytest.mark.parametrize("buffer_size", [1, 7, 64, record_scanner.DEFAULT_BUFFER_SIZE])
+@pytest.mark.parametrize("content", CASES.values(), ids=CASES.keys())
+def test_stream_records_match_line_records(
+    tmp_path: Path, content: bytes, buffer_size: int
+) -> None:
+    path = tmp_path / "clean.txt"
+    path.write_bytes(content)
+
+    records = record_scanner.iter_stream_records(io.BytesIO(content), buffer_size=buffer_size)
+
+    assert list(records) == _line_records(path)
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 64])
+@pytest.mark.parametrize("content", CASES.values(), ids=CASES.keys())
+def test_buffer_records_blocks(tmp_path: Path, content: bytes, block_size: int) -> None:
+    path = tmp_path / "clean.txt"
+    path.write_bytes(content)
+
+    records = record_scanner.iter_buffer_records(content, block_size=block_size)
+
+    assert list(records) == _line_records(path)
+
+
+def test_stream_records_with_carriage_returns_are_not_buffered() -> None:
+    content = CASES["crlf"]
+    fp = io.BytesIO(content)
+
+    records = record_scanner.iter_stream_records(fp, buffer_size=64)
+    next(records)
+
+    assert fp.tell() < len(content)
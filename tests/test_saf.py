@@ -0,0 +1,58 @@
+import csv
+import gzip
+import zipfile
+from pathlib import Path
+
+import pytest
+from simple_archive.use_cases import CreateSimpleArchiveFromCSVWriteToPath
+
+from resource_fula_ordboken.shared import saf
+
+
+def _members(path: Path) -> dict[str, bytes]:
+    with zipfile.ZipFile(path) as zipf:
+        return {info.filename: zipf.read(info) for info in zipf.infolist()}
+
+
+def test_same_archive_as_simple_archive(tmp_path: Path) -> None:
+    text_file = tmp_path / "fula_ordboken.txt"
+    text_file.write_text("%word_word%kuk%word_text%<p>Penis.</p>\n", encoding="utf-8")
+    gz_file = tmp_path / "fula_ordboken.jsonl.gz"
+    gz_file.write_bytes(gzip.compress(b'{"baseform": "kuk"}\n'))
+    csv_path = tmp_path / "metadata.csv"
+    with csv_path.open("w", encoding="utf-8") as fp:
+        csv_writer = csv.DictWriter(fp, fieldnames=("files", "dc.title", "dc.date.issued"))
+        csv_writer.writeheader()
+        csv_writer.writerow(
+            {
+                "files": f"{text_file.name}||{gz_file.name}",
+                "dc.title": "Fula ordboken (städad)",
+                "dc.date.issued": "2024-05-22",
+            }
+        )
+    expected = tmp_path / "expected.saf.zip"
+    CreateSimpleArchiveFromCSVWriteToPath().execute(
+        csv_path, output_path=expected, create_zip=True
+    )
+
+    actual = tmp_path / "out" / "actual.saf.zip"
+    with saf.SimpleArchiveZip(
+        actual, title="Fula ordboken (städad)", date_issued="2024-05-22"
+    ) as archive:
+        with archive.open(text_file.name) as fp:
+            fp.write(text_file.read_bytes())
+        archive.add_file(gz_file)
+
+    assert _members(actual) == _members(expected)
+    with zipfile.ZipFile(actual) as zipf:
+        assert zipf.getinfo(f"item_000/{gz_file.name}").compress_type == zipfile.ZIP_STORED
+        assert zipf.getinfo(f"item_000/{text_file.name}").compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_failed_archive_is_removed(tmp_path: Path) -> None:
+    output = tmp_path / "broken.saf.zip"
+    archive = saf.SimpleArchiveZip(output, title="broken", date_issued="2024-05-22")
+    with pytest.raises(FileNotFoundError), archive:
+        archive.add_file(tmp_path / "missing.txt")
+
+    assert not output.exists()
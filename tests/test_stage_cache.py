@@ -0,0 +1,145 @@
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+from typer.testing import CliRunner
+
+from resource_fula_ordboken import use_cases
+from resource_fula_ordboken.cli import subapp
+from resource_fula_ordboken.shared.stage_cache import StageCache
+
+SAMPLE = Path(__file__).parent / "data" / "fula_ordboken_sample.txt"
+
+
+def _convert(clean_file: Path, out: Path, stage_cache: StageCache | None) -> tuple[Path, Path]:
+    json_output = out / "fula_ordboken.jsonl.gz"
+    saf_output = out / "fula_ordboken.processed.saf.zip"
+    use_cases.convert_and_package(
+        clean_file,
+        title="test",
+        date_issued="2024-05-22",
+        json_output=json_output,
+        saf_output=saf_output,
+        workdir=out / "work",
+        stage_cache=stage_cache,
+    )
+    return json_output, saf_output
+
+
+def test_unchanged_input_is_restored_from_cache(tmp_path: Path) -> None:
+    clean_file = tmp_path / "fula_ordboken_2024-05-22.txt"
+    shutil.copy(SAMPLE, clean_file)
+    stage_cache = StageCache(tmp_path / "cache")
+
+    first = _convert(clean_file, tmp_path / "first", stage_cache)
+    second = _convert(clean_file, tmp_path / "second", stage_cache)
+
+    assert (stage_cache.hits, stage_cache.misses) == (1, 1)
+    assert not (tmp_path / "second" / "work").exists()
+    for first_path, second_path in zip(first, second, strict=True):
+        assert first_path.read_bytes() == second_path.read_bytes()
+
+
+def test_changed_input_is_converted_again(tmp_path: Path) -> None:
+    clean_file = tmp_path / "fula_ordboken_2024-05-22.txt"
+    shutil.copy(SAMPLE, clean_file)
+    stage_cache = StageCache(tmp_path / "cache")
+    json_output, _ = _convert(clean_file, tmp_path / "out", stage_cache)
+    cached = json_output.read_bytes()
+
+    lines = SAMPLE.read_text(encoding="utf-8").splitlines(keepends=True)
+    clean_file.write_text("".join(lines[: len(lines) // 2]), encoding="utf-8")
+    _convert(clean_file, tmp_path / "out", stage_cache)
+
+    assert (stage_cache.hits, stage_cache.misses) == (0, 2)
+    assert json_output.read_bytes() != cached
+    # the output was replaced, so the cached copy of the first run is intact
+    shutil.copy(SAMPLE, clean_file)
+    _convert(clean_file, tmp_path / "again", stage_cache)
+    assert stage_cache.hits == 1
+    assert (tmp_path / "again" / "fula_ordboken.jsonl.gz").read_bytes() == cached
+
+
+def test_outputs_written_without_the_cache_leave_it_intact(tmp_path: Path) -> None:
+    clean_file = tmp_path / "fula_ordboken_2024-05-22.txt"
+    shutil.copy(SAMPLE, clean_file)
+    stage_cache = StageCache(tmp_path / "cache")
+    json_output, saf_output = _convert(clean_file, tmp_path / "out", stage_cache)
+    cached = json_output.read_bytes(), saf_output.read_bytes()
+
+    # a run without the cache writes over the outputs in place
+    lines = SAMPLE.read_text(encoding="utf-8").splitlines(keepends=True)
+    clean_file.write_text("".join(lines[: len(lines) // 2]), encoding="utf-8")
+    _convert(clean_file, tmp_path / "out", None)
+    assert json_output.read_bytes() != cached[0]
+
+    shutil.copy(SAMPLE, clean_file)
+    _convert(clean_file, tmp_path / "out", stage_cache)
+
+    assert stage_cache.hits == 1
+    assert (json_output.read_bytes(), saf_output.read_bytes()) == cached
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path: Path) -> None:
+    stage_cache = StageCache(tmp_path / "cache", max_bytes=25)
+    keys = []
+    for nr in range(3):
+        output = tmp_path / f"{nr}.txt"
+        output.write_text("x" * 10)
+        keys.append(stage_cache.key("test", [], nr=nr))
+        stage_cache.put(keys[-1], {"out": output})
+        os.utime(stage_cache.root / keys[-1][:2] / keys[-1] / "meta.json", (nr, nr))
+        if nr == 1:
+            assert stage_cache.restore(keys[0], {"out": tmp_path / "restored.txt"})
+            os.utime(stage_cache.root / keys[0][:2] / keys[0] / "meta.json", (10, 10))
+
+    assert stage_cache.restore(keys[0], {"out": tmp_path / "restored.txt"})
+    assert not stage_cache.restore(keys[1], {"out": tmp_path / "restored.txt"})
+    assert stage_cache.restore(keys[2], {"out": tmp_path / "restored.txt"})
+
+
+def test_entries_stored_or_evicted_by_another_process_are_tolerated(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    stage_cache = StageCache(tmp_path / "cache")
+    other = StageCache(tmp_path / "cache")
+    output = tmp_path / "out.txt"
+    output.write_text("x" * 10)
+    key = stage_cache.key("test", [])
+    rename = Path.rename
+
+    def rename_after_other(self: Path, target: Path) -> Path:
+        monkeypatch.setattr(Path, "rename", rename)
+        monkeypatch.setattr(os, "getpid", lambda: 0)
+        other.put(key, {"out": output})
+        return rename(self, target)
+
+    monkeypatch.setattr(Path, "rename", rename_after_other)
+    stage_cache.put(key, {"out": output})
+    assert stage_cache.restore(key, {"out": tmp_path / "restored.txt"})
+    assert [path.name for path in stage_cache.root.glob("*/*")] == [key]
+
+    entries = stage_cache._entries()
+    other.evict(0)
+    monkeypatch.setattr(stage_cache, "_entries", lambda: entries)
+    assert stage_cache.evict(0) == [stage_cache.root / key[:2] / key]
+    assert not stage_cache.restore(key, {"out": tmp_path / "restored.txt"})
+
+
+def test_cleanup_removes_stale_workdirs(tmp_path: Path) -> None:
+    workdir = tmp_path / "tmp"
+    stale = workdir / "fula_ordboken.001"
+    fresh = workdir / "fula_ordboken.002"
+    stale.mkdir(parents=True)
+    fresh.mkdir()
+    os.utime(stale, (0, 0))
+
+    result = CliRunner().invoke(
+        subapp,
+        ["cleanup", "--workdir", str(workdir), "--cache-dir", str(tmp_path / "cache")],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert not stale.exists()
+    assert fresh.exists()
@@ -1,7 +1,21 @@
+import functools
+import shutil
 import tempfile
+import zipfile
 from pathlib import Path
+from typing import Any
 
-from resource_fula_ordboken import use_cases
+import json_arrays
+import pytest
+
+from resource_fula_ordboken import fula_ord_converter, use_cases
+from resource_fula_ordboken.fula_ord_converter import FulaOrdTxt2JsonConverter, ParsedRecord
+from resource_fula_ordboken.shared import files
+from resource_fula_ordboken.shared.memory_budget import MemoryBudget
+from resource_fula_ordboken.validation import Validation, Validator
+from tests.helpers import make_entry, make_exported
+
+SAMPLE = Path(__file__).parent / "data" / "fula_ordboken_sample.txt"
 
 
 def test_package_as_simple_archive() -> None:
@@ -25,3 +39,397 @@ def test_package_as_simple_archive() -> None:
     )
 
     assert output_path.exists()
+
+
+@pytest.mark.parametrize("suffix", [".txt", ".zip"])
+def test_convert_and_package(tmp_path: Path, suffix: str) -> None:
+    clean_file = tmp_path / f"fula_ordboken_2024-05-22{suffix}"
+    if suffix == ".zip":
+        with zipfile.ZipFile(clean_file, "w") as zipf:
+            zipf.write(SAMPLE, SAMPLE.name)
+    else:
+        shutil.copy(SAMPLE, clean_file)
+    json_output = tmp_path / "out" / "fula_ordboken.jsonl.gz"
+    saf_output = tmp_path / "out" / "fula_ordboken.processed.saf.zip"
+
+    use_cases.convert_and_package(
+        clean_file,
+        title="test",
+        date_issued="2024-05-22",
+        json_output=json_output,
+        saf_output=saf_output,
+        workdir=tmp_path / "work",
+    )
+
+    converter = FulaOrdTxt2JsonConverter()
+    with SAMPLE.open(encoding="utf-8") as fp:
+        expected = [
+            entry.model_dump()
+            for entry in converter.update_jfr(list(converter.convert_entry(fp)))
+        ]
+    assert list(json_arrays.load_from_file(json_output)) == expected
+    assert saf_output.exists()
+    assert not list((tmp_path / "work").glob("*/*.spill.jsonl"))
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_convert_and_package_converts_every_member(tmp_path: Path, jobs: int) -> None:
+    records = SAMPLE.read_text(encoding="utf-8").split("%word_word%")[1:]
+    parts = [records[nr::3] for nr in range(3)]
+    clean_file = tmp_path / "fula_ordboken_2024-05-22.zip"
+    with zipfile.ZipFile(clean_file, "w") as zipf:
+        for nr, part in enumerate(parts):
+            zipf.writestr(f"Del {nr}.txt", "".join(f"%word_word%{record}" for record in part))
+    json_output = tmp_path / "out" / "fula_ordboken.jsonl.gz"
+
+    use_cases.convert_and_package(
+        clean_file,
+        title="test",
+        date_issued="2024-05-22",
+        json_output=json_output,
+        saf_output=tmp_path / "out" / "fula_ordboken.processed.saf.zip",
+        workdir=tmp_path / "work",
+        jobs=jobs,
+    )
+    shard_output = tmp_path / "shards" / "fula_ordboken.jsonl.gz"
+    use_cases.convert_and_package(
+        clean_file,
+        title="test",
+        date_issued="2024-05-22",
+        json_output=shard_output,
+        saf_output=tmp_path / "shards" / "fula_ordboken.processed.saf.zip",
+        workdir=tmp_path / "work",
+        jobs=jobs,
+        shard_by_member=True,
+    )
+
+    converter = FulaOrdTxt2JsonConverter()
+    entries = []
+    for part in parts:
+        lines = "".join(f"%word_word%{record}" for record in part).splitlines(keepends=True)
+        entries.append(list(converter.convert_entry(lines)))
+    expected = [
+        [entry.model_dump() for entry in converter.update_jfr(part_entries)]
+        for part_entries in entries
+    ]
+    assert list(json_arrays.load_from_file(json_output)) == [
+        entry for member_entries in expected for entry in member_entries
+    ]
+    for nr, member_entries in enumerate(expected):
+        shard = tmp_path / "shards" / f"fula_ordboken.del_{nr}.jsonl.gz"
+        assert list(json_arrays.load_from_file(shard)) == member_entries
+    assert len(list((tmp_path / "work").glob("*/*"))) == 0
+
+
+@pytest.mark.parametrize("encoding", ["latin-1", "utf-8", "utf-8-sig"])
+def test_clean_data_and_package_matches_extract_and_rewrite(
+    tmp_path: Path, encoding: str
+) -> None:
+    raw_text = SAMPLE.read_text(encoding="utf-8").replace("&eacute;", "&amp;eacute;") * 20
+    raw_zip = tmp_path / "Fula ordboken 2024-05-22.zip"
+    with zipfile.ZipFile(raw_zip, "w") as zipf:
+        zipf.writestr("fula_ordboken.txt", raw_text.encode(encoding))
+    output_path = tmp_path / "clean.saf.zip"
+
+    use_cases.clean_data_and_package(
+        raw_zip,
+        title="test",
+        date_issued="2024-05-22",
+        output_path=output_path,
+        workdir=tmp_path / "work",
+    )
+
+    extracted = tmp_path / "extracted" / "fula_ordboken.txt"
+    with zipfile.ZipFile(raw_zip) as zipf:
+        zipf.extractall(extracted.parent)
+    files.change_encoding_to_utf8(extracted)
+    files.unescape_file(extracted)
+    with zipfile.ZipFile(output_path) as zipf:
+        cleaned = zipf.read("item_000/fula_ordboken.txt")
+    assert cleaned == extracted.read_bytes()
+    assert cleaned.startswith(b"%word_word%")
+
+
+def test_raw_to_batch_validates_each_member_and_the_diff_from_the_start(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    raw_zip = tmp_path / "Fula ordboken 2024-05-22.zip"
+    with zipfile.ZipFile(raw_zip, "w") as zipf:
+        zipf.write(SAMPLE, "del_1.txt")
+        zipf.write(SAMPLE, "del_2.txt")
+    baseline = tmp_path / "baseline.jsonl.gz"
+    json_arrays.dump_to_file([], baseline)
+    validated = []
+
+    def validate_parsed(record: ParsedRecord) -> ParsedRecord:
+        validated.append(record.baseform)
+        return record
+
+    diff_counts = []
+    find_updates = use_cases._find_updates
+
+    def count_diff(*args: Any, validator: Validator, **kwargs: Any) -> Any:
+        diff_counts.append(validator.count)
+        return find_updates(*args, validator=validator, **kwargs)
+
+    monkeypatch.setattr(fula_ord_converter, "validate_parsed", validate_parsed)
+    monkeypatch.setattr(use_cases, "_find_updates", count_diff)
+    out = tmp_path / "out"
+
+    use_cases.raw_to_batch(
+        raw_zip,
+        baseline=baseline,
+        msg="test",
+        title="test",
+        date_issued="2024-05-22",
+        clean_saf_output=out / "clean.saf.zip",
+        json_output=out / "fula_ordboken.jsonl.gz",
+        processed_saf_output=out / "processed.saf.zip",
+        batch_output=out / "batch.jsonl.gz",
+        workdir=tmp_path / "work",
+        validator=Validator(Validation.SAMPLED, every=3),
+    )
+
+    num_picked = 3  # records 0, 3 and 6 of the 8 in each member
+    assert len(validated) == 2 * num_picked
+    assert validated[:num_picked] == validated[num_picked:]
+    assert diff_counts == [0]
+
+
+@pytest.mark.parametrize("use_case", ["convert_and_package", "raw_to_batch"])
+def test_working_dir_and_budget_are_released_when_a_stage_fails(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, use_case: str
+) -> None:
+    raw_zip = tmp_path / "fula_ordboken_2024-05-22.zip"
+    with zipfile.ZipFile(raw_zip, "w") as zipf:
+        zipf.write(SAMPLE, SAMPLE.name)
+    baseline = tmp_path / "baseline.jsonl.gz"
+    json_arrays.dump_to_file([], baseline)
+
+    def fail(*_args: object) -> None:
+        raise OSError("disk full")
+
+    monkeypatch.setattr(FulaOrdTxt2JsonConverter, "iter_spilled", fail)
+    closed = []
+    close = MemoryBudget.close
+
+    def record_close(budget: MemoryBudget) -> None:
+        closed.append(budget)
+        close(budget)
+
+    monkeypatch.setattr(MemoryBudget, "close", record_close)
+    out = tmp_path / "out"
+    if use_case == "convert_and_package":
+        run = functools.partial(
+            use_cases.convert_and_package,
+            json_output=out / "fula_ordboken.jsonl.gz",
+            saf_output=out / "processed.saf.zip",
+        )
+    else:
+        run = functools.partial(
+            use_cases.raw_to_batch,
+            baseline=baseline,
+            msg="test",
+            clean_saf_output=out / "clean.saf.zip",
+            json_output=out / "fula_ordboken.jsonl.gz",
+            processed_saf_output=out / "processed.saf.zip",
+            batch_output=out / "batch.jsonl.gz",
+        )
+
+    with pytest.raises(OSError, match="disk full"):
+        run(
+            raw_zip,
+            title="test",
+            date_issued="2024-05-22",
+            workdir=tmp_path / "work",
+            max_memory=1,
+        )
+
+    assert not list((tmp_path / "work").iterdir())
+    assert len(closed) == 1
+
+
+@pytest.mark.parametrize("mode", ["in_memory", "streaming", "index"])
+def test_raw_to_batch_matches_the_three_steps(tmp_path: Path, mode: str) -> None:
+    raw_zip = tmp_path / "Fula ordboken 2024-05-22.zip"
+    with zipfile.ZipFile(raw_zip, "w") as zipf:
+        zipf.writestr("fula_ordboken.txt", SAMPLE.read_text(encoding="utf-8").encode("latin-1"))
+        zipf.writestr("README", b"not an export")
+    steps = tmp_path / "steps"
+    steps.mkdir()
+
+    use_cases.clean_data_and_package(
+        raw_zip,
+        title="test",
+        date_issued="2024-05-22",
+        output_path=steps / "clean.saf.zip",
+        workdir=steps / "work",
+    )
+    clean_file = steps / "fula_ordboken_2024-05-22.txt"
+    with zipfile.ZipFile(steps / "clean.saf.zip") as zipf:
+        clean_file.write_bytes(zipf.read("item_000/fula_ordboken.txt"))
+    use_cases.convert_and_package(
+        clean_file,
+        title="test",
+        date_issued="2024-05-22",
+        json_output=steps / "fula_ordboken.jsonl.gz",
+        saf_output=steps / "processed.saf.zip",
+        workdir=steps / "work",
+    )
+    entries = list(json_arrays.load_from_file(steps / "fula_ordboken.jsonl.gz"))
+    baseline = tmp_path / "baseline.jsonl.gz"
+    json_arrays.dump_to_file(
+        [
+            make_exported(
+                entries[0] | {"text": "<p>Old text.</p>"}, "01HZ0000000000000000000001"
+            ),
+            *(
+                make_exported(entry, f"01HZ{nr:022}")
+                for nr, entry in enumerate(entries[2:], start=2)
+            ),
+            make_exported(make_entry("gone..1", "gone"), "01HZ0000000000000000000099"),
+        ],
+        baseline,
+    )
+    if mode == "index":
+        use_cases.index_baseline(baseline)
+    streaming, use_index = mode == "streaming", mode == "index"
+    use_cases.create_karp_batch_from_export(
+        steps / "fula_ordboken.jsonl.gz",
+        baseline=baseline,
+        output_path=steps / "batch.jsonl.gz",
+        msg="test",
+        streaming=streaming,
+        use_index=use_index,
+    )
+    out = tmp_path / "out"
+
+    use_cases.raw_to_batch(
+        raw_zip,
+        baseline=baseline,
+        msg="test",
+        title="test",
+        date_issued="2024-05-22",
+        clean_saf_output=out / "clean.saf.zip",
+        json_output=out / "fula_ordboken.jsonl.gz",
+        processed_saf_output=out / "processed.saf.zip",
+        batch_output=out / "batch.jsonl.gz",
+        workdir=tmp_path / "work",
+        streaming=streaming,
+        use_index=use_index,
+    )
+
+    for name in ("fula_ordboken.txt", "README"):
+        assert _saf_member(out / "clean.saf.zip", name) == _saf_member(
+            steps / "clean.saf.zip", name
+        )
+    assert list(json_arrays.load_from_file(out / "fula_ordboken.jsonl.gz")) == entries
+    assert _saf_member(out / "processed.saf.zip", "fula_ordboken.jsonl.gz")
+    batch = list(map(_comparable, json_arrays.load_from_file(out / "batch.jsonl.gz")))
+    assert batch == list(map(_comparable, json_arrays.load_from_file(steps / "batch.jsonl.gz")))
+    assert sorted(cmd["cmdtype"] for cmd in batch) == [
+        "add_entry",
+        "delete_entry",
+        "update_entry",
+    ]
+    assert not list((tmp_path / "work").glob("*/*.spill.jsonl"))
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_rebuild_releases_converts_every_release(tmp_path: Path, jobs: int) -> None:
+    raw_files = []
+    for date, part in [("2024-05-22", slice(None)), ("2024-06-01", slice(2, None))]:
+        raw_zip = tmp_path / "raw" / f"Fula ordboken {date}.zip"
+        raw_zip.parent.mkdir(exist_ok=True)
+        records = SAMPLE.read_text(encoding="utf-8").split("%word_word%")[1:][part]
+        with zipfile.ZipFile(raw_zip, "w") as zipf:
+            zipf.writestr(
+                "fula_ordboken.txt",
+                "".join(f"%word_word%{record}" for record in records).encode("latin-1"),
+            )
+        raw_files.append(raw_zip)
+    broken = tmp_path / "raw" / "Fula ordboken 2024-07-01.zip"
+    broken.write_bytes(b"not a zip")
+
+    results = use_cases.rebuild_releases(
+        [raw_files[0], broken, raw_files[1]],
+        output_dir=tmp_path / "data",
+        jobs=jobs,
+        workdir=tmp_path / "work",
+        stage_cache=False,
+        encoding_cache=False,
+    )
+
+    assert [(result.path, result.date_issued) for result in results] == [
+        (raw_files[0], "2024-05-22"),
+        (broken, "2024-07-01"),
+        (raw_files[1], "2024-06-01"),
+    ]
+    assert [result.error for result in results] == [
+        None,
+        "BadZipFile: File is not a zip file",
+        None,
+    ]
+    for raw_zip in raw_files:
+        clean_output, json_output, processed_output = use_cases.release_outputs(
+            raw_zip, tmp_path / "data"
+        )
+        assert clean_output.exists()
+        assert processed_output.exists()
+        steps = tmp_path / "steps" / raw_zip.stem
+        use_cases.clean_data_and_package(
+            raw_zip,
+            title="test",
+            date_issued="2024-05-22",
+            output_path=steps / "clean.saf.zip",
+            workdir=tmp_path / "work",
+        )
+        use_cases.convert_and_package(
+            steps / "clean.saf.zip",
+            title="test",
+            date_issued="2024-05-22",
+            json_output=steps / "fula_ordboken.jsonl.gz",
+            saf_output=steps / "processed.saf.zip",
+            workdir=tmp_path / "work",
+        )
+        assert list(json_arrays.load_from_file(json_output)) == list(
+            json_arrays.load_from_file(steps / "fula_ordboken.jsonl.gz")
+        )
+
+
+def _saf_member(saf: Path, name: str) -> bytes:
+    with zipfile.ZipFile(saf) as zipf:
+        return zipf.read(f"item_000/{name}")
+
+
+def _comparable(cmd: dict) -> dict:
+    """Drop the fields that are generated when a command is created."""
+    generated = {"timestamp", "id"} if cmd["cmdtype"] == "add_entry" else {"timestamp"}
+    return {key: value for key, value in cmd.items() if key not in generated}
+
+
+@pytest.mark.parametrize("mode", ["in_memory", "streaming", "use_index"])
+def test_create_karp_batch_writes_command_ids_as_strings(
+    export_files: tuple[Path, Path], tmp_path: Path, mode: str
+) -> None:
+    current, baseline = export_files
+    output = tmp_path / "batch.jsonl.gz"
+    if mode == "use_index":
+        use_cases.index_baseline(baseline)
+
+    use_cases.create_karp_batch_from_export(
+        current,
+        baseline=baseline,
+        output_path=output,
+        msg="test",
+        streaming=mode == "streaming",
+        use_index=mode == "use_index",
+    )
+
+    cmds = list(json_arrays.load_from_file(output))
+    assert sorted(cmd["cmdtype"] for cmd in cmds) == [
+        "add_entry",
+        "delete_entry",
+        "update_entry",
+    ]
+    assert all(isinstance(cmd["id"], str) for cmd in cmds if "id" in cmd)